@@ -0,0 +1,57 @@
+# Round trip of daemon queries on a reused connection, for a daemon serving a synthetic fat-tree
+#
+#   python benchmarks/bench_daemon.py [--hosts 10000] [--queries 10000] [--target_ms 1.0]
+#
+# Exits with status 1 when the median round trip is above --target_ms
+import argparse
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from ibtopo.daemon import DaemonClient, TopologyDaemon
+from ibtopo.metrics import percentile
+from ibtopo.synthetic import fat_tree, write_fabric
+
+
+def round_trips(socket_path, hosts, queries) -> list:
+    timings = []
+    with DaemonClient(socket_path) as client:
+        for i in range(queries):
+            start = time.perf_counter()
+            client.query('torset', hosts[i % len(hosts)])
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hosts', type=int, default=10000, help='Fat-tree size in hosts (default: 10000)')
+    parser.add_argument('--queries', type=int, default=10000, help='Queries sent on one connection (default: 10000)')
+    parser.add_argument('--target_ms', type=float, default=1.0, help='Highest acceptable median round trip in ms (default: 1.0)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output_dir = Path(tmp)
+        fabric = fat_tree(args.hosts)
+        write_fabric(output_dir, fabric, seed=0)
+        daemon = TopologyDaemon(output_dir, output_dir / 'ibtopo.sock')
+        daemon.start()
+        thread = threading.Thread(target=daemon.serve_forever)
+        thread.start()
+        try:
+            timings = round_trips(daemon.socket_path, fabric.hosts, args.queries)
+        finally:
+            daemon.shutdown()
+            thread.join()
+
+    median = percentile(timings, 50) * 1000
+    print(f"{args.queries} queries  median {median:.3f} ms  p99 {percentile(timings, 99) * 1000:.3f} ms  max {max(timings) * 1000:.3f} ms")
+    if median > args.target_ms:
+        print(f"REGRESSION median round trip {median:.3f} ms above {args.target_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
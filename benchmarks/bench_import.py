@@ -0,0 +1,41 @@
+# Import time of ibtopo and of a parse-only run, each measured in a fresh interpreter
+#
+#   python benchmarks/bench_import.py [--repeat N] [--topology tests/data/topology.txt]
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+CASES = {
+    'python': 'pass',
+    'import ibtopo': 'import ibtopo',
+    'parse topology': 'from ibtopo.topofile import parse_topology; list(parse_topology({topology!r}))',
+    'import networkx': 'import networkx',
+    'import matplotlib.pyplot': 'import matplotlib.pyplot',
+    'import fabric': 'import fabric',
+}
+
+
+def time_case(code, repeat) -> list:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per case (default: 5)')
+    parser.add_argument('--topology', type=str, default='tests/data/topology.txt', help='Topology file for the parse-only case')
+    args = parser.parse_args()
+
+    for name, code in CASES.items():
+        timings = time_case(code.format(topology=args.topology), args.repeat)
+        print(f"{name:<28} median {statistics.median(timings) * 1000:8.1f} ms  min {min(timings) * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+# Wall time and peak traced memory of each topology pipeline phase on synthetic fat-trees
+#
+#   python benchmarks/bench_pipeline.py [--hosts 1000 10000 100000] [--repeat N] [--output results.json]
+#   python benchmarks/bench_pipeline.py --compare baseline.json [--threshold 1.25]
+#
+# Results are written as {"version": 1, "python": ..., "results": {"<hosts>": {"<phase>": {"seconds": ..., "peak_bytes": ...}}}}
+# and --compare exits with status 1 when a phase got slower or bigger than threshold x the baseline
+import argparse
+import gc
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+# Imported up front so the first phase using them is not charged for it, see bench_import.py
+import matplotlib.pyplot  # noqa: F401
+import networkx  # noqa: F401
+import numpy  # noqa: F401
+
+from ibtopo import IBTopology
+from ibtopo.distances import DistanceMatrix
+from ibtopo.placement import PlacementIndex
+from ibtopo.synthetic import fat_tree, write_fabric
+
+RESULTS_VERSION = 1
+# Phases faster than this are too noisy to flag as regressions
+MIN_SECONDS = 0.01
+MIN_PEAK_BYTES = 1024 * 1024
+
+
+def load_snapshot(topology):
+    IBTopology.from_snapshot(topology.output_dir / 'topology.snapshot')
+
+
+def place(topology):
+    # A job of a tenth of the hosts while every torset is partly allocated, so it spans many torsets
+    index = PlacementIndex(topology.torsets, DistanceMatrix.load(topology.output_dir, 'torset'))
+    free_hosts = [host for i, hosts in enumerate(topology.torsets.values()) for host in hosts[i % 5:]]
+    index.place(len(topology.host_ip_to_torset) // 10, free_hosts)
+
+
+def draw_aggregate(topology):
+    # Without a cached layout, so every run computes it
+    (topology.output_dir / 'topology_layout_aggregate.json').unlink(missing_ok=True)
+    topology.draw_topology('aggregate')
+
+
+PHASES = {
+    'load_topology': lambda topology: topology.load_topology(),
+    'load_topology_compact': lambda topology: topology.load_topology(compact=True),
+    'identify_torsets': lambda topology: setattr(topology, 'host_ip_to_torset', topology.identify_torsets()),
+    'group_hosts_by_torset': lambda topology: setattr(topology, 'torsets', topology.group_hosts_by_torset()),
+    'write_hosts_by_torset': lambda topology: topology.write_hosts_by_torset(),
+    'write_torset_outputs': lambda topology: topology.write_torset_outputs(),
+    'write_distance_matrices': lambda topology: topology.write_distance_matrices(),
+    'place': place,
+    'save_snapshot': lambda topology: topology.save_snapshot(),
+    'load_snapshot': load_snapshot,
+    'draw_aggregate': draw_aggregate,
+}
+
+
+def run_pipeline(output_dir, fabric, phases, trace_memory) -> dict:
+    topology = IBTopology(output_dir, output_dir / 'hosts.txt', 'sharp_cmd')
+    topology.guid_to_host_ip = fabric.guid_to_host_ip
+    results = {}
+    for name in phases:
+        gc.collect()
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        PHASES[name](topology)
+        results[name] = {'seconds': time.perf_counter() - start}
+        if trace_memory:
+            results[name]['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    if len(topology.torsets) != len(fabric.torsets):
+        raise RuntimeError(f"Expected {len(fabric.torsets)} torsets, found {len(topology.torsets)}")
+    return results
+
+
+def bench(hosts, repeat, draw_max_hosts, trace_memory) -> dict:
+    phases = [name for name in PHASES if name != 'draw_aggregate' or hosts <= draw_max_hosts]
+    with tempfile.TemporaryDirectory() as tmp:
+        output_dir = Path(tmp)
+        start = time.perf_counter()
+        fabric = fat_tree(hosts)
+        write_fabric(output_dir, fabric, seed=0)
+        generate_seconds = time.perf_counter() - start
+
+        runs = [run_pipeline(output_dir, fabric, phases, trace_memory=False) for _ in range(repeat)]
+        results = {'generate': {'seconds': generate_seconds}}
+        for name in phases:
+            results[name] = {'seconds': statistics.median(run[name]['seconds'] for run in runs)}
+        # tracemalloc slows allocation heavy code down, so memory is measured in a separate run
+        if trace_memory:
+            for name, result in run_pipeline(output_dir, fabric, phases, trace_memory=True).items():
+                results[name]['peak_bytes'] = result['peak_bytes']
+    return results
+
+
+def compare(results, baseline, threshold) -> list:
+    # (hosts, phase, metric, baseline, current) for every regression beyond threshold
+    regressions = []
+    for hosts, phases in results['results'].items():
+        for name, metrics in phases.items():
+            base = baseline['results'].get(hosts, {}).get(name)
+            if base is None:
+                continue
+            for metric, floor in (('seconds', MIN_SECONDS), ('peak_bytes', MIN_PEAK_BYTES)):
+                if metric not in metrics or metric not in base:
+                    continue
+                if metrics[metric] > max(base[metric], floor) * threshold:
+                    regressions.append((hosts, name, metric, base[metric], metrics[metric]))
+    return regressions
+
+
+def print_results(results, baseline=None) -> None:
+    for hosts, phases in results['results'].items():
+        print(f"{hosts} hosts")
+        for name, metrics in phases.items():
+            line = f"  {name:<26} {metrics['seconds'] * 1000:10.1f} ms"
+            if 'peak_bytes' in metrics:
+                line += f" {metrics['peak_bytes'] / 2 ** 20:10.1f} MiB"
+            base = baseline['results'].get(hosts, {}).get(name) if baseline else None
+            if base is not None:
+                line += f"   x{metrics['seconds'] / base['seconds']:.2f} time"
+                if 'peak_bytes' in metrics and base.get('peak_bytes'):
+                    line += f" x{metrics['peak_bytes'] / base['peak_bytes']:.2f} memory"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hosts', type=int, nargs='+', default=[1000, 10000, 100000], help='Fat-tree sizes in hosts (default: 1000 10000 100000)')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per size, the median is reported (default: 3)')
+    parser.add_argument('--draw_max_hosts', type=int, default=10000, help='Largest size the aggregate drawing is timed for (default: 10000)')
+    parser.add_argument('--no_memory', action='store_true', help='Do not measure peak memory with tracemalloc')
+    parser.add_argument('--output', type=str, default=None, help='Write results as JSON to this file')
+    parser.add_argument('--compare', type=str, default=None, help='Baseline results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25, help='Ratio to the baseline reported as a regression (default: 1.25)')
+    args = parser.parse_args()
+
+    results = {
+        'version': RESULTS_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': {str(hosts): bench(hosts, args.repeat, args.draw_max_hosts, not args.no_memory) for hosts in args.hosts},
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if baseline:
+        regressions = compare(results, baseline, args.threshold)
+        for hosts, name, metric, base, current in regressions:
+            print(f"REGRESSION {hosts} hosts {name} {metric}: {base:.4g} -> {current:.4g}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
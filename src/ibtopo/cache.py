@@ -0,0 +1,72 @@
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+# GUIDs only change when an HCA is replaced, so a day is a conservative default
+DEFAULT_TTL = 24 * 60 * 60
+CACHE_VERSION = 1
+
+
+class GuidCache:
+    # Persisted host -> GUIDs map, keyed by the entries of the hosts file
+    # {"version": 1, "hosts": {"10.193.0.4": {"guids": [...], "timestamp": 1700000000.0, "ok": true}}}
+    def __init__(self, path: Path, ttl: float = DEFAULT_TTL):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.entries = self._load()
+
+    def _load(self) -> dict:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable GUID cache {self.path}: {e}")
+            return {}
+        if data.get('version') != CACHE_VERSION:
+            logging.warning(f"Ignoring GUID cache {self.path} with unsupported version {data.get('version')}")
+            return {}
+        return data.get('hosts', {})
+
+    def stale_hosts(self, hosts, now=None) -> list:
+        # Hosts that are new, expired or failed the last time they were queried
+        now = time.time() if now is None else now
+        stale = []
+        for host in hosts:
+            entry = self.entries.get(host)
+            if entry is None or not entry['ok'] or now - entry['timestamp'] >= self.ttl:
+                stale.append(host)
+        return stale
+
+    def update(self, host, guids, now=None) -> None:
+        # guids is None when the host could not be queried
+        self.entries[host] = {
+            'guids': guids if guids is not None else [],
+            'timestamp': time.time() if now is None else now,
+            'ok': guids is not None,
+        }
+
+    def guids(self, host) -> list:
+        entry = self.entries.get(host)
+        return entry['guids'] if entry is not None else []
+
+    def guid_to_host(self, hosts=None) -> dict:
+        # guid -> host for the given hosts (default: every cached host), like IBTopology.fetch_guids.
+        # GUIDs are normalized as caches written by earlier versions kept them in ibstat form
+        from .topo import normalize_guid
+
+        guids = {}
+        for host in self.entries if hosts is None else hosts:
+            for guid in self.guids(host):
+                guids[normalize_guid(guid)] = host
+        return guids
+
+    def save(self) -> None:
+        # Write to a temporary file and rename so a crash never leaves a truncated cache behind
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'hosts': self.entries}, f)
+        os.replace(tmp_path, self.path)
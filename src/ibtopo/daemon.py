@@ -0,0 +1,294 @@
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import threading
+import time
+from pathlib import Path
+
+from .diff import FabricState, diff_topology, update_torsets
+from .output import TORSETS_FILE
+from .topo import IBTopology, normalize_guid, read_guid_map, read_torsets
+from .topofile import read_topology
+
+# Seconds between checks of topology.txt, torsets.json, the snapshot and the GUID cache for changes
+POLL_INTERVAL = 2.0
+SOCKET_NAME = 'ibtopo.sock'
+# Used when XDG_RUNTIME_DIR is not set, e.g. for a daemon started by systemd as root
+RUN_DIR = Path('/run/ibtopo')
+QUERY_TIMEOUT = 5.0
+
+
+class QueryError(Exception):
+    # The daemon could not answer a query (unknown host, torset or GUID, bad command)
+    pass
+
+
+class DaemonError(Exception):
+    # Another daemon is already listening on the socket, or the socket path is not a socket
+    pass
+
+
+def default_socket_path() -> Path:
+    # A Unix socket only works on the node that created it, so it is never put in the output
+    # directory, which is usually on a filesystem shared by every node
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    return Path(runtime_dir) / 'ibtopo' / SOCKET_NAME if runtime_dir else RUN_DIR / SOCKET_NAME
+
+
+class TopologyIndex:
+    # Lookup tables for one version of the fabric: host -> torset, torset -> hosts and GUID -> host.
+    # A reload builds a new index and swaps it in, so a query never sees a half updated index
+    def __init__(self, topology: IBTopology, generation: int = 1):
+        self.topology = topology
+        self.host_torset = topology.host_ip_to_torset
+        self.torset_hosts = topology.torsets
+        self.guid_host = topology.guid_to_host_ip
+        self.generation = generation
+        self.loaded_at = time.time()
+
+    def fabric_state(self) -> FabricState:
+        return FabricState(self.topology.device_guids_per_switch, self.topology.switch_links, self.guid_host)
+
+    def answer(self, request: str) -> dict:
+        # 'torset <host>', 'hosts <torset>', 'host <guid>', 'torsets' or 'status'
+        command, *args = request.split() or ['']
+        if command == 'torset' and len(args) == 1:
+            if args[0] not in self.host_torset:
+                raise QueryError(f"Unknown host {args[0]}")
+            return {'torset': self.host_torset[args[0]]}
+        if command == 'hosts' and len(args) == 1:
+            if args[0] not in self.torset_hosts:
+                raise QueryError(f"Unknown torset {args[0]}")
+            return {'hosts': self.torset_hosts[args[0]]}
+        if command == 'host' and len(args) == 1:
+            try:
+                guid = normalize_guid(args[0])
+            except ValueError:
+                raise QueryError(f"Invalid GUID {args[0]}")
+            if guid not in self.guid_host:
+                raise QueryError(f"Unknown GUID {args[0]}")
+            return {'host': self.guid_host[guid]}
+        if command == 'torsets' and not args:
+            return {'torsets': {torset: len(hosts) for torset, hosts in self.torset_hosts.items()}}
+        if command == 'status' and not args:
+            return {'generation': self.generation, 'loaded_at': self.loaded_at, 'hosts': len(self.host_torset),
+                    'torsets': len(self.torset_hosts), 'guids': len(self.guid_host)}
+        raise QueryError(f"Invalid query {request.strip()!r}")
+
+
+def load_fabric(output_dir: Path, guid_cache: Path = None) -> FabricState:
+    # Switches from topology.txt, GUIDs from topology.snapshot or the GUID cache, see topo.read_guid_map
+    guid_to_host_ip = read_guid_map(output_dir, guid_cache)
+    if not guid_to_host_ip:
+        logging.warning(f"No GUIDs in {output_dir}: neither topology.snapshot nor the GUID cache has any, GUID lookups will fail")
+    return FabricState(*read_topology(Path(output_dir) / 'topology.txt'), guid_to_host_ip)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    # One query per line and one JSON answer per line, until the client closes the connection
+    def handle(self):
+        for line in self.rfile:
+            index = self.server.topology_daemon.index
+            try:
+                response = index.answer(line.decode())
+            except QueryError as e:
+                response = {'error': str(e)}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class TopologyDaemon:
+    # Serves a TopologyIndex of an output directory on a Unix socket and rebuilds it when
+    # topology.txt, torsets.json, the snapshot or the GUID cache change. Torset IDs are read from torsets.json (or
+    # the torset files of the run) at start and whenever torsets.json is rewritten, and otherwise
+    # kept stable across reloads like `ibtopo update` does
+    def __init__(self, output_dir: Path, socket_path: Path = None, guid_cache: Path = None, poll_interval: float = POLL_INTERVAL):
+        self.output_dir = Path(output_dir)
+        self.topo_file = self.output_dir / 'topology.txt'
+        self.guid_cache = Path(guid_cache) if guid_cache else self.output_dir / 'guid_cache.json'
+        self.torsets_file = self.output_dir / TORSETS_FILE
+        self.snapshot_file = self.output_dir / 'topology.snapshot'
+        self.socket_path = Path(socket_path) if socket_path else default_socket_path()
+        self.poll_interval = poll_interval
+        self.index = None
+        self.server = None
+        self._signature = None
+        self._stop = threading.Event()
+
+    def _file_signature(self) -> tuple:
+        signature = []
+        for path in (self.topo_file, self.guid_cache, self.torsets_file, self.snapshot_file):
+            try:
+                info = path.stat()
+            except FileNotFoundError:
+                signature.append(None)
+                continue
+            signature.append((info.st_mtime_ns, info.st_size, info.st_ino))
+        return tuple(signature)
+
+    def reload(self) -> TopologyIndex:
+        signature = self._file_signature()
+        state = load_fabric(self.output_dir, self.guid_cache)
+        topology = IBTopology.from_state(state.device_guids_per_switch, state.switch_links, state.guid_to_host_ip)
+        # A rewritten torsets.json (a new run or `ibtopo update`) replaces the torset IDs of the index
+        torsets_changed = self._signature is not None and signature[2] not in (None, self._signature[2])
+        if self.index is not None and not torsets_changed:
+            old = self.index.fabric_state()
+            topology.host_ip_to_torset, changes = update_torsets(old, state, self.index.host_torset, diff_topology(old, state))
+            if changes:
+                logging.info(f"{len(changes)} hosts changed torset")
+        else:
+            torsets = read_torsets(self.output_dir)
+            if torsets:
+                topology.host_ip_to_torset = {host_ip: torset for torset, hosts in torsets.items() for host_ip in hosts}
+            else:
+                topology.host_ip_to_torset = topology.identify_torsets()
+        topology.torsets = topology.group_hosts_by_torset()
+
+        generation = self.index.generation + 1 if self.index is not None else 1
+        self.index = TopologyIndex(topology, generation)
+        self._signature = signature
+        logging.info(f"Loaded generation {generation}: {len(topology.host_ip_to_torset)} hosts in {len(topology.torsets)} torsets")
+        return self.index
+
+    def _watch(self) -> None:
+        # A change is only loaded once the files were the same for two checks in a row, so a file
+        # that is still being written is not loaded half way
+        pending = None
+        while not self._stop.wait(self.poll_interval):
+            signature = self._file_signature()
+            if signature == self._signature:
+                pending = None
+                continue
+            if signature != pending:
+                pending = signature
+                continue
+            pending = None
+            try:
+                self.reload()
+            except Exception as e:
+                logging.warning(f"Reload of {self.output_dir} failed, still serving generation {self.index.generation}: {e}")
+
+    def _remove_stale_socket(self) -> None:
+        # Only a socket nothing listens on is removed, as left behind by a daemon that was killed
+        try:
+            mode = self.socket_path.lstat().st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise DaemonError(f"{self.socket_path} exists and is not a socket")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(str(self.socket_path))
+            except ConnectionRefusedError:
+                self.socket_path.unlink()
+                return
+            except OSError as e:
+                raise DaemonError(f"Cannot check for a daemon listening on {self.socket_path}: {e}")
+        raise DaemonError(f"A daemon is already listening on {self.socket_path}")
+
+    def start(self) -> None:
+        # Load the index, bind the socket and start watching the files, serve_forever answers queries
+        self.reload()
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        self._remove_stale_socket()
+        self.server = _Server(str(self.socket_path), _RequestHandler)
+        self.server.topology_daemon = self
+        threading.Thread(target=self._watch, daemon=True).start()
+        logging.info(f"Listening on {self.socket_path}")
+
+    def serve_forever(self) -> None:
+        try:
+            self.server.serve_forever()
+        finally:
+            self._stop.set()
+            self.server.server_close()
+            self.socket_path.unlink(missing_ok=True)
+
+    def shutdown(self) -> None:
+        # From another thread, makes serve_forever return
+        self.server.shutdown()
+
+
+class DaemonClient:
+    # Connection to a TopologyDaemon that can be reused for any number of queries
+    def __init__(self, socket_path: Path, timeout: float = QUERY_TIMEOUT):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(str(socket_path))
+        self.file = self.sock.makefile('rb')
+
+    def query(self, command: str, *args) -> dict:
+        self.sock.sendall(' '.join((command,) + args).encode() + b'\n')
+        line = self.file.readline()
+        if not line:
+            raise QueryError("Daemon closed the connection")
+        response = json.loads(line)
+        if 'error' in response:
+            raise QueryError(response['error'])
+        return response
+
+    def close(self) -> None:
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def query(socket_path: Path, command: str, *args) -> dict:
+    with DaemonClient(socket_path) as client:
+        return client.query(command, *args)
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(prog='ibtopo daemon', description='Serve torset and GUID lookups for an output directory over a Unix socket')
+    parser.add_argument('output_dir', type=str, help='Output directory of an ibtopo run')
+    parser.add_argument('--socket', type=str, default=None, help=f'Path of the Unix socket, on a node local filesystem (default: $XDG_RUNTIME_DIR/ibtopo/{SOCKET_NAME} or {RUN_DIR / SOCKET_NAME})')
+    parser.add_argument('--guid_cache', type=str, default=None, help='GUID cache file, read when the output directory has no topology.snapshot (default: <output_dir>/guid_cache.json)')
+    parser.add_argument('--poll_interval', type=float, default=POLL_INTERVAL, help=f'Seconds between checks for a changed topology file or GUID cache (default: {POLL_INTERVAL})')
+    args = parser.parse_args(argv)
+
+    daemon = TopologyDaemon(Path(args.output_dir), args.socket, args.guid_cache, args.poll_interval)
+    daemon.start()
+    # SIGTERM unwinds serve_forever like Ctrl-C so the socket file is removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def query_cli(argv=None):
+    parser = argparse.ArgumentParser(prog='ibtopo query', description='Query a running ibtopo daemon')
+    parser.add_argument('socket', type=str, help='Path of the Unix socket of the daemon')
+    parser.add_argument('command', choices=['torset', 'hosts', 'host', 'torsets', 'status'],
+                        help='torset <host>, hosts <torset>, host <guid>, torsets or status')
+    parser.add_argument('args', nargs='*', help='Host, torset or GUID')
+    args = parser.parse_args(argv)
+
+    try:
+        response = query(Path(args.socket), args.command, *args.args)
+    except (OSError, QueryError) as e:
+        print(f"ibtopo query: {e}", file=sys.stderr)
+        sys.exit(1)
+    # Plain values for shell scripts, one host per line for 'hosts'
+    value = response if len(response) != 1 else next(iter(response.values()))
+    if isinstance(value, list):
+        print('\n'.join(value))
+    elif isinstance(value, dict):
+        print(json.dumps(value, indent=2))
+    else:
+        print(value)
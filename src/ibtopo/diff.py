@@ -0,0 +1,249 @@
+import argparse
+import json
+import logging
+import shutil
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from .cache import GuidCache
+from .output import SLURM_TOPOLOGY_FILE, atomic_open, write_slurm_topology, write_torset_map
+from .topo import IBTopology, UnionFind, read_guid_map, read_torsets, write_torsets
+from .topofile import read_topology
+
+
+class UpdateError(Exception):
+    # The results of the previous run cannot be updated, e.g. no GUID to host map to apply the change to
+    pass
+
+
+@dataclass
+class FabricState:
+    # What a run knows about the fabric: leaf switch GUIDs and switch links from topology.txt,
+    # and the GUIDs of every host
+    device_guids_per_switch: dict
+    switch_links: dict
+    guid_to_host_ip: dict
+
+
+@dataclass
+class TopologyDiff:
+    added_switches: list = field(default_factory=list)
+    removed_switches: list = field(default_factory=list)
+    # Links as [switch, switch] pairs in sorted order
+    added_links: list = field(default_factory=list)
+    removed_links: list = field(default_factory=list)
+    # GUIDs attached to (or gone from) a leaf switch
+    added_guids: list = field(default_factory=list)
+    removed_guids: list = field(default_factory=list)
+    # guid -> [old leaf switch, new leaf switch]
+    moved_guids: dict = field(default_factory=dict)
+    # guid -> [old host, new host], None when the GUID was not known
+    changed_guid_hosts: dict = field(default_factory=dict)
+
+    def is_empty(self) -> bool:
+        return not any(asdict(self).values())
+
+
+def _switches(state: FabricState) -> set:
+    switches = set(state.device_guids_per_switch)
+    for switch, connected_switches in state.switch_links.items():
+        switches.add(switch)
+        switches.update(connected_switches)
+    return switches
+
+
+def _links(state: FabricState) -> set:
+    return {tuple(sorted((switch, conn_switch))) for switch, connected_switches in state.switch_links.items()
+            for conn_switch in connected_switches if switch != conn_switch}
+
+
+def _leaf_of_guid(state: FabricState) -> dict:
+    return {guid: switch for switch, guids in state.device_guids_per_switch.items() for guid in guids}
+
+
+def diff_topology(old: FabricState, new: FabricState) -> TopologyDiff:
+    old_switches, new_switches = _switches(old), _switches(new)
+    old_links, new_links = _links(old), _links(new)
+    old_leaf, new_leaf = _leaf_of_guid(old), _leaf_of_guid(new)
+    guid_hosts = {}
+    for guid in old.guid_to_host_ip.keys() | new.guid_to_host_ip.keys():
+        old_host, new_host = old.guid_to_host_ip.get(guid), new.guid_to_host_ip.get(guid)
+        if old_host != new_host:
+            guid_hosts[guid] = [old_host, new_host]
+    return TopologyDiff(
+        added_switches=sorted(new_switches - old_switches),
+        removed_switches=sorted(old_switches - new_switches),
+        added_links=[list(link) for link in sorted(new_links - old_links)],
+        removed_links=[list(link) for link in sorted(old_links - new_links)],
+        added_guids=sorted(new_leaf.keys() - old_leaf.keys()),
+        removed_guids=sorted(old_leaf.keys() - new_leaf.keys()),
+        moved_guids={guid: [old_leaf[guid], new_leaf[guid]] for guid in sorted(old_leaf.keys() & new_leaf.keys()) if old_leaf[guid] != new_leaf[guid]},
+        changed_guid_hosts=dict(sorted(guid_hosts.items())),
+    )
+
+
+def _torset_number(torset) -> int:
+    try:
+        return int(torset.rsplit('-', 1)[1])
+    except (IndexError, ValueError):
+        return -1
+
+
+def update_torsets(old: FabricState, new: FabricState, host_ip_to_torset: dict, diff: TopologyDiff) -> tuple:
+    # Re-assign torsets only around the change: hosts touched by the diff, every host of their old
+    # torsets and whatever the new topology connects them to. Everything else keeps its torset, and
+    # re-computed torsets keep the old ID that most of their hosts had
+    # Returns (new host_ip_to_torset, {host: [old torset, new torset]})
+    guids = set(diff.added_guids) | set(diff.removed_guids) | set(diff.moved_guids) | set(diff.changed_guid_hosts)
+    for switch in diff.added_switches + diff.removed_switches:
+        guids.update(old.device_guids_per_switch.get(switch, ()))
+        guids.update(new.device_guids_per_switch.get(switch, ()))
+    seeds = {state.guid_to_host_ip[guid] for state in (old, new) for guid in guids if guid in state.guid_to_host_ip}
+    if not seeds:
+        return dict(host_ip_to_torset), {}
+
+    old_members = {}
+    for host_ip, torset in host_ip_to_torset.items():
+        old_members.setdefault(torset, []).append(host_ip)
+    new_host_guids = {}
+    for guid, host_ip in new.guid_to_host_ip.items():
+        new_host_guids.setdefault(host_ip, []).append(guid)
+    # Only the GUIDs of the region are looked up, but a full guid -> leaf map is cheaper than a scan per GUID
+    new_leaf = _leaf_of_guid(new)
+
+    region = set()
+    affected_torsets = set()
+    queue = []
+
+    def visit(host_ip):
+        if host_ip in region:
+            return
+        region.add(host_ip)
+        queue.append(host_ip)
+        torset = host_ip_to_torset.get(host_ip)
+        if torset is not None and torset not in affected_torsets:
+            affected_torsets.add(torset)
+            for member in old_members[torset]:
+                visit(member)
+
+    for host_ip in sorted(seeds):
+        visit(host_ip)
+    components = UnionFind()
+    seen_leaves = set()
+    while queue:
+        host_ip = queue.pop()
+        for guid in new_host_guids.get(host_ip, ()):
+            leaf = new_leaf.get(guid)
+            if leaf is None or leaf in seen_leaves:
+                continue
+            seen_leaves.add(leaf)
+            leaf_hosts = [new.guid_to_host_ip[g] for g in new.device_guids_per_switch[leaf] if g in new.guid_to_host_ip]
+            components.union_all(leaf_hosts)
+            for other in leaf_hosts:
+                visit(other)
+
+    groups = {}
+    for host_ip in components.parent:
+        groups.setdefault(components.find(host_ip), []).append(host_ip)
+
+    # Largest components pick their old ID first, new IDs continue after the highest ID in use
+    next_number = max(map(_torset_number, host_ip_to_torset.values()), default=-1) + 1
+    taken = set()
+    assignment = {}
+    for hosts in sorted(groups.values(), key=lambda hosts: (-len(hosts), min(hosts))):
+        votes = Counter(host_ip_to_torset[host_ip] for host_ip in hosts if host_ip in host_ip_to_torset)
+        torset = next((torset for torset, _ in sorted(votes.items(), key=lambda item: (-item[1], item[0])) if torset not in taken), None)
+        if torset is None:
+            torset = f"torset-{next_number:02}"
+            next_number += 1
+        taken.add(torset)
+        for host_ip in hosts:
+            assignment[host_ip] = torset
+
+    updated = {host_ip: torset for host_ip, torset in host_ip_to_torset.items() if host_ip not in region}
+    changes = {}
+    for host_ip in sorted(region):
+        old_torset, new_torset = host_ip_to_torset.get(host_ip), assignment.get(host_ip)
+        if new_torset is not None:
+            updated[host_ip] = new_torset
+        if old_torset != new_torset:
+            changes[host_ip] = [old_torset, new_torset]
+    return updated, changes
+
+
+def change_log(diff: TopologyDiff, old_torsets, new_torsets, changes: dict) -> dict:
+    log = asdict(diff)
+    log['torset_changes'] = changes
+    log['added_torsets'] = sorted(set(new_torsets) - set(old_torsets))
+    log['removed_torsets'] = sorted(set(old_torsets) - set(new_torsets))
+    return log
+
+
+def update_output_dir(output_dir: Path, new_topo_file: Path, new_guid_cache: Path = None) -> dict:
+    # Apply a new topology file (and GUID cache) to the results of a previous run in output_dir.
+    # torsets.json, topology.txt, guid_cache.json, and the per-torset files, topology.conf, topology.snapshot
+    # and hop distance matrices when the run wrote them, are updated and the change log is written to changes.json
+    # Without GUIDs no change can be tied to a host, so an UpdateError is raised instead of a no-op update
+    output_dir = Path(output_dir)
+    torsets = read_torsets(output_dir)
+    host_ip_to_torset = {host_ip: torset for torset, hosts in torsets.items() for host_ip in hosts}
+    old_guids = read_guid_map(output_dir)
+    if not old_guids:
+        raise UpdateError(f"No GUID to host map in {output_dir}: neither topology.snapshot nor guid_cache.json has any GUIDs")
+    new_guids = GuidCache(new_guid_cache).guid_to_host() if new_guid_cache else old_guids
+    if not new_guids:
+        raise UpdateError(f"No GUIDs in {new_guid_cache}")
+    old = FabricState(*read_topology(output_dir / 'topology.txt'), old_guids)
+    new = FabricState(*read_topology(new_topo_file), new_guids)
+
+    diff = diff_topology(old, new)
+    updated, changes = update_torsets(old, new, host_ip_to_torset, diff)
+    new_torsets = {}
+    for host_ip, torset in updated.items():
+        new_torsets.setdefault(torset, []).append(host_ip)
+    new_torsets = dict(sorted(new_torsets.items(), key=lambda item: _torset_number(item[0])))
+
+    write_torset_map(output_dir, new_torsets)
+    if any(output_dir.glob('torset-*_hosts.txt')):
+        for torset in set(torsets) - set(new_torsets):
+            (output_dir / f"{torset}_hosts.txt").unlink(missing_ok=True)
+        write_torsets(output_dir, {torset: hosts for torset, hosts in new_torsets.items() if hosts != torsets.get(torset)})
+    if (output_dir / SLURM_TOPOLOGY_FILE).exists():
+        write_slurm_topology(output_dir, new.device_guids_per_switch, new.switch_links, new.guid_to_host_ip, updated)
+    snapshot_path = output_dir / 'topology.snapshot'
+    if snapshot_path.exists():
+        topology = IBTopology.from_snapshot(snapshot_path)
+        topology.device_guids_per_switch, topology.switch_links = new.device_guids_per_switch, new.switch_links
+        topology.guid_to_host_ip = new.guid_to_host_ip
+        topology.host_ip_to_torset = updated
+        topology.spanning_hosts = [host_ip for host_ip in topology.spanning_hosts if host_ip in updated]
+        topology.save_snapshot(snapshot_path)
+    # Copied atomically, a daemon watching the output directory never reads a partial file
+    for new_file, name in ((new_topo_file, 'topology.txt'), (new_guid_cache, 'guid_cache.json')):
+        if new_file and Path(new_file).resolve() != (output_dir / name).resolve():
+            with open(new_file, 'rb') as src, atomic_open(output_dir / name, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+
+    from .distances import DistanceMatrix, leaf_distances, torset_distances
+
+    if DistanceMatrix.exists(output_dir, 'torset') and not diff.is_empty():
+        leaf_matrix = leaf_distances(new.device_guids_per_switch, new.switch_links)
+        leaf_matrix.save(output_dir, 'leaf')
+        torset_distances(leaf_matrix, new.device_guids_per_switch, new.guid_to_host_ip, updated).save(output_dir, 'torset')
+
+    log = change_log(diff, torsets, new_torsets, changes)
+    with atomic_open(output_dir / 'changes.json') as f:
+        json.dump(log, f, indent=2)
+    logging.info(f"{len(changes)} hosts changed torset, {len(log['added_torsets'])} torsets added, {len(log['removed_torsets'])} removed")
+    return log
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(prog='ibtopo update', description='Update the results of a previous run for a changed fabric, keeping torset IDs stable')
+    parser.add_argument('output_dir', type=str, help='Output directory of a previous ibtopo run')
+    parser.add_argument('topology', type=str, help='New topology file generated by sharp_cmd')
+    parser.add_argument('--guid_cache', type=str, default=None, help='New GUID cache file (default: the GUIDs of the previous run)')
+    args = parser.parse_args(argv)
+
+    update_output_dir(Path(args.output_dir), Path(args.topology), Path(args.guid_cache) if args.guid_cache else None)
@@ -0,0 +1,106 @@
+from pathlib import Path
+
+import numpy as np
+
+from .graph import FabricGraph
+from .output import atomic_open
+from .topo import leaf_torsets
+from .topofile import SWITCHES, TopologyRecord
+
+# Stored for pairs of leaves (or torsets) that are not connected through switch links
+UNREACHABLE = 255
+# Bytes of leaf matrix rows torset_distances works on at a time
+LEAF_BLOCK_BYTES = 64 * 1024 * 1024
+
+
+class DistanceMatrix:
+    # Dense uint8 hop distance matrix with the names of its rows/columns
+    # - Stored as <name>_distances.npy and <name>_distances_index.txt (one name per line, row order)
+    #   so schedulers can np.load(mmap_mode='r') it without parsing the topology again
+    def __init__(self, names: list, matrix: np.ndarray):
+        self.names = names
+        self.matrix = matrix
+        self.index = {name: i for i, name in enumerate(names)}
+
+    def distance(self, a, b) -> int:
+        if a == b:
+            return 0
+        i, j = self.index.get(a), self.index.get(b)
+        if i is None or j is None:
+            return UNREACHABLE
+        return int(self.matrix[i, j])
+
+    def save(self, output_dir: Path, name: str) -> None:
+        # Replaced atomically: readers may have the previous matrix mapped, and truncating a mapped
+        # file in place kills them with SIGBUS
+        with atomic_open(Path(output_dir) / f'{name}_distances.npy', 'wb') as f:
+            np.save(f, self.matrix)
+        with atomic_open(Path(output_dir) / f'{name}_distances_index.txt') as f:
+            f.write(''.join(f"{row_name}\n" for row_name in self.names))
+
+    @classmethod
+    def load(cls, output_dir: Path, name: str, mmap_mode: str = 'r') -> 'DistanceMatrix':
+        with open(Path(output_dir) / f'{name}_distances_index.txt', 'r') as f:
+            names = [row_name.strip() for row_name in f]
+        return cls(names, np.load(Path(output_dir) / f'{name}_distances.npy', mmap_mode=mmap_mode))
+
+    @staticmethod
+    def exists(output_dir: Path, name: str) -> bool:
+        return (Path(output_dir) / f'{name}_distances.npy').exists() and (Path(output_dir) / f'{name}_distances_index.txt').exists()
+
+
+def leaf_distances(device_guids_per_switch, switch_links) -> DistanceMatrix:
+    # Switch hops between every pair of leaf switches, one BFS per leaf over the Switches= links
+    graph = FabricGraph()
+    for leaf in device_guids_per_switch:
+        graph.add_record(TopologyRecord(leaf, SWITCHES, []))
+    for switch, connected_switches in switch_links.items():
+        graph.add_record(TopologyRecord(switch, SWITCHES, connected_switches))
+    graph.finalize()
+
+    leaves = list(device_guids_per_switch)
+    # Leaves were added first, so their vertex ids are 0..len(leaves)-1
+    # - Leaves with the same set of neighbor switches (e.g. every leaf of a pod uplinked to the same
+    #   spines) are the same distance from every other switch and 2 hops from each other, so one
+    #   BFS per distinct neighbor set is enough
+    groups = {}
+    for row in range(len(leaves)):
+        groups.setdefault(graph.neighbors(row).tobytes(), []).append(row)
+    matrix = np.full((len(leaves), len(leaves)), UNREACHABLE, dtype=np.uint8)
+    for neighbors, rows in groups.items():
+        if not neighbors:
+            # Leaves without uplinks only reach themselves
+            matrix[rows, rows] = 0
+            continue
+        hops = graph.bfs(rows[0])[:len(leaves)]
+        reachable = hops >= 0
+        distances = np.where(reachable, np.minimum(hops, UNREACHABLE - 1), UNREACHABLE).astype(np.uint8)
+        distances[rows] = 2
+        matrix[rows] = distances
+        matrix[rows, rows] = 0
+    return DistanceMatrix(leaves, matrix)
+
+
+def torset_distances(leaf_matrix: DistanceMatrix, device_guids_per_switch, guid_to_host_ip, host_ip_to_torset) -> DistanceMatrix:
+    # Switch hops between the closest leaf switches of every pair of torsets
+    torset_of_leaf = leaf_torsets(device_guids_per_switch, guid_to_host_ip, host_ip_to_torset)
+    torsets = list(dict.fromkeys(torset_of_leaf.values()))
+    if not torsets:
+        return DistanceMatrix([], np.empty((0, 0), dtype=np.uint8))
+    torset_index = {torset: i for i, torset in enumerate(torsets)}
+    # Group leaf rows by torset so the minimum over each group is a single reduceat
+    rows = sorted((torset_index[torset_of_leaf[leaf]], leaf_matrix.index[leaf]) for leaf in torset_of_leaf)
+    groups = np.array([group for group, _ in rows])
+    order = np.array([row for _, row in rows])
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    ends = np.r_[starts[1:], len(order)]
+    # Torsets are reduced a block at a time so no copy of the whole leaf matrix is made
+    block = max(1, LEAF_BLOCK_BYTES // (leaf_matrix.matrix.shape[1] * int((ends - starts).max())))
+    matrix = np.empty((len(torsets), len(torsets)), dtype=np.uint8)
+    for first in range(0, len(torsets), block):
+        last = min(first + block, len(torsets))
+        leaf_rows = leaf_matrix.matrix[order[starts[first]:ends[last - 1]]]
+        torset_rows = np.minimum.reduceat(leaf_rows, starts[first:last] - starts[first], axis=0)
+        matrix[first:last] = np.minimum.reduceat(torset_rows[:, order], starts, axis=1)
+    np.fill_diagonal(matrix, 0)
+    return DistanceMatrix(torsets, matrix)
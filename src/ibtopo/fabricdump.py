@@ -0,0 +1,134 @@
+import ipaddress
+import logging
+import re
+import socket
+import subprocess
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple
+
+from .topo import normalize_guid
+
+# Seconds ibnetdiscover may run before it is killed
+IBNETDISCOVER_TIMEOUT = 10 * 60
+
+# 'Ca	1 "H-00155dfffd341acb"		# "hpc-013 mlx5_ib0"'
+IBNETDISCOVER_NODE = re.compile(r'^(Ca|Switch|Rt)\s+\d+\s+"[^"]*"\s*#\s*"([^"]*)"')
+# '[1](155dfffd341acb) 	"S-0098039b03000007"[1]		# ...', the port GUID of a CA port
+IBNETDISCOVER_CA_PORT = re.compile(r'^\[\d+\]\(([0-9a-fA-F]+)\)')
+
+
+class FabricDumpError(Exception):
+    # ibnetdiscover failed or timed out
+    pass
+
+
+class CaPort(NamedTuple):
+    # A channel adapter port of a fabric dump
+    # - description is the node description, '<hostname> <device>' by default (rdma-ndd '%h %d')
+    guid: str
+    description: str
+
+
+def parse_ibnetdiscover(lines: Iterable[str]) -> Iterator[CaPort]:
+    description = None
+    for line in lines:
+        node = IBNETDISCOVER_NODE.match(line)
+        if node:
+            # Only ports listed below a Ca node are host ports
+            description = node.group(2) if node.group(1) == 'Ca' else None
+            continue
+        if description is not None:
+            port = IBNETDISCOVER_CA_PORT.match(line)
+            if port:
+                yield CaPort(normalize_guid(port.group(1)), description)
+
+
+def parse_iblinkinfo(lines: Iterable[str]) -> Iterator[CaPort]:
+    # 'CA: hpc-013 mlx5_ib0:' followed by one line per port starting with its port GUID
+    description = None
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith('CA:'):
+            description = stripped[len('CA:'):].rstrip(':').strip()
+        elif stripped.startswith('Switch:') or not stripped:
+            description = None
+        elif description is not None and stripped.startswith('0x'):
+            yield CaPort(normalize_guid(stripped.split()[0]), description)
+
+
+def parse_fabric_dump(path: Path) -> list:
+    # ibnetdiscover or iblinkinfo output, told apart by the 'CA:' headers of iblinkinfo
+    with open(path, 'r') as f:
+        lines = f.readlines()
+    if any(line.startswith('CA:') for line in lines):
+        return list(parse_iblinkinfo(lines))
+    return list(parse_ibnetdiscover(lines))
+
+
+def run_ibnetdiscover(output_file: Path, timeout: float = IBNETDISCOVER_TIMEOUT) -> None:
+    # A single fabric sweep from this node, written to output_file
+    with open(output_file, 'w') as f:
+        try:
+            process = subprocess.run(['ibnetdiscover'], stdin=subprocess.DEVNULL, stdout=f, stderr=subprocess.PIPE, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            raise FabricDumpError(f"ibnetdiscover did not finish within {timeout}s")
+    if process.returncode != 0:
+        raise FabricDumpError(f"ibnetdiscover exited with status {process.returncode}: {process.stderr.decode(errors='replace').strip()}")
+
+
+def match_hosts(names, hosts, resolve=None) -> dict:
+    # name -> hosts file entry for the hostnames of node descriptions
+    # - matched as is, by short name ('hpc-013' for 'hpc-013.cluster'), or by resolving the name to
+    #   an address listed in the hosts file (with resolve, socket.gethostbyname by default); names
+    #   matching none of these are left out
+    resolve = resolve or socket.gethostbyname
+    hosts = set(hosts)
+    short_names = {}
+    for host in hosts:
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            short_names.setdefault(host.split('.')[0], host)
+    matched = {}
+    for name in names:
+        if name in hosts:
+            matched[name] = name
+        elif name.split('.')[0] in short_names:
+            matched[name] = short_names[name.split('.')[0]]
+        else:
+            try:
+                address = resolve(name)
+            except OSError:
+                continue
+            if address in hosts:
+                matched[name] = address
+    return matched
+
+
+def guids_from_ports(ports, hosts, ibdevice_pattern='', resolve=None) -> dict:
+    # guid -> host like IBTopology.fetch_guids, merged in hosts file order
+    # - Only devices whose name contains ibdevice_pattern are kept, like the ibstatus | grep of fetch_guids
+    host_guids = {}
+    for port in ports:
+        hostname, _, device = port.description.partition(' ')
+        if ibdevice_pattern and ibdevice_pattern not in device:
+            continue
+        host_guids.setdefault(hostname, []).append(port.guid)
+    host_of_name = match_hosts(host_guids, hosts, resolve)
+
+    guids_per_host = {}
+    for name, guids in host_guids.items():
+        if name in host_of_name:
+            guids_per_host.setdefault(host_of_name[name], []).extend(guids)
+    missing = [host for host in hosts if host not in guids_per_host]
+    if missing:
+        logging.error(f"No GUIDs found in the fabric dump for {len(missing)} hosts: {', '.join(missing)}")
+    unknown = [name for name in host_guids if name not in host_of_name]
+    if unknown:
+        logging.info(f"Ignoring {len(unknown)} nodes of the fabric dump that are not in the hosts file: {', '.join(unknown)}")
+
+    guids = {}
+    for host in hosts:
+        for guid in guids_per_host.get(host, []):
+            guids[guid] = host
+    return guids
@@ -0,0 +1,86 @@
+import argparse
+import dataclasses
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .topo import TopologyConfig, main
+
+# Settings that are paths, relative ones are relative to the manifest
+PATH_FIELDS = ('hosts_file', 'output_dir', 'sharp_cmd_path', 'pkey_path', 'guid_cache', 'fabric_dump')
+# Same defaults as the ibtopo command line
+DEFAULTS = {'sharp_smx_ucx_interface': 'mlx5_ib0:1', 'ibdevice_pattern': 'mlx5_ib', 'pkey_path': None}
+
+
+def load_manifest(path: Path, output_root: Path = None) -> dict:
+    # name -> TopologyConfig for every fabric of a manifest
+    # {"defaults": {"username": "hpcadmin", "sharp_cmd_path": "/opt/mellanox/sharp/bin/sharp_cmd"},
+    #  "fabrics": {"fabric-a": {"hosts_file": "fabric-a/hosts.txt", "sharp_smx_ucx_interface": "mlx5_ib0:1"}, ...}}
+    # - Keys are TopologyConfig fields, the entry of a fabric overrides "defaults"
+    # - Outputs go to <output_root>/<name> (default: next to the manifest) unless output_dir is set
+    path = Path(path)
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    base = path.parent
+    output_root = Path(output_root) if output_root is not None else base
+    fields = {field.name for field in dataclasses.fields(TopologyConfig)}
+
+    configs = {}
+    for name, entry in manifest.get('fabrics', {}).items():
+        values = {**DEFAULTS, **manifest.get('defaults', {}), **entry}
+        unknown = set(values) - fields
+        if unknown:
+            raise ValueError(f"Unknown settings for fabric {name}: {', '.join(sorted(unknown))}")
+        for key in PATH_FIELDS:
+            if values.get(key) is not None:
+                values[key] = base / Path(values[key]).expanduser()
+        values.setdefault('output_dir', output_root / name)
+        try:
+            configs[name] = TopologyConfig(**values)
+        except TypeError as e:
+            raise ValueError(f"Invalid settings for fabric {name}: {e}")
+
+    output_dirs = [config.output_dir.resolve() for config in configs.values()]
+    if len(set(output_dirs)) != len(output_dirs):
+        raise ValueError("Every fabric needs its own output directory")
+    return configs
+
+
+def run_fabric(name: str, config: TopologyConfig) -> dict:
+    # Runs in a worker process, log lines are prefixed with the fabric name
+    logging.basicConfig(level=logging.INFO, format=f'%(asctime)s {name} %(levelname)s %(message)s', force=True)
+    start = time.perf_counter()
+    try:
+        main(config)
+    except Exception as e:
+        logging.error(f"Fabric {name} failed: {e}")
+        return {'ok': False, 'error': str(e), 'seconds': time.perf_counter() - start, 'output_dir': str(config.output_dir)}
+    return {'ok': True, 'seconds': time.perf_counter() - start, 'output_dir': str(config.output_dir)}
+
+
+def run_fabrics(configs: dict, workers: int = None) -> dict:
+    # One process per fabric (up to `workers` at a time), so fabrics share no state and the run
+    # takes about as long as the slowest fabric
+    if not configs:
+        return {}
+    with ProcessPoolExecutor(max_workers=workers or len(configs)) as executor:
+        futures = {name: executor.submit(run_fabric, name, config) for name, config in configs.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(prog='ibtopo fabrics', description='Run the topology pipeline for every fabric of a manifest in parallel')
+    parser.add_argument('manifest', type=str, help='JSON manifest of fabrics')
+    parser.add_argument('--workers', type=int, default=None, help='Fabrics processed at the same time (default: all)')
+    parser.add_argument('--output_dir', type=str, default=None, help='Directory for the per-fabric output directories (default: next to the manifest)')
+    args = parser.parse_args(argv)
+
+    results = run_fabrics(load_manifest(Path(args.manifest), args.output_dir), args.workers)
+    for name, result in results.items():
+        status = 'ok' if result['ok'] else f"failed: {result['error']}"
+        print(f"{name}: {status} ({result['seconds']:.1f}s, {result['output_dir']})")
+    if not all(result['ok'] for result in results.values()):
+        sys.exit(1)
@@ -0,0 +1,152 @@
+from array import array
+
+import numpy as np
+
+from .topofile import NODES, SWITCHES
+
+
+class FabricGraph:
+    # Array backed graph of the fabric, a compact alternative to nx.Graph for large fabrics
+    # - Switches are vertices 0..num_switches-1 in the order they are first seen, followed by one
+    #   vertex per node GUID. GUIDs are interned as 64-bit integers
+    # - Adjacency is stored in CSR form: neighbors of v are indices[indptr[v]:indptr[v + 1]]
+    def __init__(self):
+        self.switch_names = []
+        self.guids = np.empty(0, dtype=np.uint64)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.empty(0, dtype=np.int32)
+        self._switch_index = {}
+        # GUIDs in sorted order and their vertex, for binary search lookups
+        self._sorted_guids = np.empty(0, dtype=np.uint64)
+        self._sorted_vertices = np.empty(0, dtype=np.int64)
+        # Only needed while records are being added, released by finalize()
+        self._link_src = array('l')
+        self._link_dst = array('l')
+        self._node_src = array('l')
+        self._node_guid = array('Q')
+
+    @classmethod
+    def from_records(cls, records) -> 'FabricGraph':
+        graph = cls()
+        for record in records:
+            graph.add_record(record)
+        graph.finalize()
+        return graph
+
+    def _switch_vertex(self, name) -> int:
+        vertex = self._switch_index.get(name)
+        if vertex is None:
+            vertex = self._switch_index[name] = len(self.switch_names)
+            self.switch_names.append(name)
+        return vertex
+
+    def add_record(self, record) -> None:
+        switch = self._switch_vertex(record.switch)
+        if record.kind == SWITCHES:
+            self._link_src.extend([switch] * len(record.members))
+            self._link_dst.extend([self._switch_vertex(name) for name in record.members])
+        elif record.kind == NODES:
+            self._node_src.extend([switch] * len(record.members))
+            self._node_guid.extend([int(guid, 16) for guid in record.members])
+
+    def finalize(self) -> None:
+        num_switches = len(self.switch_names)
+
+        # Intern GUIDs, numbering node vertices in the order GUIDs were first seen
+        node_guids = np.frombuffer(self._node_guid, dtype=np.uint64) if len(self._node_guid) else np.empty(0, dtype=np.uint64)
+        sorted_guids, first_seen, inverse = np.unique(node_guids, return_index=True, return_inverse=True)
+        order = np.argsort(first_seen, kind='stable')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        self.guids = sorted_guids[order]
+        self._sorted_guids = sorted_guids
+        self._sorted_vertices = num_switches + rank
+
+        src = np.concatenate([np.frombuffer(self._link_src, dtype=np.int_), np.frombuffer(self._node_src, dtype=np.int_)]).astype(np.int64)
+        dst = np.concatenate([np.frombuffer(self._link_dst, dtype=np.int_).astype(np.int64), num_switches + rank[inverse.reshape(-1)]])
+        # Store each undirected edge in both rows. sharp_cmd lists switch links from both ends,
+        # so duplicates (and self loops) are dropped like nx.Graph does
+        rows = np.concatenate([src, dst])
+        cols = np.concatenate([dst, src])
+        keep = rows != cols
+        num_vertices = num_switches + len(self.guids)
+        pairs = np.unique(rows[keep] * num_vertices + cols[keep])
+        rows, cols = np.divmod(pairs, num_vertices)
+        index_type = np.int32 if num_vertices < 2 ** 31 else np.int64
+        self.indices = cols.astype(index_type)
+        self.indptr = np.zeros(num_vertices + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=num_vertices), out=self.indptr[1:])
+
+        self._link_src = array('l')
+        self._link_dst = array('l')
+        self._node_src = array('l')
+        self._node_guid = array('Q')
+
+    @property
+    def num_switches(self) -> int:
+        return len(self.switch_names)
+
+    def number_of_nodes(self) -> int:
+        return len(self.indptr) - 1
+
+    def number_of_edges(self) -> int:
+        return len(self.indices) // 2
+
+    def vertex(self, label) -> int:
+        # Switch name or GUID string to vertex id
+        vertex = self._switch_index.get(label)
+        if vertex is not None:
+            return vertex
+        value = np.uint64(int(label, 16))
+        i = np.searchsorted(self._sorted_guids, value)
+        if i == len(self._sorted_guids) or self._sorted_guids[i] != value:
+            raise KeyError(label)
+        return int(self._sorted_vertices[i])
+
+    def label(self, vertex) -> str:
+        if vertex < self.num_switches:
+            return self.switch_names[vertex]
+        return hex(int(self.guids[vertex - self.num_switches]))
+
+    def is_switch(self, vertex) -> bool:
+        return vertex < self.num_switches
+
+    def degree(self, vertex) -> int:
+        return int(self.indptr[vertex + 1] - self.indptr[vertex])
+
+    def neighbors(self, vertex) -> np.ndarray:
+        return self.indices[self.indptr[vertex]:self.indptr[vertex + 1]]
+
+    def bfs(self, source, switches_only: bool = False) -> np.ndarray:
+        # Hop distance from source to every vertex (-1 when unreachable), one frontier at a time
+        distances = np.full(self.number_of_nodes(), -1, dtype=np.int32)
+        distances[source] = 0
+        frontier = np.array([source], dtype=np.int64)
+        level = 0
+        while len(frontier):
+            level += 1
+            starts = self.indptr[frontier]
+            lengths = self.indptr[frontier + 1] - starts
+            offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            neighbors = self.indices[offsets]
+            if switches_only:
+                neighbors = neighbors[neighbors < self.num_switches]
+            frontier = np.unique(neighbors[distances[neighbors] == -1]).astype(np.int64)
+            distances[frontier] = level
+        return distances
+
+    def to_networkx(self):
+        import networkx as nx
+
+        graph = nx.Graph()
+        graph.add_nodes_from(self.switch_names)
+        graph.add_nodes_from((hex(int(guid)) for guid in self.guids), type='node')
+        for vertex in range(self.number_of_nodes()):
+            for neighbor in self.neighbors(vertex).tolist():
+                if neighbor < vertex:
+                    continue
+                if neighbor < self.num_switches:
+                    graph.add_edge(self.label(vertex), self.label(neighbor))
+                else:
+                    graph.add_edge(self.label(vertex), self.label(neighbor), type='switch-to-node')
+        return graph
@@ -0,0 +1,110 @@
+import json
+import logging
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+METRICS_VERSION = 1
+# Number of hosts listed in the slowest hosts summary
+SLOWEST_HOSTS = 10
+
+
+def peak_rss_bytes() -> int:
+    # High-water mark of the process resident set size for its whole lifetime, ru_maxrss is in KiB
+    # on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def reset_peak_rss() -> bool:
+    # Linux only: reset VmHWM to the current RSS, so hwm_rss_bytes measures from now on
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def hwm_rss_bytes() -> int:
+    # VmHWM, the peak RSS since the last reset_peak_rss (or process start)
+    with open('/proc/self/status', 'r') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    raise OSError("VmHWM not found in /proc/self/status")
+
+
+def percentile(values, q) -> float:
+    # Linear interpolation between the closest ranks, q in [0, 100]
+    values = sorted(values)
+    if not values:
+        return None
+    rank = (len(values) - 1) * q / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def latency_summary(latencies: dict, slowest: int = SLOWEST_HOSTS) -> dict:
+    # latencies[host] = seconds spent running remote commands on host
+    seconds = list(latencies.values())
+    summary = {'hosts': len(seconds)}
+    if seconds:
+        summary['seconds'] = {
+            'mean': sum(seconds) / len(seconds),
+            'p50': percentile(seconds, 50),
+            'p90': percentile(seconds, 90),
+            'p99': percentile(seconds, 99),
+            'max': max(seconds),
+        }
+    summary['slowest'] = [{'host': host, 'seconds': host_seconds} for host, host_seconds in sorted(latencies.items(), key=lambda item: -item[1])[:slowest]]
+    summary['per_host'] = latencies
+    return summary
+
+
+class RunMetrics:
+    # Wall time and peak RSS of each phase of a run, and the SSH latency of each host
+    # - peak_rss_bytes is the peak RSS during the phase. Where the peak cannot be reset (not Linux),
+    #   peak_rss_increase_bytes is how much the peak RSS of the process grew during the phase instead
+    # {"version": 1, "started": ..., "total_seconds": ..., "phases": {"sharp_cmd": {"seconds": ..., "peak_rss_bytes": ...}},
+    #  "sharp_cmd": {"seconds": ..., "return_code": ..., "timed_out": ...},
+    #  "ssh": {"hosts": ..., "seconds": {"mean": ..., "p50": ..., ...}, "slowest": [...], "per_host": {...}}}
+    def __init__(self):
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.phases = {}
+        self.host_latencies = {}
+        # {"seconds": ..., "return_code": ..., "timed_out": ...} of sharp_cmd
+        self.sharp_cmd = {}
+
+    @contextmanager
+    def phase(self, name):
+        reset = reset_peak_rss()
+        peak_before = None if reset else peak_rss_bytes()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if reset:
+                self.phases[name] = {'seconds': seconds, 'peak_rss_bytes': hwm_rss_bytes()}
+            else:
+                self.phases[name] = {'seconds': seconds, 'peak_rss_increase_bytes': peak_rss_bytes() - peak_before}
+            logging.debug(f"Phase {name} took {seconds:.3f}s")
+
+    def to_dict(self) -> dict:
+        return {
+            'version': METRICS_VERSION,
+            'started': self.started,
+            'total_seconds': time.perf_counter() - self._start,
+            'phases': self.phases,
+            'sharp_cmd': self.sharp_cmd,
+            'ssh': latency_summary(self.host_latencies),
+        }
+
+    def write(self, path: Path) -> None:
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
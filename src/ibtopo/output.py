@@ -0,0 +1,108 @@
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+from .topo import UnionFind, leaf_torsets, switch_adjacency
+
+TORSETS_FILE = 'torsets.json'
+SLURM_TOPOLOGY_FILE = 'topology.conf'
+TORSETS_VERSION = 1
+
+
+@contextmanager
+def atomic_open(path: Path, mode: str = 'w'):
+    # Write to a temporary file next to path and rename it into place, so readers see the previous
+    # file or the complete new one, never a partial one. Nothing is replaced when writing fails
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def write_torset_map(output_dir: Path, torsets: dict) -> Path:
+    # Every torset and its hosts in a single torsets.json
+    # {"version": 1, "torsets": {"torset-00": ["10.193.0.4", ...], ...}}
+    path = Path(output_dir) / TORSETS_FILE
+    with atomic_open(path) as f:
+        json.dump({'version': TORSETS_VERSION, 'torsets': torsets}, f)
+    return path
+
+
+def read_torset_map(output_dir: Path):
+    # Torsets from torsets.json, None when the output directory does not have one
+    path = Path(output_dir) / TORSETS_FILE
+    if not path.exists():
+        return None
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if data.get('version') != TORSETS_VERSION:
+        raise ValueError(f"Unsupported torset map version {data.get('version')} in {path}")
+    return data['torsets']
+
+
+def slurm_topology(device_guids_per_switch, switch_links, guid_to_host_ip, host_ip_to_torset) -> str:
+    # Slurm topology.conf (topology/tree) for the torsets
+    # - A host is cabled to a leaf switch per rail but Slurm allows a single leaf per node, so every
+    #   torset is a leaf switch named after the torset with its hosts as nodes
+    # - Groups of torsets whose leaf switches reach a common switch within k hops are joined under a
+    #   tier<k>-NN switch, until a single switch is left or no more groups can be joined
+    adjacency = switch_adjacency(switch_links)
+    torsets = {}
+    for host_ip, torset in host_ip_to_torset.items():
+        torsets.setdefault(torset, []).append(host_ip)
+    lines = [f"SwitchName={torset} Nodes={','.join(hosts)}" for torset, hosts in torsets.items()]
+
+    # reach[group] = switches within `tier` hops of the leaf switches of the group, frontier[group] = the ones `tier` hops away
+    reach = {torset: set() for torset in torsets}
+    for leaf, torset in leaf_torsets(device_guids_per_switch, guid_to_host_ip, host_ip_to_torset).items():
+        reach[torset].add(leaf)
+    frontier = {group: set(switches) for group, switches in reach.items()}
+    tier = 0
+    while len(reach) > 1:
+        tier += 1
+        grown = False
+        for group, switches in reach.items():
+            frontier[group] = {conn_switch for switch in frontier[group] for conn_switch in adjacency.get(switch, ())} - switches
+            switches |= frontier[group]
+            grown = grown or bool(frontier[group])
+        if not grown:
+            break
+
+        components = UnionFind()
+        owner = {}
+        for group, switches in reach.items():
+            components.add(group)
+            for switch in switches:
+                other = owner.setdefault(switch, group)
+                if other != group:
+                    components.union(other, group)
+        children_of = {}
+        for group in reach:
+            children_of.setdefault(components.find(group), []).append(group)
+
+        next_reach, next_frontier = {}, {}
+        joined = 0
+        for children in children_of.values():
+            if len(children) == 1:
+                name = children[0]
+            else:
+                name = f"tier{tier}-{joined:02}"
+                joined += 1
+                lines.append(f"SwitchName={name} Switches={','.join(children)}")
+            next_reach[name] = set().union(*(reach[child] for child in children))
+            next_frontier[name] = set().union(*(frontier[child] for child in children))
+        reach, frontier = next_reach, next_frontier
+    return '\n'.join(lines) + '\n'
+
+
+def write_slurm_topology(output_dir: Path, device_guids_per_switch, switch_links, guid_to_host_ip, host_ip_to_torset) -> Path:
+    path = Path(output_dir) / SLURM_TOPOLOGY_FILE
+    with atomic_open(path) as f:
+        f.write(slurm_topology(device_guids_per_switch, switch_links, guid_to_host_ip, host_ip_to_torset))
+    return path
@@ -0,0 +1,178 @@
+import argparse
+import logging
+from bisect import bisect_left
+from pathlib import Path
+
+from .cache import GuidCache
+from .topo import read_torsets
+from .topofile import read_topology
+
+# Hop distance used between torsets when the switch graph does not connect them (or is unknown)
+UNKNOWN_DISTANCE = 255
+# Number of the largest torsets tried as the starting point of a multi-torset placement
+MAX_SEEDS = 8
+
+
+def torset_hop_distances(device_guids_per_switch, switch_links, guid_to_host_ip, host_ip_to_torset):
+    # Switch hops between the closest leaf switches of every pair of torsets, as a
+    # distances.DistanceMatrix computed like write_distance_matrices does: one BFS per group of leaves
+    # with the same uplinks instead of one per torset
+    from .distances import leaf_distances, torset_distances
+
+    leaf_matrix = leaf_distances(device_guids_per_switch, switch_links)
+    return torset_distances(leaf_matrix, device_guids_per_switch, guid_to_host_ip, host_ip_to_torset)
+
+
+class PlacementIndex:
+    # Precomputed torset index answering "which N free hosts span the fewest torsets and switch hops"
+    # - torsets[torset] = [host, ...] as written by IBTopology.write_hosts_by_torset
+    # - distances[torset_a][torset_b] = switch hops, or a distances.DistanceMatrix of torsets as
+    #   returned by torset_hop_distances
+    def __init__(self, torsets: dict, distances=None):
+        self.torsets = torsets
+        self.distances = distances if distances is not None else {}
+        self.host_torset = {host: torset for torset, hosts in torsets.items() for host in hosts}
+        # Position of each host in its torset so hosts are always picked in a stable order
+        self.host_rank = {host: rank for hosts in torsets.values() for rank, host in enumerate(hosts)}
+        self.torset_order = {torset: i for i, torset in enumerate(torsets)}
+        # Free hosts per torset, every host starts free
+        self.free = {torset: set(hosts) for torset, hosts in torsets.items()}
+
+    def allocate(self, hosts) -> None:
+        for host in hosts:
+            self.free[self.host_torset[host]].discard(host)
+
+    def release(self, hosts) -> None:
+        for host in hosts:
+            self.free[self.host_torset[host]].add(host)
+
+    def distance(self, torset_a, torset_b) -> int:
+        if torset_a == torset_b:
+            return 0
+        if not isinstance(self.distances, dict):
+            return self.distances.distance(torset_a, torset_b)
+        return self.distances.get(torset_a, {}).get(torset_b, UNKNOWN_DISTANCE)
+
+    def _free_by_torset(self, free_hosts) -> dict:
+        if free_hosts is None:
+            return {torset: hosts for torset, hosts in self.free.items() if hosts}
+        free = {}
+        for host in free_hosts:
+            torset = self.host_torset.get(host)
+            if torset is not None:
+                free.setdefault(torset, set()).add(host)
+        return free
+
+    def _diameter(self, selected) -> int:
+        return max((self.distance(a, b) for i, a in enumerate(selected) for b in selected[i + 1:]), default=0)
+
+    def _grow(self, seed, count, capacity, num_torsets) -> list:
+        # Add the torsets closest to seed (larger first on ties) while the placement can still be
+        # completed within num_torsets torsets
+        selected = [seed]
+        remaining = count - capacity[seed]
+        candidates = sorted((t for t in capacity if t != seed), key=lambda t: (self.distance(seed, t), -capacity[t], self.torset_order[t]))
+        # Capacities of the candidates in ascending order, kept in step with candidates
+        capacities = sorted(capacity[t] for t in candidates)
+
+        def largest_sum(n):
+            return sum(capacities[max(0, len(capacities) - n):]) if n > 0 else 0
+
+        while remaining > 0:
+            slots = num_torsets - len(selected)
+            # Largest capacity still reachable with the other slots - 1 torsets: the slots - 1
+            # largest, or the slots largest without the candidate when it is one of them
+            smallest_of_largest = capacities[max(0, len(capacities) - (slots - 1))] if slots > 1 else None
+            with_candidate, without_candidate = largest_sum(slots), largest_sum(slots - 1)
+            for torset in candidates:
+                cap = capacity[torset]
+                if cap >= remaining:
+                    break
+                if slots > 1 and cap >= smallest_of_largest:
+                    rest = with_candidate - cap
+                else:
+                    rest = without_candidate
+                if cap + rest >= remaining:
+                    break
+            candidates.remove(torset)
+            capacities.pop(bisect_left(capacities, capacity[torset]))
+            selected.append(torset)
+            remaining -= capacity[torset]
+        return selected
+
+    def place(self, count: int, free_hosts=None) -> list:
+        # Hosts for a job of `count` nodes, using the fewest torsets and then the fewest switch hops
+        # between them. free_hosts defaults to the hosts not allocated in this index
+        free = self._free_by_torset(free_hosts)
+        capacity = {torset: len(hosts) for torset, hosts in free.items()}
+        if count <= 0:
+            return []
+        if sum(capacity.values()) < count:
+            raise ValueError(f"Requested {count} hosts but only {sum(capacity.values())} are free")
+
+        # Best fit in a single torset keeps the larger torsets available for larger jobs
+        fits = [torset for torset, cap in capacity.items() if cap >= count]
+        if fits:
+            selected = [min(fits, key=lambda t: (capacity[t], self.torset_order[t]))]
+        else:
+            by_capacity = sorted(capacity, key=lambda t: (-capacity[t], self.torset_order[t]))
+            num_torsets, total = 0, 0
+            while total < count:
+                total += capacity[by_capacity[num_torsets]]
+                num_torsets += 1
+            largest = [capacity[t] for t in by_capacity]
+            best = None
+            for rank, seed in enumerate(by_capacity[:MAX_SEEDS]):
+                # Only seeds that can be completed with num_torsets - 1 other torsets
+                others = sum(largest[:num_torsets - 1]) if rank >= num_torsets - 1 else sum(largest[:num_torsets]) - capacity[seed]
+                if capacity[seed] + others < count:
+                    continue
+                selected = self._grow(seed, count, capacity, num_torsets)
+                cost = (len(selected), self._diameter(selected), sum(self.distance(seed, t) for t in selected))
+                if best is None or cost < best[0]:
+                    best = (cost, selected)
+            selected = best[1]
+
+        hosts = []
+        for torset in selected:
+            hosts.extend(sorted(free[torset], key=self.host_rank.__getitem__)[:count - len(hosts)])
+        return hosts
+
+
+def index_from_output_dir(output_dir: Path, guid_cache: Path = None) -> PlacementIndex:
+    # Torsets from the torset files, switch hops from the precomputed torset distance matrix, or
+    # from the topology file and GUID cache when there is no matrix
+    from .distances import DistanceMatrix
+
+    output_dir = Path(output_dir)
+    torsets = read_torsets(output_dir)
+    if DistanceMatrix.exists(output_dir, 'torset'):
+        return PlacementIndex(torsets, DistanceMatrix.load(output_dir, 'torset'))
+    guid_cache = Path(guid_cache) if guid_cache else output_dir / 'guid_cache.json'
+    topo_file = output_dir / 'topology.txt'
+    distances = None
+    if topo_file.exists() and guid_cache.exists():
+        host_ip_to_torset = {host: torset for torset, hosts in torsets.items() for host in hosts}
+        guid_to_host_ip = GuidCache(guid_cache).guid_to_host(host_ip_to_torset)
+        device_guids_per_switch, switch_links = read_topology(topo_file)
+        distances = torset_hop_distances(device_guids_per_switch, switch_links, guid_to_host_ip, host_ip_to_torset)
+    else:
+        logging.warning(f"No topology file or GUID cache in {output_dir}, all torsets are treated as equally distant")
+    return PlacementIndex(torsets, distances)
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(prog='ibtopo place', description='Select hosts for a job using the fewest torsets and switch hops')
+    parser.add_argument('output_dir', type=str, help='Output directory of an ibtopo run')
+    parser.add_argument('count', type=int, help='Number of hosts requested')
+    parser.add_argument('--free_hosts', type=str, default=None, help='File with the hosts available for the job (default: every host)')
+    parser.add_argument('--guid_cache', type=str, default=None, help='Path to GUID cache file (default: <output_dir>/guid_cache.json)')
+    args = parser.parse_args(argv)
+
+    index = index_from_output_dir(Path(args.output_dir), args.guid_cache)
+    free_hosts = None
+    if args.free_hosts:
+        with open(args.free_hosts, 'r') as f:
+            free_hosts = [host.strip() for host in f if host.strip()]
+    for host in index.place(args.count, free_hosts):
+        print(host)
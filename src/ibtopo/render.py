@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+import networkx as nx
+
+from .topo import leaf_torsets, switch_adjacency
+
+# Tier of the torsets (hosts and their leaf switches collapsed together) in aggregated graphs
+TORSET_TIER = 0
+
+
+def aggregate_graph(device_guids_per_switch, switch_links, guid_to_host_ip, host_ip_to_torset) -> nx.Graph:
+    # Collapse GUIDs into hosts, hosts and their leaf switches into torsets, and keep the switches
+    # above the leaves. Every node gets a 'tier': 0 for torsets, then hop distance from the leaves
+    graph = nx.Graph()
+    leaf_torset = leaf_torsets(device_guids_per_switch, guid_to_host_ip, host_ip_to_torset)
+    for torset in dict.fromkeys(leaf_torset.values()):
+        graph.add_node(torset, tier=TORSET_TIER, hosts=0)
+    for host_ip, torset in host_ip_to_torset.items():
+        if torset in graph:
+            graph.nodes[torset]['hosts'] += 1
+
+    adjacency = switch_adjacency(switch_links)
+
+    # Tiers above the leaves by BFS over switch links
+    tiers = {leaf: TORSET_TIER for leaf in leaf_torset}
+    frontier = list(leaf_torset)
+    while frontier:
+        next_frontier = []
+        for switch in frontier:
+            for conn_switch in sorted(adjacency.get(switch, ())):
+                if conn_switch not in tiers:
+                    tiers[conn_switch] = tiers[switch] + 1
+                    next_frontier.append(conn_switch)
+        frontier = next_frontier
+    unreachable_tier = max(tiers.values(), default=TORSET_TIER) + 1
+
+    def collapsed(switch):
+        return leaf_torset.get(switch, switch)
+
+    for switch in adjacency:
+        if switch not in leaf_torset and switch not in graph:
+            graph.add_node(switch, tier=tiers.get(switch, unreachable_tier))
+    for switch, connected_switches in adjacency.items():
+        for conn_switch in connected_switches:
+            a, b = collapsed(switch), collapsed(conn_switch)
+            if a != b:
+                graph.add_edge(a, b)
+    return graph
+
+
+def graph_key(graph: nx.Graph, layout_name: str) -> str:
+    # Fingerprint of the graph structure, a cached layout is reused only for the same graph
+    digest = hashlib.sha256(layout_name.encode())
+    for node in sorted(map(str, graph.nodes)):
+        digest.update(f"n {node}\n".encode())
+    for edge in sorted(tuple(sorted(map(str, edge))) for edge in graph.edges):
+        digest.update(f"e {edge[0]} {edge[1]}\n".encode())
+    return digest.hexdigest()
+
+
+def cached_layout(graph: nx.Graph, layout_name: str, layout, cache_file: Path) -> dict:
+    key = graph_key(graph, layout_name)
+    if cache_file.exists():
+        try:
+            with open(cache_file, 'r') as f:
+                cached = json.load(f)
+            if cached.get('key') == key:
+                return {node: tuple(cached['pos'][str(node)]) for node in graph.nodes}
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Ignoring unreadable layout cache {cache_file}: {e}")
+    pos = layout(graph)
+    with open(cache_file, 'w') as f:
+        json.dump({'key': key, 'pos': {str(node): [float(x), float(y)] for node, (x, y) in pos.items()}}, f)
+    return pos
+
+
+def write_dot(graph: nx.Graph, path: Path) -> None:
+    # Plain DOT writer, avoids the pydot/pygraphviz dependency of nx.nx_agraph / nx.nx_pydot
+    def quote(value):
+        return '"' + str(value).replace('"', '\\"') + '"'
+
+    with open(path, 'w') as f:
+        f.write("graph topology {\n")
+        for node, attrs in graph.nodes(data=True):
+            attributes = ', '.join(f"{key}={quote(value)}" for key, value in attrs.items())
+            f.write(f"  {quote(node)}{f' [{attributes}]' if attributes else ''};\n")
+        for a, b in graph.edges:
+            f.write(f"  {quote(a)} -- {quote(b)};\n")
+        f.write("}\n")
@@ -0,0 +1,188 @@
+import json
+import struct
+import sys
+from array import array
+from pathlib import Path
+
+from .topofile import NODES, SWITCHES, TopologyRecord
+
+# Snapshot file layout, all integers in the byte order recorded in the header:
+#   magic (8 bytes) | version (uint32) | byte order (1 byte, '<' or '>') | section count (uint32)
+#   then per section: tag (4 bytes) | length (uint64) | payload
+# Strings (hosts, switches, torsets) are interned in one string table and referenced by uint32 id,
+# GUIDs are stored as uint64. Columns are plain arrays so loading is a handful of frombytes calls
+MAGIC = b'IBTOPO\0\0'
+VERSION = 1
+HEADER = struct.Struct('=8sIcI')
+SECTION = struct.Struct('=4sQ')
+NATIVE_ORDER = b'<' if sys.byteorder == 'little' else b'>'
+
+
+class StringTable:
+    def __init__(self):
+        self.strings = []
+        self.ids = {}
+
+    def id(self, value) -> int:
+        string_id = self.ids.get(value)
+        if string_id is None:
+            string_id = self.ids[value] = len(self.strings)
+            self.strings.append(value)
+        return string_id
+
+    def ids_of(self, values) -> array:
+        return array('I', map(self.id, values))
+
+    def to_bytes(self) -> bytes:
+        encoded = [value.encode() for value in self.strings]
+        offsets = array('Q', [0])
+        for value in encoded:
+            offsets.append(offsets[-1] + len(value))
+        return struct.pack('=Q', len(encoded)) + offsets.tobytes() + b''.join(encoded)
+
+    @staticmethod
+    def from_bytes(data, swap: bool) -> list:
+        count = _unpack_count(data, swap)
+        offsets = _array('Q', data[8:8 + 8 * (count + 1)], swap)
+        blob = bytes(data[8 + 8 * (count + 1):])
+        return [blob[offsets[i]:offsets[i + 1]].decode() for i in range(count)]
+
+
+def _unpack_count(data, swap: bool) -> int:
+    return _array('Q', data[:8], swap)[0]
+
+
+def _array(typecode, data, swap: bool) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if swap:
+        values.byteswap()
+    return values
+
+
+def _grouped(strings: StringTable, groups: dict, member_column) -> bytes:
+    # {key: [member, ...]} as key ids, offsets into the member column, and the member column
+    keys = strings.ids_of(groups)
+    offsets = array('Q', [0])
+    members = member_column()
+    for values in groups.values():
+        members.extend(values)
+        offsets.append(len(members))
+    return struct.pack('=Q', len(keys)) + keys.tobytes() + offsets.tobytes() + members.tobytes()
+
+
+def _ungrouped(data, swap: bool, member_typecode) -> tuple:
+    count = _unpack_count(data, swap)
+    position = 8
+    keys = _array('I', data[position:position + 4 * count], swap)
+    position += 4 * count
+    offsets = _array('Q', data[position:position + 8 * (count + 1)], swap)
+    position += 8 * (count + 1)
+    members = _array(member_typecode, data[position:], swap)
+    return keys, offsets, members
+
+
+def _guid_value(guid) -> int:
+    # GUIDs are stored as integers and restored with hex(), in the form of topo.normalize_guid
+    return int(guid, 16)
+
+
+def save_snapshot(topology, path: Path) -> None:
+    strings = StringTable()
+    meta = {
+        'output_dir': str(topology.output_dir),
+        'hosts_file': str(topology.hosts_file),
+        'sharp_cmd_path': str(topology.sharp_cmd_path),
+        'sharp_smx_ucx_interface': topology.sharp_smx_ucx_interface,
+        'ibdevice_pattern': topology.ibdevice_pattern,
+    }
+    sections = [
+        (b'META', json.dumps(meta).encode()),
+        (b'HOST', strings.ids_of(topology.hosts).tobytes()),
+        (b'GUID', array('Q', map(_guid_value, topology.guid_to_host_ip)).tobytes()),
+        (b'GHST', strings.ids_of(topology.guid_to_host_ip.values()).tobytes()),
+        (b'LEAF', _grouped(strings, {switch: map(_guid_value, guids) for switch, guids in topology.device_guids_per_switch.items()}, lambda: array('Q'))),
+        (b'LINK', _grouped(strings, {switch: map(strings.id, links) for switch, links in topology.switch_links.items()}, lambda: array('I'))),
+        (b'TSHT', strings.ids_of(topology.host_ip_to_torset).tobytes()),
+        (b'TSID', strings.ids_of(topology.host_ip_to_torset.values()).tobytes()),
+        (b'SPAN', strings.ids_of(topology.spanning_hosts).tobytes()),
+    ]
+    # The string table is written first but filled while the other sections are built
+    sections.insert(0, (b'STRS', strings.to_bytes()))
+
+    tmp_path = Path(path).with_name(f".{Path(path).name}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, NATIVE_ORDER, len(sections)))
+        for tag, payload in sections:
+            f.write(SECTION.pack(tag, len(payload)))
+            f.write(payload)
+    tmp_path.replace(path)
+
+
+def read_sections(path: Path) -> tuple:
+    with open(path, 'rb') as f:
+        data = memoryview(f.read())
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise ValueError(f"{path} is not an ibtopo snapshot")
+    byte_order = bytes(data[12:13])
+    _, version, _, count = struct.Struct(byte_order.decode() + HEADER.format[1:]).unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f"Unsupported snapshot version {version} in {path}")
+    swap = byte_order != NATIVE_ORDER
+    sections = {}
+    position = HEADER.size
+    for _ in range(count):
+        tag = bytes(data[position:position + 4])
+        length = _unpack_count(data[position + 4:position + SECTION.size], swap)
+        position += SECTION.size
+        sections[tag] = data[position:position + length]
+        position += length
+    return sections, swap
+
+
+def _guid_to_host(sections, strings, swap: bool) -> dict:
+    guid_hosts = _array('I', sections[b'GHST'], swap)
+    return {hex(guid): strings[host] for guid, host in zip(_array('Q', sections[b'GUID'], swap), guid_hosts)}
+
+
+def load_guid_to_host(path: Path) -> dict:
+    # Only the GUID -> host map of the snapshot at path
+    sections, swap = read_sections(path)
+    return _guid_to_host(sections, StringTable.from_bytes(sections[b'STRS'], swap), swap)
+
+
+def load_snapshot(topology, path: Path) -> None:
+    # Restores the state written by save_snapshot into topology (an IBTopology)
+    sections, swap = read_sections(path)
+    strings = StringTable.from_bytes(sections[b'STRS'], swap)
+    meta = json.loads(bytes(sections[b'META']))
+    topology.output_dir = Path(meta['output_dir'])
+    topology.hosts_file = Path(meta['hosts_file'])
+    topology.sharp_cmd_path = Path(meta['sharp_cmd_path'])
+    topology.sharp_smx_ucx_interface = meta['sharp_smx_ucx_interface']
+    topology.ibdevice_pattern = meta['ibdevice_pattern']
+    topology.guids_file = topology.output_dir / 'guids.txt'
+    topology.topo_file = topology.output_dir / 'topology.txt'
+
+    topology.hosts = [strings[i] for i in _array('I', sections[b'HOST'], swap)]
+    topology.guid_to_host_ip = _guid_to_host(sections, strings, swap)
+
+    keys, offsets, members = _ungrouped(sections[b'LEAF'], swap, 'Q')
+    guids = [hex(guid) for guid in members]
+    topology.device_guids_per_switch = {strings[key]: guids[offsets[i]:offsets[i + 1]] for i, key in enumerate(keys)}
+    keys, offsets, members = _ungrouped(sections[b'LINK'], swap, 'I')
+    links = [strings[switch] for switch in members]
+    topology.switch_links = {strings[key]: links[offsets[i]:offsets[i + 1]] for i, key in enumerate(keys)}
+
+    torset_hosts = _array('I', sections[b'TSHT'], swap)
+    torset_ids = _array('I', sections[b'TSID'], swap)
+    topology.host_ip_to_torset = {strings[host]: strings[torset] for host, torset in zip(torset_hosts, torset_ids)}
+    topology.spanning_hosts = [strings[i] for i in _array('I', sections[b'SPAN'], swap)]
+
+
+def snapshot_records(topology) -> list:
+    # Topology file records equivalent to the restored per-switch GUID lists and switch links,
+    # for IBTopology.load_topology(records=...)
+    records = [TopologyRecord(switch, SWITCHES, links) for switch, links in topology.switch_links.items()]
+    records.extend(TopologyRecord(switch, NODES, guids) for switch, guids in topology.device_guids_per_switch.items())
+    return records
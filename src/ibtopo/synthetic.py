@@ -0,0 +1,107 @@
+import argparse
+import itertools
+import random
+from dataclasses import dataclass
+from pathlib import Path
+
+from .cache import GuidCache
+
+# First GUID handed out, in the same range as the GUIDs of tests/data/topology.txt
+BASE_GUID = 0x155dfffd000000
+HEADER = "# Topology file generated by ibtopo.synthetic\n\n"
+
+
+@dataclass
+class SyntheticFabric:
+    hosts: list
+    # guid_to_host_ip[guid] = host, like IBTopology.guid_to_host_ip
+    guid_to_host_ip: dict
+    # device_guids_per_switch[leaf] = [guid, ...] and switch_links[switch] = [switch, ...], like IBTopology
+    device_guids_per_switch: dict
+    switch_links: dict
+    # Hosts of each torset, in the order the torsets were generated
+    torsets: list
+
+
+def host_ip(index) -> str:
+    return f"10.{index // 65536}.{index // 256 % 256}.{index % 256}"
+
+
+def fat_tree(hosts: int, guids_per_host: int = 8, hosts_per_leaf: int = 16, torsets_per_pod: int = 16, spines_per_pod: int = 8) -> SyntheticFabric:
+    # Rail optimized three tier fat-tree:
+    # - GUID r of every host (rail r) is cabled to leaf r of the host's torset, hosts_per_leaf hosts per torset
+    # - each leaf of rail r uplinks to all spines_per_pod spines of rail r in its pod of torsets_per_pod torsets
+    # - spine k of every pod of rail r uplinks to core k of rail r
+    switch_names = (f"ibsw{n}" for n in itertools.count(1))
+    host_ips = [host_ip(index) for index in range(hosts)]
+    # GUIDs of each host are consecutive, as ibstat lists them
+    host_guids = [[hex(BASE_GUID + index * guids_per_host + rail) for rail in range(guids_per_host)] for index in range(hosts)]
+    guid_to_host_ip = {guid: host for host, guids in zip(host_ips, host_guids) for guid in guids}
+    device_guids_per_switch = {}
+    switch_links = {}
+    torsets = []
+    cores = [[next(switch_names) for _ in range(spines_per_pod)] for _ in range(guids_per_host)]
+
+    num_torsets = -(-hosts // hosts_per_leaf)
+    for pod_start in range(0, num_torsets, torsets_per_pod):
+        spines = [[next(switch_names) for _ in range(spines_per_pod)] for _ in range(guids_per_host)]
+        pod_leaves = [[] for _ in range(guids_per_host)]
+        for torset in range(pod_start, min(pod_start + torsets_per_pod, num_torsets)):
+            torset_hosts = range(torset * hosts_per_leaf, min((torset + 1) * hosts_per_leaf, hosts))
+            torsets.append([host_ips[index] for index in torset_hosts])
+            for rail in range(guids_per_host):
+                leaf = next(switch_names)
+                pod_leaves[rail].append(leaf)
+                device_guids_per_switch[leaf] = [host_guids[index][rail] for index in torset_hosts]
+        for rail in range(guids_per_host):
+            for k, spine in enumerate(spines[rail]):
+                switch_links[spine] = pod_leaves[rail] + [cores[rail][k]]
+
+    return SyntheticFabric(host_ips, guid_to_host_ip, device_guids_per_switch, switch_links, torsets)
+
+
+def topology_lines(fabric: SyntheticFabric, seed=None) -> list:
+    # sharp_cmd topology file lines, shuffled when a seed is given since sharp_cmd does not list
+    # switches in any particular order
+    lines = [f"SwitchName={switch} Nodes={','.join(guids)}\n" for switch, guids in fabric.device_guids_per_switch.items()]
+    lines.extend(f"SwitchName={switch} Switches={','.join(links)}\n" for switch, links in fabric.switch_links.items())
+    if seed is not None:
+        random.Random(seed).shuffle(lines)
+    return lines
+
+
+def write_fabric(output_dir: Path, fabric: SyntheticFabric, seed=None) -> None:
+    # hosts.txt, guids.txt, topology.txt and guid_cache.json, as an ibtopo run would leave them
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(output_dir / 'hosts.txt', 'w') as f:
+        f.writelines(f"{host}\n" for host in fabric.hosts)
+    with open(output_dir / 'guids.txt', 'w') as f:
+        f.writelines(f"{guid}\n" for guid in fabric.guid_to_host_ip)
+    with open(output_dir / 'topology.txt', 'w') as f:
+        f.write(HEADER)
+        f.writelines(topology_lines(fabric, seed))
+
+    guids_per_host = {}
+    for guid, host in fabric.guid_to_host_ip.items():
+        guids_per_host.setdefault(host, []).append(guid)
+    cache = GuidCache(output_dir / 'guid_cache.json')
+    for host in fabric.hosts:
+        cache.update(host, guids_per_host.get(host, []))
+    cache.save()
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(prog='ibtopo synthetic', description='Generate a sharp_cmd topology file, hosts file and GUID cache for a fat-tree')
+    parser.add_argument('output_dir', type=str, help='Output directory for generated files')
+    parser.add_argument('hosts', type=int, help='Number of hosts')
+    parser.add_argument('--guids_per_host', type=int, default=8, help='GUIDs (rails) per host (default: 8)')
+    parser.add_argument('--hosts_per_leaf', type=int, default=16, help='Hosts per leaf switch, i.e. per torset (default: 16)')
+    parser.add_argument('--torsets_per_pod', type=int, default=16, help='Torsets sharing the same spine switches (default: 16)')
+    parser.add_argument('--spines_per_pod', type=int, default=8, help='Spine switches per rail in each pod (default: 8)')
+    parser.add_argument('--seed', type=int, default=None, help='Shuffle topology file lines with this seed')
+    args = parser.parse_args(argv)
+
+    fabric = fat_tree(args.hosts, args.guids_per_host, args.hosts_per_leaf, args.torsets_per_pod, args.spines_per_pod)
+    write_fabric(Path(args.output_dir), fabric, args.seed)
+    print(f"{len(fabric.hosts)} hosts, {len(fabric.torsets)} torsets, {len(fabric.device_guids_per_switch)} leaf switches written to {args.output_dir}")
@@ -1,41 +1,316 @@
+from __future__ import annotations
+
+import itertools
+import json
 import logging
+import os
+import shlex
 import subprocess
-from dataclasses import dataclass
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from collections import Counter
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-import fabric
-import matplotlib
+from .cache import DEFAULT_TTL, GuidCache
+from .metrics import RunMetrics
+from .topofile import NODES, SWITCHES, follow_lines, parse_topology, parse_topology_lines
 
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import networkx as nx
+# fabric, matplotlib, networkx and numpy are slow to import, so they are only imported by the
+# code paths that need them: SSH collection, drawing and graph building
+if TYPE_CHECKING:
+    import networkx as nx
 
-logging.basicConfig(level=logging.INFO)
 
+# Seconds sharp_cmd may run before it is killed
+SHARP_CMD_TIMEOUT = 60 * 60
+# Where the sysfs probe reads device ports from
+SYSFS_INFINIBAND = '/sys/class/infiniband'
+# Seconds to establish an SSH connection and to run a command on a host
+CONNECT_TIMEOUT = 10
+COMMAND_TIMEOUT = 60
+# Attempts after the first one for a host, waiting RETRY_BACKOFF, 2 * RETRY_BACKOFF, ... seconds in between
+RETRIES = 2
+RETRY_BACKOFF = 1.0
+
+
+class SharpCmdError(Exception):
+    # sharp_cmd failed, timed out or did not write the topology file
+    pass
+
+
+class RemoteCommandError(Exception):
+    # A host could not be reached or a command on it timed out, after all retries
+    pass
 
-def run_command(command):
-    try:
-        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err = process.communicate()
-        if process.returncode == 0:
-            return out
-        else:
-            return err
-    except Exception as e:
-        return str(e)
 
+class DiscoveryError(Exception):
+    # Hosts were unreachable and the run was not allowed to continue without them
+    pass
+
+
+def normalize_guid(guid) -> str:
+    # Every GUID is keyed in the form sharp_cmd writes to the topology file, without leading zeros
+    # - '0x00155dfffd341acb' (ibstat) / '00155dfffd341acb' / '0x155dfffd341acb' -> '0x155dfffd341acb'
+    # - '0x0c42a10300001234' -> '0xc42a10300001234'
+    return hex(int(guid, 16))
+
+
+def run_remote_cmd(host, username, cmd, connect_timeout=CONNECT_TIMEOUT, command_timeout=COMMAND_TIMEOUT):
+    import fabric
 
-def run_remote_cmd(host, username, cmd):
     try:
-        with fabric.Connection(host, user=username) as conn:
-            result = conn.run(cmd, hide=True)
+        with fabric.Connection(host, user=username, connect_timeout=connect_timeout) as conn:
+            result = conn.run(cmd, hide=True, timeout=command_timeout)
             return {
                 'stdout': result.stdout.strip(),
                 'stderr': result.stderr.strip(),
                 'return_code': result.return_code
             }
     except Exception as e:
-        raise Exception(f"Error running command on host {host}: {str(e)}")
+        raise RemoteCommandError(f"Error running command on host {host}: {str(e)}")
+
+
+class ConnectionPool:
+    # Keeps one SSH session open per host for the duration of a run, so every command after the
+    # first one on a host reuses the existing connection instead of paying a new handshake
+    # - Connecting and running a command are bounded by connect_timeout and command_timeout, and
+    #   are retried up to `retries` times with exponential backoff starting at `backoff` seconds
+    # - No command is started, and no wait goes past, `deadline` seconds after the pool was created
+    def __init__(self, username, private_key=None, connect_timeout=CONNECT_TIMEOUT, command_timeout=COMMAND_TIMEOUT,
+                 retries=RETRIES, backoff=RETRY_BACKOFF, deadline=None):
+        self.username = username
+        self.private_key = private_key
+        self.connect_timeout = connect_timeout
+        self.command_timeout = command_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.deadline = time.perf_counter() + deadline if deadline is not None else None
+        self._connections = {}
+        self._lock = threading.Lock()
+        # latencies[host] = seconds spent connecting to and running commands on host
+        self.latencies = {}
+
+    def _limit(self, timeout):
+        # timeout capped by the time left until the deadline, None for no limit
+        if self.deadline is None:
+            return timeout
+        remaining = max(0.0, self.deadline - time.perf_counter())
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def _get_connection(self, host):
+        import fabric
+
+        with self._lock:
+            conn = self._connections.get(host)
+            if conn is None:
+                connect_kwargs = {'key_filename': str(self.private_key)} if self.private_key else {}
+                conn = fabric.Connection(host, user=self.username, connect_kwargs=connect_kwargs, connect_timeout=self._limit(self.connect_timeout))
+                self._connections[host] = conn
+        return conn
+
+    def _drop_connection(self, host) -> None:
+        # A connection that failed is not reused, the next attempt reconnects
+        with self._lock:
+            conn = self._connections.pop(host, None)
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def run(self, host, cmd) -> dict:
+        start = time.perf_counter()
+        try:
+            for attempt in itertools.count():
+                if self.deadline is not None and time.perf_counter() >= self.deadline:
+                    raise RemoteCommandError(f"Error running command on host {host}: discovery deadline exceeded")
+                try:
+                    # warn=True so a failing command is reported through its return code instead of raising
+                    result = self._get_connection(host).run(cmd, hide=True, warn=True, timeout=self._limit(self.command_timeout))
+                    return {
+                        'stdout': result.stdout.strip(),
+                        'stderr': result.stderr.strip(),
+                        'return_code': result.return_code
+                    }
+                except Exception as e:
+                    self._drop_connection(host)
+                    if attempt >= self.retries:
+                        raise RemoteCommandError(f"Error running command on host {host}: {str(e)}")
+                    delay = self._limit(self.backoff * 2 ** attempt)
+                    logging.warning(f"Retrying host {host} in {delay:.1f}s after error: {str(e)}")
+                    time.sleep(delay)
+        finally:
+            with self._lock:
+                self.latencies[host] = self.latencies.get(host, 0) + time.perf_counter() - start
+
+    def close(self) -> None:
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections = {}
+        for conn in connections:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parse_probe_output(stdout) -> dict:
+    # First line is the hostname, followed by 'State: ...' / 'Port GUID: ...' pairs from ibstat
+    # - State is printed before Port GUID for each port
+    lines = stdout.splitlines()
+    probe = {'hostname': lines[0].strip() if lines else '', 'guids': [], 'port_state': {}}
+    state = None
+    for line in lines[1:]:
+        key, _, value = line.partition(':')
+        key = key.strip()
+        if key == 'State':
+            state = value.strip()
+        elif key == 'Port GUID':
+            guid = normalize_guid(value.strip())
+            probe['guids'].append(guid)
+            probe['port_state'][guid] = state
+    return probe
+
+
+def sysfs_probe_cmd(ibdevice_pattern, root=SYSFS_INFINIBAND) -> str:
+    # A single grep printing 'path:value' for the hostname and for the GID 0 (subnet prefix + port
+    # GUID) and state of every port of the devices matching ibdevice_pattern
+    ports = f"{shlex.quote(str(root))}/*{ibdevice_pattern}*/ports/*"
+    return f"grep -sH . /proc/sys/kernel/hostname {ports}/gids/0 {ports}/state"
+
+
+def parse_sysfs_probe(stdout) -> dict:
+    # Same result as parse_probe_output from the output of sysfs_probe_cmd
+    # - '.../mlx5_ib0/ports/1/gids/0:fe80:0000:0000:0000:0015:5dff:fd34:1acb' -> GUID 0x155dfffd341acb
+    # - '.../mlx5_ib0/ports/1/state:4: ACTIVE' -> 'Active', as ibstat prints it
+    probe = {'hostname': '', 'guids': [], 'port_state': {}}
+    ports = {}
+    for line in stdout.splitlines():
+        path, _, value = line.partition(':')
+        if path == '/proc/sys/kernel/hostname':
+            probe['hostname'] = value.strip()
+        elif path.endswith('/gids/0'):
+            ports.setdefault(path[:-len('/gids/0')], {})['guid'] = normalize_guid(value.replace(':', '')[-16:])
+        elif path.endswith('/state'):
+            ports.setdefault(path[:-len('/state')], {})['state'] = value.partition(':')[2].strip().capitalize()
+    for port in ports.values():
+        if 'guid' in port:
+            probe['guids'].append(port['guid'])
+            probe['port_state'][port['guid']] = port.get('state')
+    return probe
+
+
+def switch_adjacency(switch_links) -> dict:
+    # Undirected switch -> set of switches, from links that may be listed from either end
+    adjacency = {}
+    for switch, connected_switches in switch_links.items():
+        for conn_switch in connected_switches:
+            adjacency.setdefault(switch, set()).add(conn_switch)
+            adjacency.setdefault(conn_switch, set()).add(switch)
+    return adjacency
+
+
+def leaf_torsets(device_guids_per_switch, guid_to_host_ip, host_ip_to_torset) -> dict:
+    # Torset of each leaf switch, leaves without any known host are left out
+    torset_of_leaf = {}
+    for switch, guids in device_guids_per_switch.items():
+        for guid in guids:
+            host_ip = guid_to_host_ip.get(guid)
+            if host_ip in host_ip_to_torset:
+                torset_of_leaf[switch] = host_ip_to_torset[host_ip]
+                break
+    return torset_of_leaf
+
+
+def read_torsets(output_dir: Path) -> dict:
+    # Torsets from torsets.json, or from the torset-NN_hosts.txt files of older output directories
+    from .output import read_torset_map
+
+    torsets = read_torset_map(output_dir)
+    if torsets is not None:
+        return torsets
+    torsets = {}
+    for torset_file in sorted(Path(output_dir).glob('torset-*_hosts.txt')):
+        with open(torset_file, 'r') as f:
+            torsets[torset_file.name[:-len('_hosts.txt')]] = [host.strip() for host in f if host.strip()]
+    return torsets
+
+
+def read_guid_map(output_dir: Path, guid_cache: Path = None) -> dict:
+    # GUID -> host map of a run from topology.snapshot, which is written whatever the GUID source and
+    # also without a GUID cache. The GUID cache (default: <output_dir>/guid_cache.json) is only read
+    # for output directories without a snapshot
+    from .snapshot import load_guid_to_host
+
+    snapshot = Path(output_dir) / 'topology.snapshot'
+    if snapshot.exists():
+        return load_guid_to_host(snapshot)
+    return GuidCache(guid_cache or Path(output_dir) / 'guid_cache.json').guid_to_host()
+
+
+def write_torsets(output_dir: Path, torsets: dict) -> None:
+    # One torset-NN_hosts.txt file per torset with a host per line
+    from .output import atomic_open
+
+    for torset, hosts in torsets.items():
+        with atomic_open(Path(output_dir) / f"{torset}_hosts.txt") as f:
+            f.write(''.join(f"{host}\n" for host in hosts))
+
+
+class UnionFind:
+    # Disjoint sets with path halving and union by size, near-constant time per operation
+    def __init__(self):
+        # Insertion order of parent is the order elements were first seen
+        self.parent = {}
+        self.size = {}
+
+    def add(self, x) -> None:
+        if x not in self.parent:
+            self.parent[x] = x
+            self.size[x] = 1
+
+    def find(self, x):
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return root_a
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size[root_b]
+        return root_a
+
+    def union_all(self, items):
+        # Union a whole group at once, elements not seen before are attached straight to the root
+        parent, size = self.parent, self.size
+        items = iter(items)
+        root = next(items)
+        if root in parent:
+            root = self.find(root)
+        else:
+            parent[root] = root
+            size[root] = 1
+        for x in items:
+            if x not in parent:
+                parent[x] = root
+                size[root] += 1
+            elif parent[x] != root:
+                root = self.union(root, x)
+        return root
 
 
 @dataclass
@@ -49,6 +324,54 @@ class TopologyConfig:
     ibdevice_pattern: str
     username: str
     pkey_path: Path
+    # Number of hosts queried concurrently when collecting GUIDs
+    parallel: int = 1
+    # Collect hostname and port state along with GUIDs in a single exec per host
+    probe: bool = False
+    # GUID cache file, defaults to guid_cache.json in output_dir. Cached GUIDs older than
+    # cache_ttl seconds are refreshed, refresh_guids ignores the cache for this run
+    guid_cache: Path = None
+    cache_ttl: float = DEFAULT_TTL
+    refresh_guids: bool = False
+    use_guid_cache: bool = True
+    # Read the topology file through mmap instead of buffered reads
+    mmap_topology: bool = False
+    # Build the array backed FabricGraph instead of an nx.Graph
+    compact_graph: bool = False
+    # Draw every switch and GUID ('full') or torsets and the switch tiers above them ('aggregate')
+    draw_mode: str = 'full'
+    draw: bool = True
+    # Graph export formats, 'dot' and/or 'graphml'
+    export_formats: list = field(default_factory=list)
+    # Precompute leaf and torset hop distance matrices
+    hop_distances: bool = True
+    # Write topology.snapshot, see IBTopology.save_snapshot
+    snapshot: bool = True
+    # Run under cProfile and write profile.prof
+    profile: bool = False
+    # Parse the topology file while sharp_cmd writes it (not with mmap_topology)
+    stream_topology: bool = True
+    # Seconds sharp_cmd may run, None for no limit
+    sharp_cmd_timeout: float = SHARP_CMD_TIMEOUT
+    # Collect GUIDs over SSH from every host ('ssh') or from one ibnetdiscover/iblinkinfo dump ('fabric_dump')
+    guid_source: str = 'ssh'
+    # Saved fabric dump, ibnetdiscover is run when not set
+    fabric_dump: Path = None
+    # Read GUIDs and port states on hosts with ibstat ('ibstat') or from sysfs ('sysfs')
+    probe_mode: str = 'ibstat'
+    # SSH timeouts and retries per host, see ConnectionPool
+    connect_timeout: float = CONNECT_TIMEOUT
+    command_timeout: float = COMMAND_TIMEOUT
+    retries: int = RETRIES
+    retry_backoff: float = RETRY_BACKOFF
+    # Seconds GUID collection may take in total, None for no limit
+    discovery_deadline: float = None
+    # Continue without unreachable hosts instead of failing the run
+    partial_results: bool = False
+    # Also write a torset-NN_hosts.txt file per torset next to torsets.json
+    torset_files: bool = False
+    # Write the Slurm topology.conf
+    slurm_topology: bool = True
 
 
 class IBTopology:
@@ -56,112 +379,344 @@ class IBTopology:
     output_dir: Path
     # Output file for guids from ibstat across cluster
     guids_file: Path
-    guid_to_host_ip: dict = {}
     # guid_map[guid] = host
+    guid_to_host_ip: dict
     hosts_file: Path
     # Hosts in cluster read from hosts file
-    hosts: list = []
+    hosts: list
     # Output topology file from sharp_cmd
     topo_file: Path
-    # List of guids attached to a single switch extracted from topology file (filtered_node_entries.txt)
-    device_guids_per_switch: list = []
+    # Guids attached to each leaf switch extracted from topology file (filtered_node_entries.txt)
+    # device_guids_per_switch[switch] = [guid, ...]
+    device_guids_per_switch: dict
+    # Switches connected to each switch extracted from topology file
+    # switch_links[switch] = [switch, ...]
+    switch_links: dict
     # Map hosts to torsets
-    host_ip_to_torset: dict = {}
-    # Entire graph of topology
+    host_ip_to_torset: dict
+    # Hosts whose GUIDs are attached to leaf switches serving different sets of hosts
+    spanning_hosts: list
+    # Entire graph of topology, FabricGraph when loaded with compact=True
     graph: nx.Graph
     # Map torsets to hosts
-    torsets = {}
+    torsets: dict
+    # Runtime and exit status of the last sharp_cmd run
+    sharp_cmd_status: dict
+    # failed_hosts[host] = {'reason': ..., 'unreachable': ...} for hosts GUIDs could not be collected from
+    failed_hosts: dict
 
-    def __init__(self, output_dir: Path, hosts_file: Path, sharp_cmd_path: Path, sharp_smx_ucx_interface: str='mlx5_ib0:1', ibdevice_pattern='mlx5_ib'):
+    def __init__(self, output_dir: Path, hosts_file: Path, sharp_cmd_path: Path, sharp_smx_ucx_interface: str='mlx5_ib0:1', ibdevice_pattern='mlx5_ib', probe_mode='ibstat'):
         self.hosts_file = hosts_file
         self.sharp_cmd_path = sharp_cmd_path
         self.sharp_smx_ucx_interface = sharp_smx_ucx_interface
         # InfiniBand device pattern to match
         self.ibdevice_pattern = ibdevice_pattern
+        # Read GUIDs and port states on hosts with the ibstat pipeline ('ibstat') or from sysfs ('sysfs')
+        self.probe_mode = probe_mode
+        self.sysfs_root = SYSFS_INFINIBAND
         self.output_dir = output_dir
         self.guids_file = output_dir / 'guids.txt'
         self.topo_file = output_dir / 'topology.txt'
+        self._init_state()
 
         self.hosts = self._read_hosts_file()
 
+    def _init_state(self) -> None:
+        # Containers are created per instance, so topologies of different fabrics never share state
+        self.guid_to_host_ip = {}
+        self.hosts = []
+        self.device_guids_per_switch = {}
+        self.switch_links = {}
+        self.host_ip_to_torset = {}
+        self.spanning_hosts = []
+        self.torsets = {}
+        self.sharp_cmd_status = {}
+        self.failed_hosts = {}
+
     def _read_hosts_file(self) -> list:
         with open(self.hosts_file, 'r') as f:
             hosts = [host.strip() for host in f.readlines()]
 
         return hosts
 
-    def _fetch_guids(self, host, username, private_key, ibdevice_pattern) -> dict:
+    def _fetch_guids(self, host, username, private_key, ibdevice_pattern, pool=None) -> dict:
         cmd = f"ibstatus | grep {ibdevice_pattern} | cut -d ' ' -f 3 | xargs -I% ibstat '%' | grep 'Port GUID' | cut -d ':' -f 2"
+        if pool is not None:
+            return pool.run(host, cmd)
         return run_remote_cmd(host, username, cmd)
 
-    def fetch_guids(self, username, private_key) -> dict:
+    def _query_host(self, host, query, *args):
+        # query(*args), or None when the host could not be reached so the other hosts carry on
+        try:
+            return query(*args)
+        except Exception as e:
+            logging.error(str(e))
+            self.failed_hosts[host] = {'reason': str(e), 'unreachable': True}
+            return None
+
+    def _fetch_host_guids(self, host, username, private_key, pool=None) -> list:
+        if self.probe_mode == 'sysfs':
+            probe = self._sysfs_probe_host(host, pool)
+            return probe['guids'] if probe is not None else None
+        result = self._fetch_guids(host, username, private_key, self.ibdevice_pattern, pool)
+        if result['return_code'] != 0:
+            logging.error(f"Error fetching GUID for host {host}")
+            self.failed_hosts[host] = {'reason': f"exit status {result['return_code']}", 'unreachable': False}
+            return None
+        # ibstat prints 0x0099999999999999 where sharp_cmd prints 0x99999999999999
+        return [normalize_guid(guid) for guid in result['stdout'].split()]
+
+    def fetch_guids(self, username, private_key, parallel: int = 1, pool: ConnectionPool = None, cache: GuidCache = None) -> dict:
+        # With a cache, only hosts that are new, expired or failed last time are queried
+        hosts = self.hosts if cache is None else cache.stale_hosts(self.hosts)
+        if cache is not None:
+            logging.info(f"Using cached GUIDs for {len(self.hosts) - len(hosts)} hosts, querying {len(hosts)} hosts")
+
+        host_guids = {}
+        # Sessions are reused from `pool` when given, otherwise a pool is opened for this call only
+        with ConnectionPool(username, private_key) if pool is None else nullcontext(pool) as pool:
+            # Up to `parallel` hosts are queried at once
+            with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+                results = executor.map(lambda host: self._query_host(host, self._fetch_host_guids, host, username, private_key, pool), hosts)
+                for host, node_guids in zip(hosts, results):
+                    host_guids[host] = node_guids
+
+        if cache is not None:
+            for host, node_guids in host_guids.items():
+                cache.update(host, node_guids)
+            cache.save()
+            host_guids = {host: cache.guids(host) for host in self.hosts}
+
+        # Results are merged in hosts file order so the guid -> host map (and guids.txt)
+        # does not depend on which host answers first or whether it came from the cache
         guids = {}
         for host in self.hosts:
-            result = self._fetch_guids(host, username, private_key)
-            if result['return_code'] == 0:
-                # Querying GUIDs from ibstat will have pattern 0x0099999999999999, but Sharp will return 0x99999999999999
-                # - So we need to remove the leading 00 after 0x
-                # - Split the 8 GUIDs and use as keys with value being the host
-                node_guids = result['stdout'].replace('0x00', '0x').split()
-                for node_guid in node_guids:
-                    guids[node_guid] = host
-            else:
-                logging.error(f"Error fetching GUID for host {host}")
+            # Split the 8 GUIDs and use as keys with value being the host. Cache entries written by
+            # earlier versions may not be normalized
+            for node_guid in host_guids.get(host) or []:
+                guids[normalize_guid(node_guid)] = host
         return guids
 
+    def _sysfs_probe_host(self, host, pool) -> dict:
+        # Hostname, GUIDs and port states read from sysfs by one grep, without spawning ibstat
+        result = pool.run(host, sysfs_probe_cmd(self.ibdevice_pattern, self.sysfs_root))
+        probe = parse_sysfs_probe(result['stdout'])
+        # grep also exits with an error when a glob matches nothing, only the ports found matter
+        if not probe['guids']:
+            logging.error(f"Error probing host {host}: no {self.ibdevice_pattern} ports found in {self.sysfs_root}")
+            self.failed_hosts[host] = {'reason': f"no {self.ibdevice_pattern} ports found", 'unreachable': False}
+            return None
+        return probe
+
+    def _probe_host(self, host, pool) -> dict:
+        if self.probe_mode == 'sysfs':
+            return self._sysfs_probe_host(host, pool)
+        # Hostname, port states and port GUIDs in a single remote exec
+        cmd = f"hostname; ibstatus | grep {self.ibdevice_pattern} | cut -d ' ' -f 3 | xargs -I% ibstat '%' | grep -E 'State:|Port GUID'"
+        result = pool.run(host, cmd)
+        if result['return_code'] != 0:
+            logging.error(f"Error probing host {host}")
+            self.failed_hosts[host] = {'reason': f"exit status {result['return_code']}", 'unreachable': False}
+            return None
+        return parse_probe_output(result['stdout'])
+
+    def probe_hosts(self, username, private_key, parallel: int = 1, pool: ConnectionPool = None) -> dict:
+        probes = {}
+        with ConnectionPool(username, private_key) if pool is None else nullcontext(pool) as pool:
+            with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+                results = executor.map(lambda host: self._query_host(host, self._probe_host, host, pool), self.hosts)
+                for host, probe in zip(self.hosts, results):
+                    if probe is None:
+                        continue
+                    probes[host] = probe
+                    inactive = [guid for guid, state in probe['port_state'].items() if state != 'Active']
+                    if inactive:
+                        logging.warning(f"Host {host} ({probe['hostname']}) has ports that are not Active: {', '.join(inactive)}")
+        return probes
+
+    @staticmethod
+    def guids_from_probes(probes) -> dict:
+        guids = {}
+        for host, probe in probes.items():
+            for guid in probe['guids']:
+                guids[guid] = host
+        return guids
+
+    def guids_from_fabric_dump(self, dump_file: Path = None) -> dict:
+        # guid -> host from the node descriptions of one ibnetdiscover or iblinkinfo dump instead
+        # of SSH to every host. Without dump_file, ibnetdiscover is run here and saved to the output directory
+        from .fabricdump import guids_from_ports, parse_fabric_dump, run_ibnetdiscover
+
+        if dump_file is None:
+            dump_file = Path(self.output_dir) / 'ibnetdiscover.txt'
+            run_ibnetdiscover(dump_file)
+            logging.info(f"Fabric dump written to {dump_file}")
+        return guids_from_ports(parse_fabric_dump(dump_file), self.hosts, self.ibdevice_pattern)
+
     def write_guids_to_file(self, guids_file) -> None:
-        with open(guids_file, 'w') as f:
-            for guid in self.guid_to_host_ip.keys():
-                f.write(f"{guid}\n")
+        from .output import atomic_open
+
+        with atomic_open(guids_file) as f:
+            f.write(''.join(f"{guid}\n" for guid in self.guid_to_host_ip))
+
+    def _pending_topo_file(self) -> Path:
+        # sharp_cmd writes here and the file is renamed to topo_file once sharp_cmd succeeded, so a
+        # failed run keeps the previous topology file and readers never see a partial one
+        topo_file = Path(self.topo_file)
+        return topo_file.with_name(f".{topo_file.name}.tmp")
+
+    def _start_sharp_cmd(self) -> subprocess.Popen:
+        # No shell: the interface is passed through the environment, and the output of sharp_cmd goes
+        # to sharp_cmd.log instead of being buffered in memory
+        args = [str(self.sharp_cmd_path), 'topology', '--ib-dev', self.sharp_smx_ucx_interface,
+                '--guids_file', str(self.guids_file), '--topology_file', str(self._pending_topo_file())]
+        env = dict(os.environ, SHARP_SMX_UCX_INTERFACE=self.sharp_smx_ucx_interface)
+        # A file left by an interrupted run must not be mistaken for the new one
+        self._pending_topo_file().unlink(missing_ok=True)
+        with open(Path(self.output_dir) / 'sharp_cmd.log', 'wb') as log:
+            return subprocess.Popen(args, env=env, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+
+    def _finish_sharp_cmd(self, process, start, timeout=None) -> None:
+        # Records how sharp_cmd ran and moves the topology file it wrote into place, or raises
+        # SharpCmdError and leaves the previous topology file as it was
+        # - timeout is set when sharp_cmd was killed for running longer than that
+        self.sharp_cmd_status = {'seconds': time.perf_counter() - start, 'return_code': process.returncode, 'timed_out': timeout is not None}
+        pending = self._pending_topo_file()
+        if timeout is not None:
+            pending.unlink(missing_ok=True)
+            raise SharpCmdError(f"sharp_cmd did not finish within {timeout}s, see {Path(self.output_dir) / 'sharp_cmd.log'}")
+        if process.returncode != 0:
+            pending.unlink(missing_ok=True)
+            with open(Path(self.output_dir) / 'sharp_cmd.log', 'r', errors='replace') as f:
+                output = f.read()[-2000:].strip()
+            raise SharpCmdError(f"sharp_cmd exited with status {process.returncode}: {output}")
+        if not pending.exists():
+            raise SharpCmdError(f"sharp_cmd did not write {self.topo_file}")
+        os.replace(pending, self.topo_file)
 
-    def create_topo_file(self) -> None:
-        cmd = f"SHARP_SMX_UCX_INTERFACE={self.sharp_smx_ucx_interface} {self.sharp_cmd_path} topology --ib-dev {self.sharp_smx_ucx_interface} --guids_file {self.guids_file} --topology_file {self.topo_file}"
-        run_command(cmd)
+    def create_topo_file(self, timeout: float = SHARP_CMD_TIMEOUT) -> None:
+        start = time.perf_counter()
+        process = self._start_sharp_cmd()
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            self._finish_sharp_cmd(process, start, timeout)
+        self._finish_sharp_cmd(process, start)
         logging.info(f"Topology file generated at {self.topo_file}")
 
-    def _populate_device_guids_per_switch(self) -> list:
-        guids_per_switch = []
-        with open(self.topo_file, 'r') as f:
-            for line in f:
-                if 'Nodes=' not in line:
-                    continue
+    def stream_topo_file(self, timeout: float = SHARP_CMD_TIMEOUT, poll_interval: float = 0.05):
+        # Runs sharp_cmd and yields the records of the topology file as sharp_cmd writes them, so
+        # load_topology(records=...) builds the graph while the file is being generated
+        # - Raises SharpCmdError once the records are exhausted if sharp_cmd failed
+        start = time.perf_counter()
+        process = self._start_sharp_cmd()
+
+        def finished() -> bool:
+            if process.poll() is not None:
+                return True
+            if timeout is not None and time.perf_counter() - start > timeout:
+                process.kill()
+                process.wait()
+                self._finish_sharp_cmd(process, start, timeout)
+            return False
+
+        try:
+            yield from parse_topology_lines(follow_lines(self._pending_topo_file(), finished, poll_interval))
+        finally:
+            # The consumer stopped early or failed
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+                self._pending_topo_file().unlink(missing_ok=True)
+        self._finish_sharp_cmd(process, start)
+
+    def _populate_device_guids_per_switch(self) -> dict:
+        guids_per_switch = {}
+        for record in parse_topology(self.topo_file):
+            if record.kind == NODES:
                 # 'SwitchName=ibsw2 Nodes=0x155dfffd341acb,0x155dfffd341b0b'
-                guids_per_switch.append(line.strip().split(' ')[1].split('=')[1])
+                guids_per_switch.setdefault(record.switch, []).extend(record.members)
         return guids_per_switch
 
+    @staticmethod
+    def _add_to_graph(graph, record) -> None:
+        if record.kind == SWITCHES:
+            graph.add_edges_from((record.switch, conn_switch) for conn_switch in record.members)
+        elif record.kind == NODES:
+            graph.add_nodes_from(record.members, type='node')
+            graph.add_edges_from(((record.switch, node) for node in record.members), type='switch-to-node')
+
     def _populate_graph(self) -> nx.Graph:
+        import networkx as nx
+
         graph = nx.Graph()
-        with open(self.topo_file, 'r') as f:
-            for line in f.readlines():
-                if line.startswith("#") or not line.strip():
-                    continue
-                parts = line.split()
-                switch_name = parts[0].split("=")[1]
-                if len(parts) > 1:
-                    connections = parts[1].split("=")
-                    if connections[0] == "Switches":
-                        connected_switches = connections[1].split(",")
-                        for conn_switch in connected_switches:
-                            graph.add_edge(switch_name, conn_switch)
-                    elif connections[0] == "Nodes":
-                        connected_nodes = connections[1].split(",")
-                        for node in connected_nodes:
-                            graph.add_node(node, type='node')
-                            graph.add_edge(switch_name, node, type='switch-to-node')
+        for record in parse_topology(self.topo_file):
+            self._add_to_graph(graph, record)
         return graph
 
+    def load_topology(self, records=None, use_mmap: bool = False, compact: bool = False) -> None:
+        # Single pass over the topology file (or `records` already parsed from it) that feeds the
+        # per-switch GUID lists, the switch links and the graph at the same time
+        # - compact=True builds a FabricGraph instead of an nx.Graph
+        if records is None:
+            records = parse_topology(self.topo_file, use_mmap)
+        self.device_guids_per_switch = {}
+        self.switch_links = {}
+        if compact:
+            from .graph import FabricGraph
+            graph = FabricGraph()
+        else:
+            import networkx as nx
+            graph = nx.Graph()
+        add_to_graph = graph.add_record if compact else lambda record: self._add_to_graph(graph, record)
+        for record in records:
+            if record.kind == NODES:
+                self.device_guids_per_switch.setdefault(record.switch, []).extend(record.members)
+            elif record.kind == SWITCHES:
+                self.switch_links.setdefault(record.switch, []).extend(record.members)
+            add_to_graph(record)
+        if compact:
+            graph.finalize()
+        self.graph = graph
+
     def identify_torsets(self) -> dict:
-        # torset_node_map equivalent
+        # A torset is a connected component of the host <-> leaf switch graph: hosts sharing a leaf
+        # switch are unioned, so switches that share a host end up in the same torset
+        components = UnionFind()
+        # Set of hosts served by the first leaf switch seen for each host
+        first_switch_hosts = {}
+        seen_host_sets = set()
+        spanning_hosts = set()
+        host_ip_of = self.guid_to_host_ip.get
+        for device_guids in self.device_guids_per_switch.values():
+            # GUIDs of hosts that were not collected (failed or unreachable) are left out
+            switch_hosts = [host_ip for host_ip in map(host_ip_of, device_guids) if host_ip is not None]
+            if not switch_hosts:
+                continue
+            switch_host_set = frozenset(switch_hosts)
+            # Every rail of a torset serves the same hosts, only the first such switch adds information
+            if switch_host_set in seen_host_sets:
+                continue
+            seen_host_sets.add(switch_host_set)
+            components.union_all(switch_hosts)
+            for host_ip in switch_host_set:
+                if first_switch_hosts.setdefault(host_ip, switch_host_set) is not switch_host_set:
+                    spanning_hosts.add(host_ip)
+
+        self.spanning_hosts = [host_ip for host_ip in components.parent if host_ip in spanning_hosts]
+        if self.spanning_hosts:
+            logging.warning(f"{len(self.spanning_hosts)} hosts span leaf switches serving different hosts: {', '.join(self.spanning_hosts)}")
+
+        # Torsets are numbered in the order they first appear in the topology file
         host_ip_to_torset = {}
-        for device_guids_one_switch in self.device_guids_per_switch:
-            device_guids = device_guids_one_switch.strip().split(",")
-            # increment torset index for each new torset
-            torset_index = len(set(host_ip_to_torset.values()))
-            for guid in device_guids:
-                host_ip = self.guid_to_host_ip[guid]
-                if host_ip in host_ip_to_torset:
-                    continue
-                host_ip_to_torset[host_ip] = f"torset-{torset_index:02}"
+        torset_names = {}
+        for host_ip in components.parent:
+            root = components.find(host_ip)
+            if root not in torset_names:
+                torset_names[root] = f"torset-{len(torset_names):02}"
+            host_ip_to_torset[host_ip] = torset_names[root]
         return host_ip_to_torset
 
     def group_hosts_by_torset(self) -> dict:
@@ -174,51 +729,241 @@ class IBTopology:
         return torsets
 
     def write_hosts_by_torset(self) -> None:
-        for torset, hosts in self.torsets.items():
-            output_file = self.output_dir / f"{torset}_hosts.txt"
-            with open(output_file, 'w') as f:
-                for host in hosts:
-                    f.write(f"{host}\n")
+        write_torsets(self.output_dir, self.torsets)
 
-    def draw_topology(self) -> None:
-        pos = nx.spring_layout(self.graph, k=0.5, iterations=100)
-        nx.draw(self.graph, pos, with_labels=True)
-        plt.savefig(self.output_dir / 'topology.png')
+    def write_torset_outputs(self, torset_files: bool = False, slurm_topology: bool = True) -> None:
+        # torsets.json with every torset, the Slurm topology.conf and, with torset_files=True, the
+        # per-torset files. Each file is replaced atomically, see output.atomic_open
+        from .output import write_slurm_topology, write_torset_map
 
+        write_torset_map(self.output_dir, self.torsets)
+        if slurm_topology:
+            write_slurm_topology(self.output_dir, self.device_guids_per_switch, self.switch_links, self.guid_to_host_ip, self.host_ip_to_torset)
+        if torset_files:
+            self.write_hosts_by_torset()
 
-def main(topo_config: TopologyConfig):
-    hosts_path = topo_config.hosts_file
-    sharp_if = topo_config.sharp_smx_ucx_interface
-    sharp_cmd = topo_config.sharp_cmd_path
-    ibdevice_pattern = topo_config.infiniband_pattern
+    def save_snapshot(self, path: Path = None) -> Path:
+        # Single versioned binary file with the GUID map, per-switch GUID lists, switch links and
+        # torsets, see snapshot.py
+        from .snapshot import save_snapshot
+
+        path = path or self.output_dir / 'topology.snapshot'
+        save_snapshot(self, path)
+        return path
+
+    @classmethod
+    def from_state(cls, device_guids_per_switch: dict, switch_links: dict, guid_to_host_ip: dict) -> IBTopology:
+        # Topology without a hosts file, from per-switch GUID lists, switch links and the GUID map
+        # already read from the outputs of a run. Torsets are left to identify_torsets
+        topology = cls.__new__(cls)
+        topology._init_state()
+        topology.probe_mode = 'ibstat'
+        topology.sysfs_root = SYSFS_INFINIBAND
+        topology.device_guids_per_switch = device_guids_per_switch
+        topology.switch_links = switch_links
+        topology.guid_to_host_ip = guid_to_host_ip
+        return topology
+
+    @classmethod
+    def from_snapshot(cls, path: Path, build_graph: bool = False, compact: bool = True) -> IBTopology:
+        # Restore a topology without the hosts file, SSH or sharp_cmd. The graph is only rebuilt
+        # (from the per-switch GUID lists and switch links) when build_graph=True
+        from .snapshot import load_snapshot, snapshot_records
+
+        topology = cls.from_state({}, {}, {})
+        load_snapshot(topology, path)
+        topology.torsets = topology.group_hosts_by_torset()
+        if build_graph:
+            topology.load_topology(records=snapshot_records(topology), compact=compact)
+        return topology
+
+    def write_distance_matrices(self) -> None:
+        # leaf_distances.npy / torset_distances.npy and their index files, see distances.DistanceMatrix
+        from .distances import leaf_distances, torset_distances
+
+        leaf_matrix = leaf_distances(self.device_guids_per_switch, self.switch_links)
+        leaf_matrix.save(self.output_dir, 'leaf')
+        torset_distances(leaf_matrix, self.device_guids_per_switch, self.guid_to_host_ip, self.host_ip_to_torset).save(self.output_dir, 'torset')
+
+    def aggregate_graph(self) -> nx.Graph:
+        from .render import aggregate_graph
+
+        return aggregate_graph(self.device_guids_per_switch, self.switch_links, self.guid_to_host_ip, self.host_ip_to_torset)
+
+    def _graph_for(self, mode) -> nx.Graph:
+        # 'full' is every switch and GUID, 'aggregate' collapses GUIDs and leaf switches into torsets
+        if mode == 'aggregate':
+            return self.aggregate_graph()
+        # FabricGraph converts itself, an nx.Graph is used as is
+        return self.graph.to_networkx() if hasattr(self.graph, 'to_networkx') else self.graph
+
+    def draw_topology(self, mode: str = 'full') -> None:
+        import matplotlib
+
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        import networkx as nx
+
+        from .render import cached_layout
+
+        graph = self._graph_for(mode)
+        # Layouts are cached next to the image and reused as long as the graph does not change
+        layout_cache = self.output_dir / f'topology_layout_{mode}.json'
+        if mode == 'aggregate':
+            # Deterministic layered layout: torsets at the bottom, each switch tier above
+            pos = cached_layout(graph, 'multipartite', lambda g: nx.multipartite_layout(g, subset_key='tier', align='horizontal'), layout_cache)
+            widest_tier = max(Counter(tier for _, tier in graph.nodes(data='tier')).values(), default=1)
+            fig, ax = plt.subplots(figsize=(min(max(8, widest_tier * 0.2), 40), 8))
+            nx.draw(graph, pos, ax=ax, with_labels=widest_tier <= 100, node_size=50, width=0.2, font_size=6)
+        else:
+            pos = cached_layout(graph, 'spring', lambda g: nx.spring_layout(g, k=0.5, iterations=100), layout_cache)
+            fig, ax = plt.subplots()
+            nx.draw(graph, pos, ax=ax, with_labels=True)
+        fig.savefig(self.output_dir / 'topology.png')
+        plt.close(fig)
+
+    def export_topology(self, fmt: str, mode: str = 'full') -> Path:
+        import networkx as nx
+
+        from .render import write_dot
+
+        graph = self._graph_for(mode)
+        if fmt == 'dot':
+            path = self.output_dir / 'topology.dot'
+            write_dot(graph, path)
+        elif fmt == 'graphml':
+            path = self.output_dir / 'topology.graphml'
+            nx.write_graphml(graph, path)
+        else:
+            raise ValueError(f"Unsupported export format {fmt}")
+        return path
+
+
+def write_failed_hosts(path: Path, failed_hosts: dict) -> None:
+    # {"hosts": {"10.193.0.4": {"reason": "...", "unreachable": true}}}
+    with open(path, 'w') as f:
+        json.dump({'hosts': failed_hosts}, f, indent=2)
+
+
+def collect_guids_over_ssh(ib_topology: IBTopology, topo_config: TopologyConfig, metrics: RunMetrics) -> None:
     username = topo_config.username
     pkey_path = topo_config.pkey_path
+    parallel = topo_config.parallel
     output_dir = topo_config.output_dir
 
-    output_dir.mkdir(exist_ok=True)
+    pool = ConnectionPool(username, pkey_path, topo_config.connect_timeout, topo_config.command_timeout,
+                          topo_config.retries, topo_config.retry_backoff, topo_config.discovery_deadline)
+    with metrics.phase('collect_guids'), pool:
+        try:
+            if topo_config.probe:
+                probes = ib_topology.probe_hosts(username, pkey_path, parallel, pool)
+                ib_topology.guid_to_host_ip = ib_topology.guids_from_probes(probes)
+            else:
+                cache = None
+                if topo_config.use_guid_cache:
+                    cache_path = topo_config.guid_cache or output_dir / 'guid_cache.json'
+                    cache = GuidCache(cache_path, 0 if topo_config.refresh_guids else topo_config.cache_ttl)
+                ib_topology.guid_to_host_ip = ib_topology.fetch_guids(username, pkey_path, parallel, pool, cache)
+        finally:
+            metrics.host_latencies = dict(pool.latencies)
+
+    # Written on every run, so a report left by an earlier run is not mistaken for this one
+    write_failed_hosts(output_dir / 'failed_hosts.json', ib_topology.failed_hosts)
+    unreachable = [host for host, failure in ib_topology.failed_hosts.items() if failure['unreachable']]
+    if unreachable:
+        message = f"{len(unreachable)} hosts could not be reached: {', '.join(unreachable)}, see {output_dir / 'failed_hosts.json'}"
+        if not topo_config.partial_results:
+            raise DiscoveryError(f"{message}. Use --partial_results to continue without them")
+        logging.warning(f"{message}. Continuing without them")
+
 
-    ib_topology = IBTopology(output_dir, hosts_path, sharp_cmd, sharp_if, ibdevice_pattern)
-    ib_topology.guid_to_host_ip = ib_topology.fetch_guids(username, pkey_path)
+def run(topo_config: TopologyConfig, metrics: RunMetrics) -> None:
+    hosts_path = topo_config.hosts_file
+    sharp_if = topo_config.sharp_smx_ucx_interface
+    sharp_cmd = topo_config.sharp_cmd_path
+    ibdevice_pattern = topo_config.ibdevice_pattern
+    output_dir = topo_config.output_dir
+
+    ib_topology = IBTopology(output_dir, hosts_path, sharp_cmd, sharp_if, ibdevice_pattern, topo_config.probe_mode)
+    if topo_config.guid_source == 'fabric_dump':
+        with metrics.phase('collect_guids'):
+            ib_topology.guid_to_host_ip = ib_topology.guids_from_fabric_dump(topo_config.fabric_dump)
+    else:
+        collect_guids_over_ssh(ib_topology, topo_config, metrics)
     logging.info("Finished collecting InfiniBand device GUIDs from hosts")
-    ib_topology.write_guids_to_file(ib_topology.guids_file)
+    with metrics.phase('write_guids'):
+        ib_topology.write_guids_to_file(ib_topology.guids_file)
     logging.info(f"GUIDs written to {ib_topology.guids_file}")
-    ib_topology.create_topo_file()
-    logging.info(f"Topology file generated at {ib_topology.topo_file}")
-    ib_topology.device_guids_per_switch = ib_topology._populate_device_guids_per_switch()
-    ib_topology.graph = ib_topology._populate_graph()
-    logging.info("Populated graph from topology file")
-    ib_topology.host_ip_to_torset = ib_topology.identify_torsets()
+    if topo_config.stream_topology and not topo_config.mmap_topology:
+        # The topology file is parsed while sharp_cmd writes it, so this phase includes sharp_cmd
+        with metrics.phase('load_topology'):
+            try:
+                records = ib_topology.stream_topo_file(topo_config.sharp_cmd_timeout)
+                ib_topology.load_topology(records=records, compact=topo_config.compact_graph)
+            finally:
+                metrics.sharp_cmd = ib_topology.sharp_cmd_status
+        logging.info(f"Populated graph from topology file generated at {ib_topology.topo_file}")
+    else:
+        with metrics.phase('sharp_cmd'):
+            try:
+                ib_topology.create_topo_file(topo_config.sharp_cmd_timeout)
+            finally:
+                metrics.sharp_cmd = ib_topology.sharp_cmd_status
+        with metrics.phase('load_topology'):
+            ib_topology.load_topology(use_mmap=topo_config.mmap_topology, compact=topo_config.compact_graph)
+        logging.info("Populated graph from topology file")
+    with metrics.phase('identify_torsets'):
+        ib_topology.host_ip_to_torset = ib_topology.identify_torsets()
     logging.info("Identified torsets for hosts")
-    ib_topology.torsets = ib_topology.group_hosts_by_torset()
-    ib_topology.write_hosts_by_torset()
-    logging.info(f"Hosts grouped by torset and written to files in {ib_topology.output_dir}")
-    ib_topology.draw_topology()
-    logging.info(f"Topology graph saved to {ib_topology.output_dir / 'topology.png'}")
+    with metrics.phase('write_torsets'):
+        ib_topology.torsets = ib_topology.group_hosts_by_torset()
+        ib_topology.write_torset_outputs(topo_config.torset_files, topo_config.slurm_topology)
+    logging.info(f"Hosts grouped by torset and written to {ib_topology.output_dir / 'torsets.json'}")
+    if topo_config.snapshot:
+        with metrics.phase('snapshot'):
+            snapshot_path = ib_topology.save_snapshot()
+        logging.info(f"Topology snapshot written to {snapshot_path}")
+    if topo_config.hop_distances:
+        with metrics.phase('hop_distances'):
+            ib_topology.write_distance_matrices()
+        logging.info(f"Leaf and torset hop distances written to {ib_topology.output_dir}")
+    for fmt in topo_config.export_formats:
+        with metrics.phase(f'export_{fmt}'):
+            export_path = ib_topology.export_topology(fmt, topo_config.draw_mode)
+        logging.info(f"Topology graph exported to {export_path}")
+    if topo_config.draw:
+        with metrics.phase('draw'):
+            ib_topology.draw_topology(topo_config.draw_mode)
+        logging.info(f"Topology graph saved to {ib_topology.output_dir / 'topology.png'}")
 
     logging.info(f"{len(ib_topology.host_ip_to_torset)} nodes identified")
     logging.info(f"{len(ib_topology.torsets)} torsets identified")
 
 
+def main(topo_config: TopologyConfig):
+    # Runs the pipeline and writes metrics.json (and profile.prof with profile=True) to the output
+    # directory, also when the run fails part way
+    output_dir = topo_config.output_dir
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    metrics = RunMetrics()
+    profiler = None
+    if topo_config.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+    try:
+        if profiler is not None:
+            profiler.runcall(run, topo_config, metrics)
+        else:
+            run(topo_config, metrics)
+    finally:
+        metrics.write(output_dir / 'metrics.json')
+        logging.info(f"Run metrics written to {output_dir / 'metrics.json'}")
+        if profiler is not None:
+            profiler.dump_stats(output_dir / 'profile.prof')
+            logging.info(f"Profile written to {output_dir / 'profile.prof'}, view it with python -m pstats")
+
+
 def parse_args():
     import argparse
     parser = argparse.ArgumentParser()
@@ -229,20 +974,92 @@ def parse_args():
     parser.add_argument('output_dir', type=str, help='Output directory for generated files')
     parser.add_argument('--sharp_smx_ucx_interface', type=str, default='mlx5_ib0:1', help='Sharp SMX UCX Interface (default: mlx5_ib0:1)')
     parser.add_argument('--ibdevice_pattern', type=str, default='mlx5_ib', help='InfiniBand device pattern (default: mlx5_ib)')
+    parser.add_argument('--parallel', type=int, default=1, help='Number of hosts to query for GUIDs concurrently (default: 1)')
+    parser.add_argument('--probe', action='store_true', help='Collect hostname and port state along with GUIDs and warn about inactive ports')
+    parser.add_argument('--guid_cache', type=str, default=None, help='Path to GUID cache file (default: <output_dir>/guid_cache.json)')
+    parser.add_argument('--cache_ttl', type=float, default=DEFAULT_TTL, help=f'Seconds before cached GUIDs of a host are refreshed (default: {DEFAULT_TTL})')
+    parser.add_argument('--refresh_guids', action='store_true', help='Query every host and refresh the GUID cache')
+    parser.add_argument('--no_guid_cache', action='store_true', help='Do not read or write the GUID cache')
+    parser.add_argument('--mmap', action='store_true', help='Read the topology file through mmap')
+    parser.add_argument('--compact_graph', action='store_true', help='Build a compact array backed graph instead of a networkx graph')
+    parser.add_argument('--draw_mode', choices=['full', 'aggregate'], default='full', help='Draw every switch and GUID, or torsets and the switch tiers above them (default: full)')
+    parser.add_argument('--no_draw', action='store_true', help='Do not draw topology.png')
+    parser.add_argument('--export', choices=['dot', 'graphml'], action='append', default=[], help='Export the topology graph, can be repeated')
+    parser.add_argument('--no_hop_distances', action='store_true', help='Do not precompute leaf and torset hop distance matrices')
+    parser.add_argument('--no_snapshot', action='store_true', help='Do not write the binary topology snapshot')
+    parser.add_argument('--sharp_cmd_timeout', type=float, default=SHARP_CMD_TIMEOUT, help=f'Seconds sharp_cmd may run before it is killed (default: {SHARP_CMD_TIMEOUT})')
+    parser.add_argument('--no_stream_topology', action='store_true', help='Wait for sharp_cmd to finish before parsing the topology file')
+    parser.add_argument('--probe_mode', choices=['ibstat', 'sysfs'], default='ibstat', help='Read GUIDs (and port states with --probe) on each host with the ibstat pipeline or from /sys/class/infiniband in a single read (default: ibstat)')
+    parser.add_argument('--connect_timeout', type=float, default=CONNECT_TIMEOUT, help=f'Seconds to establish an SSH connection to a host (default: {CONNECT_TIMEOUT})')
+    parser.add_argument('--command_timeout', type=float, default=COMMAND_TIMEOUT, help=f'Seconds a command may run on a host (default: {COMMAND_TIMEOUT})')
+    parser.add_argument('--retries', type=int, default=RETRIES, help=f'Retries for a host that could not be reached or timed out (default: {RETRIES})')
+    parser.add_argument('--retry_backoff', type=float, default=RETRY_BACKOFF, help=f'Seconds before the first retry, doubled for each further retry (default: {RETRY_BACKOFF})')
+    parser.add_argument('--discovery_deadline', type=float, default=None, help='Seconds GUID collection may take in total, hosts not done by then are unreachable (default: no limit)')
+    parser.add_argument('--partial_results', action='store_true', help='Continue with the hosts that answered when some hosts are unreachable')
+    parser.add_argument('--guid_source', choices=['ssh', 'fabric_dump'], default='ssh', help='Collect GUIDs over SSH from every host, or from the node descriptions of one fabric dump (default: ssh)')
+    parser.add_argument('--fabric_dump', type=str, default=None, help='Saved ibnetdiscover or iblinkinfo output for --guid_source fabric_dump (default: run ibnetdiscover)')
+    parser.add_argument('--torset_files', action='store_true', help='Also write a torset-NN_hosts.txt file per torset')
+    parser.add_argument('--no_slurm_topology', action='store_true', help='Do not write the Slurm topology.conf')
+    parser.add_argument('--profile', action='store_true', help='Profile the run with cProfile and write <output_dir>/profile.prof (SSH worker threads are not profiled)')
 
     return parser.parse_args()
 
 
+# `ibtopo <subcommand> ...` runs <module>.cli or <module>:<function>, anything else is the topology
+# generation command line
+SUBCOMMANDS = {
+    'place': 'ibtopo.placement',
+    'update': 'ibtopo.diff',
+    'synthetic': 'ibtopo.synthetic',
+    'fabrics': 'ibtopo.fabrics',
+    'daemon': 'ibtopo.daemon',
+    'query': 'ibtopo.daemon:query_cli',
+}
+
+
 def cli():
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        import importlib
+
+        module, _, function = SUBCOMMANDS[sys.argv[1]].partition(':')
+        return getattr(importlib.import_module(module), function or 'cli')(sys.argv[2:])
     args = parse_args()
     torset_config = TopologyConfig(
         hosts_file=Path(args.hosts),
         output_dir=Path(args.output_dir),
         sharp_cmd_path=Path(args.sharp_cmd_path),
         sharp_smx_ucx_interface=args.sharp_smx_ucx_interface,
-        ibdevice_pattern=args.infiniband_pattern,
+        ibdevice_pattern=args.ibdevice_pattern,
         username=args.username,
-        pkey_path=Path(args.pkey_path)
+        pkey_path=Path(args.pkey_path),
+        parallel=args.parallel,
+        probe=args.probe,
+        guid_cache=Path(args.guid_cache) if args.guid_cache else None,
+        cache_ttl=args.cache_ttl,
+        refresh_guids=args.refresh_guids,
+        use_guid_cache=not args.no_guid_cache,
+        mmap_topology=args.mmap,
+        compact_graph=args.compact_graph,
+        draw_mode=args.draw_mode,
+        draw=not args.no_draw,
+        export_formats=args.export,
+        hop_distances=not args.no_hop_distances,
+        snapshot=not args.no_snapshot,
+        profile=args.profile,
+        stream_topology=not args.no_stream_topology,
+        sharp_cmd_timeout=args.sharp_cmd_timeout,
+        guid_source=args.guid_source,
+        fabric_dump=Path(args.fabric_dump) if args.fabric_dump else None,
+        probe_mode=args.probe_mode,
+        connect_timeout=args.connect_timeout,
+        command_timeout=args.command_timeout,
+        retries=args.retries,
+        retry_backoff=args.retry_backoff,
+        discovery_deadline=args.discovery_deadline,
+        partial_results=args.partial_results,
+        torset_files=args.torset_files,
+        slurm_topology=not args.no_slurm_topology
     )
 
     main(torset_config)
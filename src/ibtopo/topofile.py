@@ -0,0 +1,95 @@
+import mmap
+import time
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, NamedTuple
+
+SWITCH_NAME_PREFIX = 'SwitchName='
+SWITCHES = 'Switches'
+NODES = 'Nodes'
+
+
+class TopologyRecord(NamedTuple):
+    # One line of a sharp_cmd topology file
+    # - 'SwitchName=ibsw2 Switches=ibsw55,ibsw57' -> TopologyRecord('ibsw2', 'Switches', ['ibsw55', 'ibsw57'])
+    # - 'SwitchName=ibsw1 Nodes=0x155dfffd341941,0x155dfffd341ad9' -> TopologyRecord('ibsw1', 'Nodes', [...])
+    switch: str
+    kind: str
+    members: List[str]
+
+
+def parse_topology_lines(lines: Iterable[str]) -> Iterator[TopologyRecord]:
+    for line in lines:
+        if not line.startswith(SWITCH_NAME_PREFIX):
+            # Comments and blank lines
+            continue
+        parts = line.split()
+        if len(parts) < 2:
+            # Switch without any connections
+            continue
+        kind, _, members = parts[1].partition('=')
+        yield TopologyRecord(parts[0][len(SWITCH_NAME_PREFIX):], kind, members.split(','))
+
+
+def _mmap_lines(path: Path) -> Iterator[str]:
+    with open(path, 'rb') as f:
+        # mmap cannot map an empty file
+        if f.seek(0, 2) == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b''):
+                yield line.decode()
+
+
+def follow_lines(path: Path, finished: Callable[[], bool], poll_interval: float = 0.05) -> Iterator[str]:
+    # Complete lines of a file another process is still writing (like tail -f), until finished()
+    # returns True and everything written before that has been read
+    # - The file may not exist yet when following starts
+    # - A trailing line without a newline is only yielded once the writer has finished
+    f = None
+    pending = ''
+    try:
+        while True:
+            # Checked before reading, so lines written just before the writer finishes are not lost
+            done = finished()
+            if f is None:
+                try:
+                    f = open(path, 'r')
+                except FileNotFoundError:
+                    if done:
+                        return
+                    time.sleep(poll_interval)
+                    continue
+            for chunk in iter(f.readline, ''):
+                pending += chunk
+                if pending.endswith('\n'):
+                    yield pending
+                    pending = ''
+            if done:
+                if pending:
+                    yield pending
+                return
+            time.sleep(poll_interval)
+    finally:
+        if f is not None:
+            f.close()
+
+
+def parse_topology(path: Path, use_mmap: bool = False) -> Iterator[TopologyRecord]:
+    # Streams records from a topology file, reading it once and holding a single line at a time
+    if use_mmap:
+        yield from parse_topology_lines(_mmap_lines(path))
+        return
+    with open(path, 'r') as f:
+        yield from parse_topology_lines(f)
+
+
+def read_topology(path: Path, use_mmap: bool = False) -> tuple:
+    # (device_guids_per_switch, switch_links) as built by IBTopology.load_topology, without the graph
+    device_guids_per_switch = {}
+    switch_links = {}
+    for record in parse_topology(path, use_mmap):
+        if record.kind == NODES:
+            device_guids_per_switch.setdefault(record.switch, []).extend(record.members)
+        elif record.kind == SWITCHES:
+            switch_links.setdefault(record.switch, []).extend(record.members)
+    return device_guids_per_switch, switch_links
@@ -1,9 +1,17 @@
+import sys
+import time
 from pathlib import Path
 
+import fabric
 import pytest
 
+from ibtopo import TopologyConfig
+
+HOSTS_FILE = Path('tests/data/hosts.txt')
+TOPO_FILE = Path('tests/data/topology.txt')
+
 created_files = ['tests/data/torset-{i:02d}_hosts.txt'.format(i=i) for i in range(12)]
-created_files = created_files + ['tests/data/new_guids.txt']
+created_files = created_files + ['tests/data/new_guids.txt', 'tests/data/topology_layout_full.json']
 
 
 def pytest_sessionfinish(session, exitstatus):
@@ -11,3 +19,215 @@ def pytest_sessionfinish(session, exitstatus):
         for file in created_files:
             Path(file).unlink()
         print("All tests passed!")
+
+
+MOCKED_GUID_TO_HOST_IP = {
+    '0x155dfffd341acb': '10.193.0.13',
+    '0x155dfffd341acc': '10.193.0.13',
+    '0x155dfffd341acd': '10.193.0.13',
+    '0x155dfffd341ace': '10.193.0.13',
+    '0x155dfffd341acf': '10.193.0.13',
+    '0x155dfffd341ad0': '10.193.0.13',
+    '0x155dfffd341ad1': '10.193.0.13',
+    '0x155dfffd341ad2': '10.193.0.13',
+    '0x155dfffd341afb': '10.193.0.19',
+    '0x155dfffd341afc': '10.193.0.19',
+    '0x155dfffd341afd': '10.193.0.19',
+    '0x155dfffd341afe': '10.193.0.19',
+    '0x155dfffd341aff': '10.193.0.19',
+    '0x155dfffd341b00': '10.193.0.19',
+    '0x155dfffd341b01': '10.193.0.19',
+    '0x155dfffd341b02': '10.193.0.19',
+    '0x155dfffd34193b': '10.193.0.10',
+    '0x155dfffd34193c': '10.193.0.10',
+    '0x155dfffd34193d': '10.193.0.10',
+    '0x155dfffd34193e': '10.193.0.10',
+    '0x155dfffd34193f': '10.193.0.10',
+    '0x155dfffd341940': '10.193.0.10',
+    '0x155dfffd341941': '10.193.0.10',
+    '0x155dfffd341942': '10.193.0.10',
+    '0x155dfffd341b0b': '10.193.0.9',
+    '0x155dfffd341b0c': '10.193.0.9',
+    '0x155dfffd341b0d': '10.193.0.9',
+    '0x155dfffd341b0e': '10.193.0.9',
+    '0x155dfffd341b0f': '10.193.0.9',
+    '0x155dfffd341b10': '10.193.0.9',
+    '0x155dfffd341b11': '10.193.0.9',
+    '0x155dfffd341b12': '10.193.0.9',
+    '0x155dfffd34168b': '10.193.0.4',
+    '0x155dfffd34168c': '10.193.0.4',
+    '0x155dfffd34168d': '10.193.0.4',
+    '0x155dfffd34168e': '10.193.0.4',
+    '0x155dfffd34168f': '10.193.0.4',
+    '0x155dfffd341690': '10.193.0.4',
+    '0x155dfffd341691': '10.193.0.4',
+    '0x155dfffd341692': '10.193.0.4',
+    '0x155dfffd3416bb': '10.193.0.7',
+    '0x155dfffd3416bc': '10.193.0.7',
+    '0x155dfffd3416bd': '10.193.0.7',
+    '0x155dfffd3416be': '10.193.0.7',
+    '0x155dfffd3416bf': '10.193.0.7',
+    '0x155dfffd3416c0': '10.193.0.7',
+    '0x155dfffd3416c1': '10.193.0.7',
+    '0x155dfffd3416c2': '10.193.0.7',
+    '0x155dfffd341b23': '10.193.0.5',
+    '0x155dfffd341b24': '10.193.0.5',
+    '0x155dfffd341b25': '10.193.0.5',
+    '0x155dfffd341b26': '10.193.0.5',
+    '0x155dfffd341b27': '10.193.0.5',
+    '0x155dfffd341b28': '10.193.0.5',
+    '0x155dfffd341b29': '10.193.0.5',
+    '0x155dfffd341b2a': '10.193.0.5',
+    '0x155dfffd34136b': '10.193.0.18',
+    '0x155dfffd34136c': '10.193.0.18',
+    '0x155dfffd34136d': '10.193.0.18',
+    '0x155dfffd34136e': '10.193.0.18',
+    '0x155dfffd34136f': '10.193.0.18',
+    '0x155dfffd341370': '10.193.0.18',
+    '0x155dfffd341371': '10.193.0.18',
+    '0x155dfffd341372': '10.193.0.18',
+    '0x155dfffd34110b': '10.193.0.11',
+    '0x155dfffd34110c': '10.193.0.11',
+    '0x155dfffd34110d': '10.193.0.11',
+    '0x155dfffd34110e': '10.193.0.11',
+    '0x155dfffd34110f': '10.193.0.11',
+    '0x155dfffd341110': '10.193.0.11',
+    '0x155dfffd341111': '10.193.0.11',
+    '0x155dfffd341112': '10.193.0.11',
+    '0x155dfffd341b1b': '10.193.0.17',
+    '0x155dfffd341b1c': '10.193.0.17',
+    '0x155dfffd341b1d': '10.193.0.17',
+    '0x155dfffd341b1e': '10.193.0.17',
+    '0x155dfffd341b1f': '10.193.0.17',
+    '0x155dfffd341b20': '10.193.0.17',
+    '0x155dfffd341b21': '10.193.0.17',
+    '0x155dfffd341b22': '10.193.0.17',
+    '0x155dfffd341adb': '10.193.0.8',
+    '0x155dfffd341adc': '10.193.0.8',
+    '0x155dfffd341add': '10.193.0.8',
+    '0x155dfffd341ade': '10.193.0.8',
+    '0x155dfffd341adf': '10.193.0.8',
+    '0x155dfffd341ae0': '10.193.0.8',
+    '0x155dfffd341ae1': '10.193.0.8',
+    '0x155dfffd341ae2': '10.193.0.8',
+    '0x155dfffd341b03': '10.193.0.16',
+    '0x155dfffd341b04': '10.193.0.16',
+    '0x155dfffd341b05': '10.193.0.16',
+    '0x155dfffd341b06': '10.193.0.16',
+    '0x155dfffd341b07': '10.193.0.16',
+    '0x155dfffd341b08': '10.193.0.16',
+    '0x155dfffd341b09': '10.193.0.16',
+    '0x155dfffd341b0a': '10.193.0.16',
+    '0x155dfffd341a03': '10.193.0.15',
+    '0x155dfffd341a04': '10.193.0.15',
+    '0x155dfffd341a05': '10.193.0.15',
+    '0x155dfffd341a06': '10.193.0.15',
+    '0x155dfffd341a07': '10.193.0.15',
+    '0x155dfffd341a08': '10.193.0.15',
+    '0x155dfffd341a09': '10.193.0.15',
+    '0x155dfffd341a0a': '10.193.0.15',
+    '0x155dfffd341aeb': '10.193.0.12',
+    '0x155dfffd341aec': '10.193.0.12',
+    '0x155dfffd341aed': '10.193.0.12',
+    '0x155dfffd341aee': '10.193.0.12',
+    '0x155dfffd341aef': '10.193.0.12',
+    '0x155dfffd341af0': '10.193.0.12',
+    '0x155dfffd341af1': '10.193.0.12',
+    '0x155dfffd341af2': '10.193.0.12',
+    '0x155dfffd341abb': '10.193.0.6',
+    '0x155dfffd341abc': '10.193.0.6',
+    '0x155dfffd341abd': '10.193.0.6',
+    '0x155dfffd341abe': '10.193.0.6',
+    '0x155dfffd341abf': '10.193.0.6',
+    '0x155dfffd341ac0': '10.193.0.6',
+    '0x155dfffd341ac1': '10.193.0.6',
+    '0x155dfffd341ac2': '10.193.0.6',
+    '0x155dfffd341ad3': '10.193.0.14',
+    '0x155dfffd341ad4': '10.193.0.14',
+    '0x155dfffd341ad5': '10.193.0.14',
+    '0x155dfffd341ad6': '10.193.0.14',
+    '0x155dfffd341ad7': '10.193.0.14',
+    '0x155dfffd341ad8': '10.193.0.14',
+    '0x155dfffd341ad9': '10.193.0.14',
+    '0x155dfffd341ada': '10.193.0.14',
+}
+
+
+SLOW_HOST = '10.193.0.9'
+
+
+class MockedConnection:
+    # ibstat GUIDs of MOCKED_GUID_TO_HOST_IP, SLOW_HOST takes longer to answer
+    def __init__(self, host, user=None, connect_kwargs=None, connect_timeout=None):
+        self.host = host
+
+    def run(self, cmd, hide=True, warn=False, timeout=None):
+        time.sleep(0.05 if self.host == SLOW_HOST else 0.001)
+
+        class Result:
+            stdout = '\n'.join(guid.replace('0x', '0x00') for guid, host_ip in MOCKED_GUID_TO_HOST_IP.items() if host_ip == self.host)
+            stderr = ''
+            return_code = 0
+        return Result()
+
+    def close(self):
+        pass
+
+
+class UnreliableConnection:
+    # Fake transport: hosts in `hanging` never answer (until the command timeout), hosts in `flaky`
+    # fail their first attempt, `attempts` counts commands per host
+    hanging = set()
+    flaky = set()
+    attempts = {}
+
+    def __init__(self, host, user=None, connect_kwargs=None, connect_timeout=None):
+        self.host = host
+
+    def run(self, cmd, hide=True, warn=False, timeout=None):
+        attempt = UnreliableConnection.attempts[self.host] = UnreliableConnection.attempts.get(self.host, 0) + 1
+        if self.host in UnreliableConnection.hanging:
+            time.sleep(min(timeout if timeout is not None else 5, 5))
+            raise TimeoutError(f"Command did not complete within {timeout} seconds")
+        if self.host in UnreliableConnection.flaky and attempt == 1:
+            raise ConnectionResetError('Connection reset by peer')
+        return MockedConnection(self.host).run(cmd)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def unreliable(monkeypatch):
+    monkeypatch.setattr(fabric, 'Connection', UnreliableConnection)
+    UnreliableConnection.hanging = set()
+    UnreliableConnection.flaky = set()
+    UnreliableConnection.attempts = {}
+    return UnreliableConnection
+
+
+def fake_sharp_cmd(directory, body) -> Path:
+    # Executable standing in for sharp_cmd, `topology_file` is the --topology_file argument in body
+    script = Path(directory) / 'sharp_cmd'
+    script.write_text(f"""#!{sys.executable}
+import os, shutil, sys, time
+topology_file = sys.argv[sys.argv.index('--topology_file') + 1]
+{body}
+""")
+    script.chmod(0o755)
+    return script
+
+
+def config(tmp_path, **kwargs) -> TopologyConfig:
+    return TopologyConfig(
+        hosts_file=HOSTS_FILE,
+        output_dir=tmp_path / 'output',
+        sharp_cmd_path=fake_sharp_cmd(tmp_path, f"shutil.copyfile({str(TOPO_FILE.resolve())!r}, topology_file)"),
+        sharp_smx_ucx_interface='mlx5_ib0:1',
+        ibdevice_pattern='mlx5_ib',
+        username='user',
+        pkey_path=None,
+        parallel=4,
+        draw=False,
+        **kwargs
+    )
@@ -0,0 +1,36 @@
+from ibtopo.cache import GuidCache
+
+
+def test_stale_hosts(tmp_path):
+    cache = GuidCache(tmp_path / 'guid_cache.json', ttl=100)
+    cache.update('host1', ['0x1', '0x2'], now=1000)
+    cache.update('host2', None, now=1000)
+    cache.update('host3', ['0x3'], now=850)
+
+    # host2 failed, host3 expired, host4 is new
+    assert cache.stale_hosts(['host1', 'host2', 'host3', 'host4'], now=1050) == ['host2', 'host3', 'host4']
+
+
+def test_save_and_load(tmp_path):
+    cache = GuidCache(tmp_path / 'guid_cache.json')
+    cache.update('host1', ['0x1', '0x2'])
+    cache.update('host2', None)
+    cache.save()
+
+    reloaded = GuidCache(tmp_path / 'guid_cache.json')
+    assert reloaded.guids('host1') == ['0x1', '0x2']
+    assert reloaded.guids('host2') == []
+    assert reloaded.stale_hosts(['host1', 'host2']) == ['host2']
+    assert list(tmp_path.iterdir()) == [tmp_path / 'guid_cache.json']
+
+
+def test_unreadable_cache_is_ignored(tmp_path):
+    (tmp_path / 'guid_cache.json').write_text('{not json')
+    cache = GuidCache(tmp_path / 'guid_cache.json')
+    assert cache.stale_hosts(['host1']) == ['host1']
+
+
+def test_guid_to_host_normalizes_guids(tmp_path):
+    cache = GuidCache(tmp_path / 'guid_cache.json')
+    cache.update('host1', ['0x0c42a10300001234', '0x2'])
+    assert cache.guid_to_host() == {'0xc42a10300001234': 'host1', '0x2': 'host1'}
@@ -0,0 +1,191 @@
+import shutil
+import socket
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from ibtopo import IBTopology
+from ibtopo.cache import GuidCache
+from ibtopo.daemon import DaemonClient, DaemonError, QueryError, TopologyDaemon, default_socket_path, query, query_cli
+from ibtopo.output import write_torset_map
+from ibtopo.topo import read_torsets
+from conftest import MOCKED_GUID_TO_HOST_IP
+
+OUTPUT_DIR = Path('tests/data')
+HOSTS_FILE = Path('tests/data/hosts.txt')
+
+
+@pytest.fixture
+def output_dir(tmp_path):
+    # Output directory of a run: torset files, topology.txt and the GUID cache
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, 'sharp_cmd')
+    ibtopo.output_dir = tmp_path
+    ibtopo.load_topology()
+    ibtopo.guid_to_host_ip = MOCKED_GUID_TO_HOST_IP
+    ibtopo.host_ip_to_torset = ibtopo.identify_torsets()
+    ibtopo.torsets = ibtopo.group_hosts_by_torset()
+    ibtopo.write_hosts_by_torset()
+    shutil.copy(OUTPUT_DIR / 'topology.txt', tmp_path / 'topology.txt')
+    cache = GuidCache(tmp_path / 'guid_cache.json')
+    for host in ibtopo.hosts:
+        cache.update(host, [guid for guid, host_ip in MOCKED_GUID_TO_HOST_IP.items() if host_ip == host])
+    cache.save()
+    return tmp_path
+
+
+@pytest.fixture
+def daemon(output_dir, tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path / 'run'))
+    daemon = TopologyDaemon(output_dir, poll_interval=0.02)
+    daemon.start()
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.start()
+    yield daemon
+    daemon.shutdown()
+    thread.join()
+
+
+def test_queries(daemon):
+    socket_path = daemon.socket_path
+    guid = next(guid for guid, host in MOCKED_GUID_TO_HOST_IP.items() if host == '10.193.0.11')
+
+    assert query(socket_path, 'torset', '10.193.0.11') == {'torset': 'torset-02'}
+    assert query(socket_path, 'hosts', 'torset-11') == {'hosts': ['10.193.0.19', '10.193.0.5']}
+    assert query(socket_path, 'host', guid) == {'host': '10.193.0.11'}
+    assert query(socket_path, 'host', '0x00' + guid[2:]) == {'host': '10.193.0.11'}
+    assert len(query(socket_path, 'torsets')['torsets']) == 12
+    assert query(socket_path, 'status')['generation'] == 1
+    for command, args, message in [('torset', ['10.0.0.1'], 'Unknown host'), ('hosts', ['torset-99'], 'Unknown torset'),
+                                   ('host', ['xyz'], 'Invalid GUID'), ('torset', [], 'Invalid query')]:
+        with pytest.raises(QueryError, match=message):
+            query(socket_path, command, *args)
+
+
+def test_guids_cached_in_ibstat_form(output_dir):
+    # Caches written by earlier versions hold zero padded GUIDs, as ibstat prints them
+    guids = [guid for guid, host in MOCKED_GUID_TO_HOST_IP.items() if host == '10.193.0.11']
+    cache = GuidCache(output_dir / 'guid_cache.json')
+    cache.update('10.193.0.11', ['0x' + guid[2:].zfill(16) for guid in guids])
+    cache.save()
+    index = TopologyDaemon(output_dir).reload()
+
+    assert index.answer(f'host {guids[0]}') == {'host': '10.193.0.11'}
+    assert index.answer(f'host 0x{guids[0][2:].zfill(16)}') == {'host': '10.193.0.11'}
+    assert index.answer('torset 10.193.0.11') == {'torset': 'torset-02'}
+
+
+def test_guids_from_snapshot(output_dir):
+    # Runs with --no_guid_cache, --probe or --guid_source fabric_dump only have the GUIDs in the snapshot
+    topology = IBTopology(OUTPUT_DIR, HOSTS_FILE, 'sharp_cmd')
+    topology.output_dir = output_dir
+    topology.load_topology()
+    topology.guid_to_host_ip = MOCKED_GUID_TO_HOST_IP
+    topology.host_ip_to_torset = topology.identify_torsets()
+    topology.save_snapshot()
+    (output_dir / 'guid_cache.json').unlink()
+    index = TopologyDaemon(output_dir).reload()
+
+    guid = next(guid for guid, host in MOCKED_GUID_TO_HOST_IP.items() if host == '10.193.0.11')
+    assert index.answer('status')['guids'] == len(MOCKED_GUID_TO_HOST_IP)
+    assert index.answer(f'host {guid}') == {'host': '10.193.0.11'}
+
+
+def test_reused_connection(daemon):
+    # Round trip latency is measured by benchmarks/bench_daemon.py
+    with DaemonClient(daemon.socket_path) as client:
+        for _ in range(500):
+            assert client.query('torset', '10.193.0.11') == {'torset': 'torset-02'}
+        with pytest.raises(QueryError, match='Unknown host'):
+            client.query('torset', '10.0.0.1')
+        assert client.query('hosts', 'torset-11') == {'hosts': ['10.193.0.19', '10.193.0.5']}
+
+
+def test_reload_on_change(daemon, output_dir):
+    # 10.193.0.11 (torset-02, alone on its leaf switches) is drained, every other torset keeps its ID
+    before = query(daemon.socket_path, 'torsets')['torsets']
+    guids_11 = {guid for guid, host in MOCKED_GUID_TO_HOST_IP.items() if host == '10.193.0.11'}
+    lines = (output_dir / 'topology.txt').read_text().splitlines()
+    new_topology = output_dir / 'new_topology.txt'
+    new_topology.write_text('\n'.join(line for line in lines if line.split('=')[-1] not in guids_11) + '\n')
+    new_topology.replace(output_dir / 'topology.txt')
+
+    deadline = time.monotonic() + 5
+    while query(daemon.socket_path, 'status')['generation'] == 1 and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+    assert query(daemon.socket_path, 'status')['generation'] == 2
+    with pytest.raises(QueryError, match='Unknown host'):
+        query(daemon.socket_path, 'torset', '10.193.0.11')
+    del before['torset-02']
+    assert query(daemon.socket_path, 'torsets')['torsets'] == before
+
+
+def test_reload_on_new_torsets(daemon, output_dir):
+    # A new torsets.json, for instance from a new run, renumbers the torsets
+    torsets = read_torsets(output_dir)
+    write_torset_map(output_dir, {torset.replace('torset', 'rack'): hosts for torset, hosts in torsets.items()})
+
+    deadline = time.monotonic() + 5
+    while query(daemon.socket_path, 'status')['generation'] == 1 and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+    assert query(daemon.socket_path, 'status')['generation'] == 2
+    assert query(daemon.socket_path, 'torset', '10.193.0.11') == {'torset': 'rack-02'}
+    assert query(daemon.socket_path, 'hosts', 'rack-11') == {'hosts': ['10.193.0.19', '10.193.0.5']}
+
+
+def test_bad_reload_keeps_serving(daemon, output_dir):
+    (output_dir / 'topology.txt').unlink()
+    time.sleep(0.2)
+
+    assert query(daemon.socket_path, 'status')['generation'] == 1
+    assert query(daemon.socket_path, 'torset', '10.193.0.11') == {'torset': 'torset-02'}
+
+
+def test_default_socket_path(monkeypatch):
+    monkeypatch.setenv('XDG_RUNTIME_DIR', '/run/user/1000')
+    assert default_socket_path() == Path('/run/user/1000/ibtopo/ibtopo.sock')
+    monkeypatch.delenv('XDG_RUNTIME_DIR')
+    assert default_socket_path() == Path('/run/ibtopo/ibtopo.sock')
+
+
+def test_second_daemon_on_socket(daemon, output_dir):
+    assert daemon.socket_path.parent.parent == output_dir / 'run'
+    with pytest.raises(DaemonError, match='already listening'):
+        TopologyDaemon(output_dir).start()
+    assert query(daemon.socket_path, 'status')['generation'] == 1
+
+
+def test_stale_socket_is_replaced(output_dir):
+    # Left behind by a daemon that was killed: nothing listens on it
+    socket_path = output_dir / 'stale.sock'
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(str(socket_path))
+    daemon = TopologyDaemon(output_dir, socket_path)
+    daemon.start()
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.start()
+    try:
+        assert query(socket_path, 'status')['generation'] == 1
+    finally:
+        daemon.shutdown()
+        thread.join()
+
+
+def test_socket_path_is_not_a_socket(output_dir):
+    socket_path = output_dir / 'torsets.txt'
+    socket_path.write_text('keep me\n')
+    with pytest.raises(DaemonError, match='not a socket'):
+        TopologyDaemon(output_dir, socket_path).start()
+    assert socket_path.read_text() == 'keep me\n'
+
+
+def test_query_cli(daemon, capsys):
+    query_cli([str(daemon.socket_path), 'hosts', 'torset-11'])
+    assert capsys.readouterr().out == '10.193.0.19\n10.193.0.5\n'
+
+    with pytest.raises(SystemExit):
+        query_cli([str(daemon.socket_path), 'torset', '10.0.0.1'])
+    assert 'Unknown host 10.0.0.1' in capsys.readouterr().err
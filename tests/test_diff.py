@@ -0,0 +1,154 @@
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+from ibtopo import IBTopology
+from ibtopo.cache import GuidCache
+from ibtopo.diff import FabricState, UpdateError, diff_topology, update_output_dir, update_torsets
+from ibtopo.topo import read_torsets
+from conftest import MOCKED_GUID_TO_HOST_IP
+
+OUTPUT_DIR = Path('tests/data')
+HOSTS_FILE = Path('tests/data/hosts.txt')
+
+
+def fabric():
+    # torset-00: h1, h2 on leaf1 / leaf2, torset-01: h3 on leaf3, torset-02: h4 on leaf4
+    device_guids_per_switch = {'leaf1': ['0x1', '0x3'], 'leaf2': ['0x2', '0x4'], 'leaf3': ['0x5', '0x6'], 'leaf4': ['0x7']}
+    switch_links = {'spine1': ['leaf1', 'leaf2', 'leaf3', 'leaf4']}
+    guid_to_host_ip = {'0x1': 'h1', '0x2': 'h1', '0x3': 'h2', '0x4': 'h2', '0x5': 'h3', '0x6': 'h3', '0x7': 'h4'}
+    host_ip_to_torset = {'h1': 'torset-00', 'h2': 'torset-00', 'h3': 'torset-01', 'h4': 'torset-02'}
+    return FabricState(device_guids_per_switch, switch_links, guid_to_host_ip), host_ip_to_torset
+
+
+def test_diff_topology():
+    old, _ = fabric()
+    new, _ = fabric()
+    # h3's HCA 0x6 replaced by 0x8 and cabled to leaf4, leaf3 uplinked to spine2
+    new.device_guids_per_switch['leaf3'] = ['0x5']
+    new.device_guids_per_switch['leaf4'] = ['0x7', '0x8']
+    new.guid_to_host_ip = {**{g: h for g, h in old.guid_to_host_ip.items() if g != '0x6'}, '0x8': 'h3'}
+    new.switch_links['spine2'] = ['leaf3']
+    diff = diff_topology(old, new)
+
+    assert diff.added_switches == ['spine2']
+    assert diff.removed_switches == []
+    assert diff.added_links == [['leaf3', 'spine2']]
+    assert diff.added_guids == ['0x8']
+    assert diff.removed_guids == ['0x6']
+    assert diff.moved_guids == {}
+    assert diff.changed_guid_hosts == {'0x6': ['h3', None], '0x8': [None, 'h3']}
+    assert diff_topology(old, old).is_empty()
+
+
+def test_update_torsets_keeps_ids_stable():
+    old, host_ip_to_torset = fabric()
+    new, _ = fabric()
+    # h4 moves onto leaf3 next to h3, merging torset-01 and torset-02
+    new.device_guids_per_switch['leaf3'] = ['0x5', '0x6', '0x7']
+    del new.device_guids_per_switch['leaf4']
+    diff = diff_topology(old, new)
+    updated, changes = update_torsets(old, new, host_ip_to_torset, diff)
+
+    assert updated == {'h1': 'torset-00', 'h2': 'torset-00', 'h3': 'torset-01', 'h4': 'torset-01'}
+    assert changes == {'h4': ['torset-02', 'torset-01']}
+
+    # Splitting them again gives h4 a new ID after the highest one in use, h3 keeps its ID
+    updated, changes = update_torsets(new, old, updated, diff_topology(new, old))
+    assert updated['h3'] == 'torset-01'
+    assert changes == {'h4': ['torset-01', 'torset-02']}
+
+
+def test_update_output_dir(tmp_path):
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, 'sharp_cmd')
+    ibtopo.output_dir = tmp_path
+    ibtopo.load_topology()
+    ibtopo.guid_to_host_ip = MOCKED_GUID_TO_HOST_IP
+    ibtopo.host_ip_to_torset = ibtopo.identify_torsets()
+    ibtopo.torsets = ibtopo.group_hosts_by_torset()
+    ibtopo.write_hosts_by_torset()
+    ibtopo.write_distance_matrices()
+    shutil.copy(OUTPUT_DIR / 'topology.txt', tmp_path / 'topology.txt')
+    cache = GuidCache(tmp_path / 'guid_cache.json')
+    for host in ibtopo.hosts:
+        cache.update(host, [guid for guid, host_ip in MOCKED_GUID_TO_HOST_IP.items() if host_ip == host])
+    cache.save()
+
+    # 10.193.0.11 (torset-02, alone on its leaf switches) is drained: its GUIDs disappear from the fabric
+    new_topology = tmp_path / 'new_topology.txt'
+    lines = (OUTPUT_DIR / 'topology.txt').read_text().splitlines()
+    guids_11 = {guid for guid, host in MOCKED_GUID_TO_HOST_IP.items() if host == '10.193.0.11'}
+    new_topology.write_text('\n'.join(line for line in lines if line.split('=')[-1] not in guids_11) + '\n')
+    log = update_output_dir(tmp_path, new_topology)
+
+    assert log['removed_guids'] == sorted(guids_11)
+    assert log['torset_changes'] == {'10.193.0.11': ['torset-02', None]}
+    assert log['removed_torsets'] == ['torset-02']
+    assert json.loads((tmp_path / 'changes.json').read_text()) == log
+    torsets = read_torsets(tmp_path)
+    assert 'torset-02' not in torsets
+    assert torsets['torset-11'] == ['10.193.0.19', '10.193.0.5']
+    assert (tmp_path / 'topology.txt').read_text() == new_topology.read_text()
+
+
+def drained_topology(tmp_path, host) -> Path:
+    # topology.txt without the GUIDs of host, on leaf switches it may share with other hosts
+    guids = {guid for guid, host_ip in MOCKED_GUID_TO_HOST_IP.items() if host_ip == host}
+    lines = []
+    for line in (OUTPUT_DIR / 'topology.txt').read_text().splitlines():
+        switch, nodes_key, nodes = line.partition(' Nodes=')
+        if nodes_key:
+            nodes = [guid for guid in nodes.split(',') if guid not in guids]
+            line = f"{switch}{nodes_key}{','.join(nodes)}" if nodes else None
+        if line is not None:
+            lines.append(line)
+    new_topology = tmp_path / 'new_topology.txt'
+    new_topology.write_text('\n'.join(lines) + '\n')
+    return new_topology
+
+
+def run_without_guid_cache(tmp_path) -> IBTopology:
+    # Outputs of a --no_guid_cache run: the GUIDs are only in topology.snapshot
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, 'sharp_cmd')
+    ibtopo.output_dir = tmp_path
+    ibtopo.load_topology()
+    ibtopo.guid_to_host_ip = MOCKED_GUID_TO_HOST_IP
+    ibtopo.host_ip_to_torset = ibtopo.identify_torsets()
+    ibtopo.torsets = ibtopo.group_hosts_by_torset()
+    ibtopo.write_torset_outputs()
+    shutil.copy(OUTPUT_DIR / 'topology.txt', tmp_path / 'topology.txt')
+    return ibtopo
+
+
+def test_update_output_dir_without_guid_cache(tmp_path):
+    ibtopo = run_without_guid_cache(tmp_path)
+    ibtopo.save_snapshot()
+
+    log = update_output_dir(tmp_path, drained_topology(tmp_path, '10.193.0.13'))
+
+    assert log['torset_changes'] == {'10.193.0.13': [ibtopo.host_ip_to_torset['10.193.0.13'], None]}
+    assert '10.193.0.13' not in {host for hosts in read_torsets(tmp_path).values() for host in hosts}
+
+
+def test_update_output_dir_rewrites_snapshot(tmp_path):
+    ibtopo = run_without_guid_cache(tmp_path)
+    ibtopo.save_snapshot()
+    update_output_dir(tmp_path, drained_topology(tmp_path, '10.193.0.13'))
+
+    snapshot = IBTopology.from_snapshot(tmp_path / 'topology.snapshot')
+    assert snapshot.torsets == read_torsets(tmp_path)
+    assert '10.193.0.13' not in snapshot.host_ip_to_torset
+    guids_13 = {guid for guid, host in MOCKED_GUID_TO_HOST_IP.items() if host == '10.193.0.13'}
+    assert not guids_13 & {guid for guids in snapshot.device_guids_per_switch.values() for guid in guids}
+    assert snapshot.hosts_file == HOSTS_FILE
+
+
+def test_update_output_dir_without_guids(tmp_path):
+    run_without_guid_cache(tmp_path)
+    before = (tmp_path / 'torsets.json').read_text()
+
+    with pytest.raises(UpdateError, match='No GUID to host map'):
+        update_output_dir(tmp_path, drained_topology(tmp_path, '10.193.0.13'))
+    assert (tmp_path / 'torsets.json').read_text() == before
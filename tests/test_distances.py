@@ -0,0 +1,110 @@
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+
+from ibtopo import IBTopology, distances
+from ibtopo.distances import UNREACHABLE, DistanceMatrix, leaf_distances, torset_distances
+from ibtopo.synthetic import fat_tree
+from ibtopo.topo import leaf_torsets, switch_adjacency
+from conftest import MOCKED_GUID_TO_HOST_IP
+
+OUTPUT_DIR = Path('tests/data')
+HOSTS_FILE = Path('tests/data/hosts.txt')
+
+
+def bfs_torset_distances(device_guids_per_switch, switch_links, guid_to_host_ip, host_ip_to_torset):
+    # Reference: one BFS over the switch links from the leaves of every torset
+    adjacency = switch_adjacency(switch_links)
+    torset_of_leaf = leaf_torsets(device_guids_per_switch, guid_to_host_ip, host_ip_to_torset)
+    distances = {}
+    for torset in set(torset_of_leaf.values()):
+        hops = {leaf: 0 for leaf, other in torset_of_leaf.items() if other == torset}
+        distances[torset] = {torset: 0}
+        queue = deque(hops)
+        while queue:
+            switch = queue.popleft()
+            distances[torset].setdefault(torset_of_leaf.get(switch), hops[switch])
+            for conn_switch in adjacency.get(switch, ()):
+                if conn_switch not in hops:
+                    hops[conn_switch] = hops[switch] + 1
+                    queue.append(conn_switch)
+    return distances
+
+
+def test_leaf_distances():
+    device_guids_per_switch = {'leaf1': ['0x1'], 'leaf2': ['0x2'], 'leaf3': ['0x3'], 'leaf4': ['0x4']}
+    switch_links = {'spineA': ['leaf1', 'leaf2'], 'spineB': ['leaf3'], 'core': ['spineA', 'spineB']}
+    matrix = leaf_distances(device_guids_per_switch, switch_links)
+
+    assert matrix.names == ['leaf1', 'leaf2', 'leaf3', 'leaf4']
+    assert matrix.matrix.dtype == np.uint8
+    assert matrix.matrix.tolist() == [
+        [0, 2, 4, UNREACHABLE],
+        [2, 0, 4, UNREACHABLE],
+        [4, 4, 0, UNREACHABLE],
+        [UNREACHABLE, UNREACHABLE, UNREACHABLE, 0],
+    ]
+
+
+def test_leaf_distances_without_uplinks():
+    # Leaves without any switch link are not 0 hops from each other
+    matrix = leaf_distances({'a': ['0x1'], 'b': ['0x2'], 'c': ['0x3']}, {})
+
+    assert matrix.matrix.tolist() == [
+        [0, UNREACHABLE, UNREACHABLE],
+        [UNREACHABLE, 0, UNREACHABLE],
+        [UNREACHABLE, UNREACHABLE, 0],
+    ]
+
+
+def test_save_keeps_mapped_matrix_valid(tmp_path):
+    DistanceMatrix(['a', 'b'], np.array([[0, 2], [2, 0]], dtype=np.uint8)).save(tmp_path, 'leaf')
+    mapped = DistanceMatrix.load(tmp_path, 'leaf')
+    DistanceMatrix(['a'], np.zeros((1, 1), dtype=np.uint8)).save(tmp_path, 'leaf')
+
+    # The file mapped by the reader was replaced, not rewritten in place
+    assert mapped.matrix.tolist() == [[0, 2], [2, 0]]
+    assert DistanceMatrix.load(tmp_path, 'leaf').names == ['a']
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['leaf_distances.npy', 'leaf_distances_index.txt']
+
+
+def test_torset_distances_match_bfs(tmp_path):
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, 'sharp_cmd')
+    ibtopo.output_dir = tmp_path
+    ibtopo.load_topology()
+    ibtopo.guid_to_host_ip = MOCKED_GUID_TO_HOST_IP
+    ibtopo.host_ip_to_torset = ibtopo.identify_torsets()
+    ibtopo.write_distance_matrices()
+
+    leaf_matrix = DistanceMatrix.load(tmp_path, 'leaf')
+    assert isinstance(leaf_matrix.matrix, np.memmap)
+    assert leaf_matrix.matrix.shape == (96, 96)
+    matrix = DistanceMatrix.load(tmp_path, 'torset')
+    assert len(matrix.names) == 12
+
+    expected = bfs_torset_distances(ibtopo.device_guids_per_switch, ibtopo.switch_links, ibtopo.guid_to_host_ip, ibtopo.host_ip_to_torset)
+    for a in matrix.names:
+        for b in matrix.names:
+            assert matrix.distance(a, b) == expected[a].get(b, UNREACHABLE)
+
+
+def test_torset_distances_empty():
+    leaf_matrix = DistanceMatrix([], np.empty((0, 0), dtype=np.uint8))
+    assert torset_distances(leaf_matrix, {}, {}, {}).names == []
+
+
+def test_torset_distances_in_blocks(monkeypatch):
+    # 8 torsets in pods of 4: 2 hops through a spine within a pod, 4 hops through a core between pods
+    fabric = fat_tree(32, guids_per_host=2, hosts_per_leaf=4, torsets_per_pod=4, spines_per_pod=2)
+    host_ip_to_torset = {host: f"torset-{i:02}" for i, hosts in enumerate(fabric.torsets) for host in hosts}
+    leaf_matrix = leaf_distances(fabric.device_guids_per_switch, fabric.switch_links)
+    whole = torset_distances(leaf_matrix, fabric.device_guids_per_switch, fabric.guid_to_host_ip, host_ip_to_torset)
+    # One torset per block
+    monkeypatch.setattr(distances, 'LEAF_BLOCK_BYTES', 1)
+    blocks = torset_distances(leaf_matrix, fabric.device_guids_per_switch, fabric.guid_to_host_ip, host_ip_to_torset)
+
+    assert np.array_equal(whole.matrix, blocks.matrix)
+    assert blocks.distance('torset-00', 'torset-03') == 2
+    assert blocks.distance('torset-00', 'torset-04') == 4
+    assert blocks.matrix.diagonal().tolist() == [0] * 8
@@ -0,0 +1,96 @@
+import logging
+from pathlib import Path
+
+import pytest
+
+from ibtopo import IBTopology, topo
+from ibtopo.fabricdump import CaPort, guids_from_ports, match_hosts, parse_fabric_dump, parse_ibnetdiscover, parse_iblinkinfo
+from ibtopo.topo import read_torsets
+from conftest import MOCKED_GUID_TO_HOST_IP, config
+
+OUTPUT_DIR = Path('tests/data')
+HOSTS_FILE = Path('tests/data/hosts.txt')
+IBNETDISCOVER = Path('tests/data/ibnetdiscover.txt')
+IBLINKINFO = Path('tests/data/iblinkinfo.txt')
+
+
+def resolve(name):
+    # Node descriptions of the dumps name 10.193.0.N hpc-00N
+    if not name.startswith('hpc-'):
+        raise OSError(f"Unknown host {name}")
+    return f"10.193.0.{int(name[len('hpc-'):])}"
+
+
+def test_parse_ibnetdiscover():
+    lines = [
+        'Switch\t40 "S-0098039b03000001"\t\t# "MF0;ibsw1:MQM8700/U1" enhanced port 0 lid 1 lmc 0\n',
+        '[1]\t"H-00165dfffd341941"[1](155dfffd341941) \t\t# "hpc-010 mlx5_ib6" lid 122 4xHDR\n',
+        '\n',
+        'caguid=0x165dfffd341acb\n',
+        'Ca\t1 "H-00165dfffd341acb"\t\t# "hpc-013 mlx5_ib0"\n',
+        '[1](155dfffd341acb) \t"S-0098039b03000007"[1]\t\t# lid 100 lmc 0 "MF0;ibsw7:MQM8700/U1" lid 6 4xHDR\n',
+    ]
+    assert list(parse_ibnetdiscover(lines)) == [CaPort('0x155dfffd341acb', 'hpc-013 mlx5_ib0')]
+    # Same form as the ibstat and sysfs probes, see topo.normalize_guid
+    assert list(parse_ibnetdiscover(['Ca\t1 "H-0c42a10300001230"\t\t# "hpc-013 mlx5_ib0"\n', '[1](0c42a10300001234) \t"S-0098039b03000007"[1]\n'])) == [
+        CaPort('0xc42a10300001234', 'hpc-013 mlx5_ib0')]
+
+
+def test_parse_iblinkinfo():
+    lines = [
+        'CA: hpc-013 mlx5_ib0:\n',
+        '      0x00155dfffd341acb     100    1[  ] ==( 4X      53.125 Gbps Active/  LinkUp)==>       6    1[  ] "MF0;ibsw7:MQM8700/U1" ( )\n',
+        'Switch: 0x0098039b03000001 MF0;ibsw1:MQM8700/U1:\n',
+        '             1    1[  ] ==( 4X      53.125 Gbps Active/  LinkUp)==>      122    1[  ] "hpc-010 mlx5_ib6" ( )\n',
+    ]
+    assert list(parse_iblinkinfo(lines)) == [CaPort('0x155dfffd341acb', 'hpc-013 mlx5_ib0')]
+
+
+@pytest.mark.parametrize('dump', [IBNETDISCOVER, IBLINKINFO])
+def test_guids_from_fabric_dump(dump, caplog):
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, 'sharp_cmd')
+    ports = parse_fabric_dump(dump)
+    with caplog.at_level(logging.INFO):
+        guids = guids_from_ports(ports, ibtopo.hosts, ibtopo.ibdevice_pattern, resolve)
+
+    # Same map as collecting over SSH: the mlx5_an0 device of hpc-004 and ufm01 are left out
+    assert guids == MOCKED_GUID_TO_HOST_IP
+    assert list(dict.fromkeys(guids.values())) == [host for host in ibtopo.hosts if host in guids.values()]
+    assert 'not in the hosts file: ufm01' in caplog.text
+
+
+def test_guids_from_fabric_dump_missing_hosts(tmp_path, caplog):
+    hosts_file = tmp_path / 'hosts.txt'
+    hosts_file.write_text('hpc-013\nhpc-019.cluster\nhpc-099\n')
+    ibtopo = IBTopology(tmp_path, hosts_file, 'sharp_cmd')
+    with caplog.at_level(logging.ERROR):
+        guids = guids_from_ports(parse_fabric_dump(IBNETDISCOVER), ibtopo.hosts, ibtopo.ibdevice_pattern, resolve)
+
+    assert set(guids.values()) == {'hpc-013', 'hpc-019.cluster'}
+    assert len(guids) == 16
+    assert 'No GUIDs found in the fabric dump for 1 hosts: hpc-099' in caplog.text
+
+
+def test_match_hosts():
+    hosts = ['10.193.0.4', 'hpc-005.cluster', 'hpc-006']
+    matched = match_hosts(['hpc-004', 'hpc-005', 'hpc-006', 'ufm01'], hosts, resolve)
+    assert matched == {'hpc-004': '10.193.0.4', 'hpc-005': 'hpc-005.cluster', 'hpc-006': 'hpc-006'}
+
+
+def test_ibtopology_guids_from_fabric_dump(tmp_path, monkeypatch):
+    monkeypatch.setattr('socket.gethostbyname', resolve)
+    ibtopo = IBTopology(tmp_path, HOSTS_FILE, 'sharp_cmd')
+    ibtopo.guid_to_host_ip = ibtopo.guids_from_fabric_dump(IBLINKINFO)
+    ibtopo.write_guids_to_file(tmp_path / 'guids.txt')
+
+    assert ibtopo.guid_to_host_ip == MOCKED_GUID_TO_HOST_IP
+    assert sorted((tmp_path / 'guids.txt').read_text().split()) == sorted(MOCKED_GUID_TO_HOST_IP)
+
+
+def test_main_with_fabric_dump(tmp_path, monkeypatch):
+    # No SSH connection is opened
+    monkeypatch.setattr('fabric.Connection', None)
+    monkeypatch.setattr('socket.gethostbyname', resolve)
+    topo.main(config(tmp_path, guid_source='fabric_dump', fabric_dump=IBNETDISCOVER))
+
+    assert len(read_torsets(tmp_path / 'output')) == 12
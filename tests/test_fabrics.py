@@ -0,0 +1,103 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from ibtopo import IBTopology
+from ibtopo.fabrics import cli, load_manifest, run_fabrics
+from ibtopo.topo import read_torsets
+from conftest import fake_sharp_cmd
+
+TOPO_FILE = Path('tests/data/topology.txt').resolve()
+IBNETDISCOVER = Path('tests/data/ibnetdiscover.txt').resolve()
+
+
+def write_manifest(tmp_path, fabrics, defaults=None) -> Path:
+    manifest = tmp_path / 'fabrics.json'
+    manifest.write_text(json.dumps({'defaults': defaults or {}, 'fabrics': fabrics}))
+    return manifest
+
+
+def test_ibtopology_instances_do_not_share_state():
+    a = IBTopology(Path('tests/data'), Path('tests/data/hosts.txt'), 'sharp_cmd')
+    b = IBTopology(Path('tests/data'), Path('tests/data/hosts.txt'), 'sharp_cmd')
+    a.guid_to_host_ip['0x1'] = 'h1'
+    a.device_guids_per_switch['ibsw1'] = ['0x1']
+    a.torsets['torset-00'] = ['h1']
+
+    assert b.guid_to_host_ip == b.device_guids_per_switch == b.torsets == {}
+
+
+def test_load_manifest(tmp_path):
+    manifest = write_manifest(tmp_path, {
+        'a': {'hosts_file': 'a/hosts.txt', 'sharp_smx_ucx_interface': 'mlx5_ib1:1'},
+        'b': {'hosts_file': '/etc/b_hosts.txt', 'output_dir': '/tmp/b', 'parallel': 8},
+    }, defaults={'username': 'hpcadmin', 'sharp_cmd_path': 'bin/sharp_cmd', 'parallel': 64})
+    configs = load_manifest(manifest)
+
+    assert configs['a'].hosts_file == tmp_path / 'a' / 'hosts.txt'
+    assert configs['a'].output_dir == tmp_path / 'a'
+    assert configs['a'].sharp_smx_ucx_interface == 'mlx5_ib1:1'
+    assert configs['a'].sharp_cmd_path == tmp_path / 'bin' / 'sharp_cmd'
+    assert configs['a'].parallel == 64
+    assert configs['b'].hosts_file == Path('/etc/b_hosts.txt')
+    assert configs['b'].output_dir == Path('/tmp/b')
+    assert configs['b'].parallel == 8
+    assert configs['b'].ibdevice_pattern == 'mlx5_ib'
+    assert load_manifest(manifest, tmp_path / 'out')['a'].output_dir == tmp_path / 'out' / 'a'
+
+
+@pytest.mark.parametrize('fabrics, message', [
+    ({'a': {'hosts_file': 'hosts.txt', 'sharp_cmd': 'x'}}, 'Unknown settings for fabric a: sharp_cmd'),
+    ({'a': {'hosts_file': 'hosts.txt'}}, 'Invalid settings for fabric a'),
+    ({'a': {'output_dir': 'out'}, 'b': {'output_dir': 'out'}}, 'its own output directory'),
+])
+def test_load_manifest_errors(tmp_path, fabrics, message):
+    defaults = {'username': 'u', 'sharp_cmd_path': 'sharp_cmd', 'hosts_file': 'hosts.txt'} if 'output_dir' in fabrics['a'] else {}
+    with pytest.raises(ValueError, match=message):
+        load_manifest(write_manifest(tmp_path, fabrics, defaults))
+
+
+def test_run_fabrics_in_parallel(tmp_path):
+    # Fabric dumps instead of SSH, hosts are named like the node descriptions of the dump
+    hosts_file = tmp_path / 'hosts.txt'
+    hosts_file.write_text(''.join(f"hpc-{i:03}\n" for i in range(4, 20)))
+    # Records when it ran, next to the topology file
+    fake_sharp_cmd(tmp_path, f"""
+start = time.time()
+time.sleep(2)
+shutil.copyfile({str(TOPO_FILE)!r}, topology_file)
+open(os.path.join(os.path.dirname(topology_file), 'sharp_cmd.times'), 'w').write(f'{{start}} {{time.time()}}')
+""")
+    broken = tmp_path / 'broken'
+    broken.mkdir()
+    fake_sharp_cmd(broken, "sys.exit(1)")
+    defaults = {'hosts_file': 'hosts.txt', 'sharp_cmd_path': 'sharp_cmd', 'username': 'u', 'guid_source': 'fabric_dump',
+                'fabric_dump': str(IBNETDISCOVER), 'draw': False, 'hop_distances': False}
+    manifest = write_manifest(tmp_path, {'a': {}, 'b': {}, 'c': {'sharp_cmd_path': 'broken/sharp_cmd'}}, defaults)
+
+    results = run_fabrics(load_manifest(manifest))
+
+    assert results['a']['ok'] and results['b']['ok']
+    # The fabrics ran at the same time: sharp_cmd of one started before the other finished
+    (start_a, end_a), (start_b, end_b) = (map(float, (tmp_path / name / 'sharp_cmd.times').read_text().split()) for name in 'ab')
+    assert max(start_a, start_b) < min(end_a, end_b)
+    assert results['c'] == {**results['c'], 'ok': False, 'output_dir': str(tmp_path / 'c')}
+    assert 'exited with status 1' in results['c']['error']
+    for name in 'ab':
+        assert len(read_torsets(tmp_path / name)) == 12
+    assert not (tmp_path / 'c' / 'torsets.json').exists()
+
+
+def test_cli_creates_output_root(tmp_path, capsys):
+    hosts_file = tmp_path / 'hosts.txt'
+    hosts_file.write_text(''.join(f"hpc-{i:03}\n" for i in range(4, 20)))
+    fake_sharp_cmd(tmp_path, f"shutil.copyfile({str(TOPO_FILE)!r}, topology_file)")
+    defaults = {'hosts_file': 'hosts.txt', 'sharp_cmd_path': 'sharp_cmd', 'username': 'u', 'guid_source': 'fabric_dump',
+                'fabric_dump': str(IBNETDISCOVER), 'draw': False, 'hop_distances': False}
+    manifest = write_manifest(tmp_path, {'a': {}}, defaults)
+    output_root = tmp_path / 'new' / 'root'
+
+    cli([str(manifest), '--output_dir', str(output_root)])
+    assert capsys.readouterr().out.startswith('a: ok')
+    assert len(read_torsets(output_root / 'a')) == 12
@@ -0,0 +1,57 @@
+from pathlib import Path
+
+import pytest
+
+from ibtopo import IBTopology
+from ibtopo.graph import FabricGraph
+from ibtopo.topofile import TopologyRecord, parse_topology
+
+OUTPUT_DIR = Path('tests/data')
+HOSTS_FILE = Path('tests/data/hosts.txt')
+TOPO_FILE = Path('tests/data/topology.txt')
+
+
+def test_from_records_matches_networkx():
+    graph = FabricGraph.from_records(parse_topology(TOPO_FILE))
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, 'sharp_cmd')
+    nx_graph = ibtopo._populate_graph()
+
+    assert graph.number_of_nodes() == 241
+    assert graph.number_of_edges() == 240
+    converted = graph.to_networkx()
+    assert set(converted.nodes) == set(nx_graph.nodes)
+    assert {frozenset(edge) for edge in converted.edges} == {frozenset(edge) for edge in nx_graph.edges}
+    assert converted.nodes['0x155dfffd341941'] == {'type': 'node'}
+
+
+def test_queries():
+    records = [
+        TopologyRecord('leaf1', 'Nodes', ['0x1', '0x2']),
+        TopologyRecord('leaf2', 'Nodes', ['0x3']),
+        TopologyRecord('spine1', 'Switches', ['leaf1', 'leaf2']),
+        TopologyRecord('leaf1', 'Switches', ['spine1']),
+    ]
+    graph = FabricGraph.from_records(records)
+
+    leaf1, spine1 = graph.vertex('leaf1'), graph.vertex('spine1')
+    guid = graph.vertex('0x1')
+    assert graph.label(guid) == '0x1'
+    assert not graph.is_switch(guid)
+    # Link listed from both ends is stored once
+    assert graph.degree(leaf1) == 3
+    assert sorted(graph.label(v) for v in graph.neighbors(spine1)) == ['leaf1', 'leaf2']
+
+    distances = graph.bfs(guid)
+    assert distances[graph.vertex('0x3')] == 4
+    assert graph.bfs(leaf1, switches_only=True)[graph.vertex('0x2')] == -1
+    with pytest.raises(KeyError):
+        graph.vertex('0x4')
+
+
+def test_load_topology_compact():
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, 'sharp_cmd')
+    ibtopo.load_topology(compact=True)
+
+    assert isinstance(ibtopo.graph, FabricGraph)
+    assert ibtopo.graph.number_of_edges() == 240
+    assert len(ibtopo.device_guids_per_switch) == 96
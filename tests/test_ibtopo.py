@@ -1,8 +1,17 @@
+import logging
+import subprocess
+import sys
+import threading
+import time
 from pathlib import Path
 
+import fabric
 import pytest
 
 from ibtopo import IBTopology
+from ibtopo import topo
+from ibtopo.cache import GuidCache
+from conftest import MOCKED_GUID_TO_HOST_IP, fake_sharp_cmd
 
 OUTPUT_DIR = Path('tests/data')
 HOSTS_FILE = Path('tests/data/hosts.txt')
@@ -11,136 +20,6 @@ SHARP_CMD = 'sharp_cmd'
 NEW_GUIDS_FILE = 'tests/data/new_guids.txt'
 TOPO_FILE = 'tests/data/topology.txt'
 NEW_TOPO_FILE = 'tests/data/new_topology.txt'
-MOCKED_GUID_TO_HOST_IP = {
-    '0x155dfffd341acb': '10.193.0.13',
-    '0x155dfffd341acc': '10.193.0.13',
-    '0x155dfffd341acd': '10.193.0.13',
-    '0x155dfffd341ace': '10.193.0.13',
-    '0x155dfffd341acf': '10.193.0.13',
-    '0x155dfffd341ad0': '10.193.0.13',
-    '0x155dfffd341ad1': '10.193.0.13',
-    '0x155dfffd341ad2': '10.193.0.13',
-    '0x155dfffd341afb': '10.193.0.19',
-    '0x155dfffd341afc': '10.193.0.19',
-    '0x155dfffd341afd': '10.193.0.19',
-    '0x155dfffd341afe': '10.193.0.19',
-    '0x155dfffd341aff': '10.193.0.19',
-    '0x155dfffd341b00': '10.193.0.19',
-    '0x155dfffd341b01': '10.193.0.19',
-    '0x155dfffd341b02': '10.193.0.19',
-    '0x155dfffd34193b': '10.193.0.10',
-    '0x155dfffd34193c': '10.193.0.10',
-    '0x155dfffd34193d': '10.193.0.10',
-    '0x155dfffd34193e': '10.193.0.10',
-    '0x155dfffd34193f': '10.193.0.10',
-    '0x155dfffd341940': '10.193.0.10',
-    '0x155dfffd341941': '10.193.0.10',
-    '0x155dfffd341942': '10.193.0.10',
-    '0x155dfffd341b0b': '10.193.0.9',
-    '0x155dfffd341b0c': '10.193.0.9',
-    '0x155dfffd341b0d': '10.193.0.9',
-    '0x155dfffd341b0e': '10.193.0.9',
-    '0x155dfffd341b0f': '10.193.0.9',
-    '0x155dfffd341b10': '10.193.0.9',
-    '0x155dfffd341b11': '10.193.0.9',
-    '0x155dfffd341b12': '10.193.0.9',
-    '0x155dfffd34168b': '10.193.0.4',
-    '0x155dfffd34168c': '10.193.0.4',
-    '0x155dfffd34168d': '10.193.0.4',
-    '0x155dfffd34168e': '10.193.0.4',
-    '0x155dfffd34168f': '10.193.0.4',
-    '0x155dfffd341690': '10.193.0.4',
-    '0x155dfffd341691': '10.193.0.4',
-    '0x155dfffd341692': '10.193.0.4',
-    '0x155dfffd3416bb': '10.193.0.7',
-    '0x155dfffd3416bc': '10.193.0.7',
-    '0x155dfffd3416bd': '10.193.0.7',
-    '0x155dfffd3416be': '10.193.0.7',
-    '0x155dfffd3416bf': '10.193.0.7',
-    '0x155dfffd3416c0': '10.193.0.7',
-    '0x155dfffd3416c1': '10.193.0.7',
-    '0x155dfffd3416c2': '10.193.0.7',
-    '0x155dfffd341b23': '10.193.0.5',
-    '0x155dfffd341b24': '10.193.0.5',
-    '0x155dfffd341b25': '10.193.0.5',
-    '0x155dfffd341b26': '10.193.0.5',
-    '0x155dfffd341b27': '10.193.0.5',
-    '0x155dfffd341b28': '10.193.0.5',
-    '0x155dfffd341b29': '10.193.0.5',
-    '0x155dfffd341b2a': '10.193.0.5',
-    '0x155dfffd34136b': '10.193.0.18',
-    '0x155dfffd34136c': '10.193.0.18',
-    '0x155dfffd34136d': '10.193.0.18',
-    '0x155dfffd34136e': '10.193.0.18',
-    '0x155dfffd34136f': '10.193.0.18',
-    '0x155dfffd341370': '10.193.0.18',
-    '0x155dfffd341371': '10.193.0.18',
-    '0x155dfffd341372': '10.193.0.18',
-    '0x155dfffd34110b': '10.193.0.11',
-    '0x155dfffd34110c': '10.193.0.11',
-    '0x155dfffd34110d': '10.193.0.11',
-    '0x155dfffd34110e': '10.193.0.11',
-    '0x155dfffd34110f': '10.193.0.11',
-    '0x155dfffd341110': '10.193.0.11',
-    '0x155dfffd341111': '10.193.0.11',
-    '0x155dfffd341112': '10.193.0.11',
-    '0x155dfffd341b1b': '10.193.0.17',
-    '0x155dfffd341b1c': '10.193.0.17',
-    '0x155dfffd341b1d': '10.193.0.17',
-    '0x155dfffd341b1e': '10.193.0.17',
-    '0x155dfffd341b1f': '10.193.0.17',
-    '0x155dfffd341b20': '10.193.0.17',
-    '0x155dfffd341b21': '10.193.0.17',
-    '0x155dfffd341b22': '10.193.0.17',
-    '0x155dfffd341adb': '10.193.0.8',
-    '0x155dfffd341adc': '10.193.0.8',
-    '0x155dfffd341add': '10.193.0.8',
-    '0x155dfffd341ade': '10.193.0.8',
-    '0x155dfffd341adf': '10.193.0.8',
-    '0x155dfffd341ae0': '10.193.0.8',
-    '0x155dfffd341ae1': '10.193.0.8',
-    '0x155dfffd341ae2': '10.193.0.8',
-    '0x155dfffd341b03': '10.193.0.16',
-    '0x155dfffd341b04': '10.193.0.16',
-    '0x155dfffd341b05': '10.193.0.16',
-    '0x155dfffd341b06': '10.193.0.16',
-    '0x155dfffd341b07': '10.193.0.16',
-    '0x155dfffd341b08': '10.193.0.16',
-    '0x155dfffd341b09': '10.193.0.16',
-    '0x155dfffd341b0a': '10.193.0.16',
-    '0x155dfffd341a03': '10.193.0.15',
-    '0x155dfffd341a04': '10.193.0.15',
-    '0x155dfffd341a05': '10.193.0.15',
-    '0x155dfffd341a06': '10.193.0.15',
-    '0x155dfffd341a07': '10.193.0.15',
-    '0x155dfffd341a08': '10.193.0.15',
-    '0x155dfffd341a09': '10.193.0.15',
-    '0x155dfffd341a0a': '10.193.0.15',
-    '0x155dfffd341aeb': '10.193.0.12',
-    '0x155dfffd341aec': '10.193.0.12',
-    '0x155dfffd341aed': '10.193.0.12',
-    '0x155dfffd341aee': '10.193.0.12',
-    '0x155dfffd341aef': '10.193.0.12',
-    '0x155dfffd341af0': '10.193.0.12',
-    '0x155dfffd341af1': '10.193.0.12',
-    '0x155dfffd341af2': '10.193.0.12',
-    '0x155dfffd341abb': '10.193.0.6',
-    '0x155dfffd341abc': '10.193.0.6',
-    '0x155dfffd341abd': '10.193.0.6',
-    '0x155dfffd341abe': '10.193.0.6',
-    '0x155dfffd341abf': '10.193.0.6',
-    '0x155dfffd341ac0': '10.193.0.6',
-    '0x155dfffd341ac1': '10.193.0.6',
-    '0x155dfffd341ac2': '10.193.0.6',
-    '0x155dfffd341ad3': '10.193.0.14',
-    '0x155dfffd341ad4': '10.193.0.14',
-    '0x155dfffd341ad5': '10.193.0.14',
-    '0x155dfffd341ad6': '10.193.0.14',
-    '0x155dfffd341ad7': '10.193.0.14',
-    '0x155dfffd341ad8': '10.193.0.14',
-    '0x155dfffd341ad9': '10.193.0.14',
-    '0x155dfffd341ada': '10.193.0.14',
-}
 
 
 def test_ibtopology_init():
@@ -168,6 +47,261 @@ def test_fetch_guids(username, private_key):
     assert type(guids) is dict
 
 
+def mocked_fetch_guids(host, username, private_key, ibdevice_pattern, pool=None):
+    # Emulate ibstat output (leading 00 after 0x) with some SSH latency
+    time.sleep(0.05)
+    guids = [guid.replace('0x', '0x00') for guid, host_ip in MOCKED_GUID_TO_HOST_IP.items() if host_ip == host]
+    return {'stdout': '\n'.join(guids), 'stderr': '', 'return_code': 0}
+
+
+@pytest.mark.parametrize('parallel', [1, 8])
+def test_fetch_guids_mocked(parallel):
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, SHARP_CMD)
+    ibtopo._fetch_guids = mocked_fetch_guids
+    guids = ibtopo.fetch_guids('user', 'key', parallel=parallel)
+
+    assert guids == MOCKED_GUID_TO_HOST_IP
+    # Merged in hosts file order regardless of completion order
+    assert list(dict.fromkeys(guids.values())) == [h for h in ibtopo.hosts if h in guids.values()]
+
+
+@pytest.mark.parametrize('parallel', [1, 4, 16])
+def test_fetch_guids_parallel_scales_with_workers(parallel):
+    # Hosts queried at the same time, counted instead of timed so a loaded machine does not fail it
+    lock = threading.Lock()
+    active = [0]
+    peak = [0]
+
+    def counting_fetch_guids(host, username, private_key, ibdevice_pattern, pool=None):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        try:
+            return mocked_fetch_guids(host, username, private_key, ibdevice_pattern, pool)
+        finally:
+            with lock:
+                active[0] -= 1
+
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, SHARP_CMD)
+    ibtopo._fetch_guids = counting_fetch_guids
+    assert ibtopo.fetch_guids('user', 'key', parallel=parallel) == MOCKED_GUID_TO_HOST_IP
+    assert peak[0] <= parallel
+    assert peak[0] > 1 if parallel > 1 else peak[0] == 1
+
+
+def test_fetch_guids_reports_failed_hosts(caplog):
+    def failing_fetch_guids(host, username, private_key, ibdevice_pattern, pool=None):
+        if host == '10.193.0.4':
+            return {'stdout': '', 'stderr': 'ibstat: not found', 'return_code': 127}
+        return mocked_fetch_guids(host, username, private_key, ibdevice_pattern, pool)
+
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, SHARP_CMD)
+    ibtopo._fetch_guids = failing_fetch_guids
+    with caplog.at_level(logging.ERROR):
+        guids = ibtopo.fetch_guids('user', 'key', parallel=4)
+
+    assert '10.193.0.4' not in guids.values()
+    assert len(guids) == len(MOCKED_GUID_TO_HOST_IP) - 8
+    assert "Error fetching GUID for host 10.193.0.4" in caplog.text
+
+
+def test_fetch_guids_with_cache(tmp_path):
+    queried = []
+
+    def counting_fetch_guids(host, username, private_key, ibdevice_pattern, pool=None):
+        queried.append(host)
+        return mocked_fetch_guids(host, username, private_key, ibdevice_pattern, pool)
+
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, SHARP_CMD)
+    ibtopo._fetch_guids = counting_fetch_guids
+    cache = GuidCache(tmp_path / 'guid_cache.json')
+    ibtopo.guid_to_host_ip = ibtopo.fetch_guids('user', 'key', parallel=4, cache=cache)
+    ibtopo.write_guids_to_file(tmp_path / 'uncached_guids.txt')
+    assert ibtopo.guid_to_host_ip == MOCKED_GUID_TO_HOST_IP
+    assert len(queried) == 16
+
+    # Only the expired host is queried again, output is identical
+    queried.clear()
+    cache = GuidCache(tmp_path / 'guid_cache.json')
+    cache.entries['10.193.0.9']['timestamp'] = 0
+    ibtopo.guid_to_host_ip = ibtopo.fetch_guids('user', 'key', parallel=4, cache=cache)
+    assert queried == ['10.193.0.9']
+
+    ibtopo.write_guids_to_file(tmp_path / 'guids.txt')
+    assert (tmp_path / 'guids.txt').read_text() == (tmp_path / 'uncached_guids.txt').read_text()
+
+
+class FakeConnection:
+    opened = []
+
+    def __init__(self, host, user=None, connect_kwargs=None, connect_timeout=None):
+        self.host = host
+        self.closed = False
+        FakeConnection.opened.append(host)
+
+    def run(self, cmd, hide=True, warn=False, timeout=None):
+        class Result:
+            pass
+        result = Result()
+        if cmd.startswith('hostname'):
+            result.stdout = f"node-{self.host}\nState: Active\nPort GUID: 0x00155dfffd341acb\nState: Down\nPort GUID: 0x00155dfffd341acc\n"
+        else:
+            result.stdout = "0x00155dfffd341acb\n0x00155dfffd341acc\n"
+        result.stderr = ''
+        result.return_code = 0
+        return result
+
+    def close(self):
+        self.closed = True
+
+
+def test_connection_pool_reuses_sessions(monkeypatch):
+    monkeypatch.setattr(fabric, 'Connection', FakeConnection)
+    FakeConnection.opened = []
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, SHARP_CMD)
+    with topo.ConnectionPool('user', 'key') as pool:
+        ibtopo.fetch_guids('user', 'key', parallel=4, pool=pool)
+        probes = ibtopo.probe_hosts('user', 'key', parallel=4, pool=pool)
+
+    # One handshake per host, regardless of the number of commands run
+    assert sorted(FakeConnection.opened) == sorted(ibtopo.hosts)
+    assert probes['10.193.0.4']['hostname'] == 'node-10.193.0.4'
+
+
+def test_connection_pool_retries(unreliable):
+    unreliable.flaky = {'10.193.0.4'}
+    unreliable.hanging = {'10.193.0.5'}
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, SHARP_CMD)
+    start = time.perf_counter()
+    with topo.ConnectionPool('user', command_timeout=0.2, retries=2, backoff=0.05) as pool:
+        guids = ibtopo.fetch_guids('user', None, parallel=16, pool=pool)
+
+    # The flaky host answers on its second attempt, the hung one is given up after 3 x 0.2s + backoff
+    assert unreliable.attempts['10.193.0.4'] == 2
+    assert unreliable.attempts['10.193.0.5'] == 3
+    assert time.perf_counter() - start < 1.5
+    assert guids == {guid: host for guid, host in MOCKED_GUID_TO_HOST_IP.items() if host != '10.193.0.5'}
+    assert ibtopo.failed_hosts == {'10.193.0.5': {'reason': 'Error running command on host 10.193.0.5: Command did not complete within 0.2 seconds', 'unreachable': True}}
+
+
+def test_connection_pool_deadline(unreliable):
+    unreliable.hanging = set(MOCKED_GUID_TO_HOST_IP.values())
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, SHARP_CMD)
+    start = time.perf_counter()
+    with topo.ConnectionPool('user', command_timeout=60, retries=5, deadline=0.3) as pool:
+        guids = ibtopo.fetch_guids('user', None, parallel=4, pool=pool)
+
+    # Hosts not done by the deadline are unreachable, the sweep does not wait for each one's timeout
+    assert time.perf_counter() - start < 1.5
+    assert guids == {}
+    assert sorted(ibtopo.failed_hosts) == sorted(ibtopo.hosts)
+    assert 'discovery deadline exceeded' in ibtopo.failed_hosts['10.193.0.19']['reason']
+
+
+def test_parse_probe_output():
+    probe = topo.parse_probe_output("node01\nState: Active\nPort GUID: 0x00155dfffd341acb\nState: Down\nPort GUID: 0x00155dfffd341acc")
+
+    assert probe['hostname'] == 'node01'
+    assert probe['guids'] == ['0x155dfffd341acb', '0x155dfffd341acc']
+    assert probe['port_state'] == {'0x155dfffd341acb': 'Active', '0x155dfffd341acc': 'Down'}
+    assert IBTopology.guids_from_probes({'10.193.0.4': probe}) == {
+        '0x155dfffd341acb': '10.193.0.4',
+        '0x155dfffd341acc': '10.193.0.4',
+    }
+
+
+def test_normalize_guid():
+    assert topo.normalize_guid('0x00155dfffd341acb') == '0x155dfffd341acb'
+    assert topo.normalize_guid('00155dfffd341acb') == '0x155dfffd341acb'
+    assert topo.normalize_guid('0x0c42a10300001234') == '0xc42a10300001234'
+    assert topo.parse_probe_output("node01\nState: Active\nPort GUID: 0x0c42a10300001234")['guids'] == ['0xc42a10300001234']
+
+
+def fake_sysfs(root, ports) -> Path:
+    # /sys/class/infiniband like tree, ports[(device, port)] = (guid, state)
+    for (device, port), (guid, state) in ports.items():
+        port_dir = Path(root) / device / 'ports' / str(port)
+        (port_dir / 'gids').mkdir(parents=True)
+        value = f"{int(guid, 16):016x}"
+        (port_dir / 'gids' / '0').write_text('fe80:0000:0000:0000:' + ':'.join(value[i:i + 4] for i in range(0, 16, 4)) + '\n')
+        (port_dir / 'state').write_text(state + '\n')
+    return Path(root)
+
+
+class LocalConnection:
+    # Runs commands on this machine, so remote commands can be checked against a fake sysfs tree
+    commands = []
+
+    def __init__(self, host, user=None, connect_kwargs=None, connect_timeout=None):
+        pass
+
+    def run(self, cmd, hide=True, warn=False, timeout=None):
+        LocalConnection.commands.append(cmd)
+        process = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+
+        class Result:
+            stdout = process.stdout
+            stderr = process.stderr
+            return_code = process.returncode
+        return Result()
+
+    def close(self):
+        pass
+
+
+def test_parse_sysfs_probe():
+    probe = topo.parse_sysfs_probe(
+        "/proc/sys/kernel/hostname:node01\n"
+        "/sys/class/infiniband/mlx5_ib0/ports/1/gids/0:fe80:0000:0000:0000:0015:5dff:fd34:1acb\n"
+        "/sys/class/infiniband/mlx5_ib1/ports/1/gids/0:fe80:0000:0000:0000:0015:5dff:fd34:1acc\n"
+        "/sys/class/infiniband/mlx5_ib0/ports/1/state:4: ACTIVE\n"
+        "/sys/class/infiniband/mlx5_ib1/ports/1/state:1: DOWN\n"
+    )
+    assert probe == {
+        'hostname': 'node01',
+        'guids': ['0x155dfffd341acb', '0x155dfffd341acc'],
+        'port_state': {'0x155dfffd341acb': 'Active', '0x155dfffd341acc': 'Down'},
+    }
+
+
+def test_sysfs_probe(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(fabric, 'Connection', LocalConnection)
+    LocalConnection.commands = []
+    root = fake_sysfs(tmp_path / 'infiniband', {
+        ('mlx5_ib0', 1): ('0x00155dfffd341acb', '4: ACTIVE'),
+        ('mlx5_ib1', 1): ('0x00155dfffd341acc', '1: DOWN'),
+        # Not an InfiniBand device matching ibdevice_pattern
+        ('mlx5_an0', 1): ('0x00155dfffd341a00', '4: ACTIVE'),
+    })
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, SHARP_CMD, probe_mode='sysfs')
+    ibtopo.hosts = ['10.193.0.4']
+    ibtopo.sysfs_root = root
+    with caplog.at_level(logging.WARNING):
+        probes = ibtopo.probe_hosts('user', 'key')
+
+    assert probes['10.193.0.4']['guids'] == ['0x155dfffd341acb', '0x155dfffd341acc']
+    assert probes['10.193.0.4']['hostname'] == Path('/proc/sys/kernel/hostname').read_text().strip()
+    assert 'not Active: 0x155dfffd341acc' in caplog.text
+    assert ibtopo.fetch_guids('user', 'key') == {'0x155dfffd341acb': '10.193.0.4', '0x155dfffd341acc': '10.193.0.4'}
+    # One remote command per host and run
+    assert len(LocalConnection.commands) == 2
+
+    ibtopo.ibdevice_pattern = 'mlx4_ib'
+    with caplog.at_level(logging.ERROR):
+        assert ibtopo.fetch_guids('user', 'key') == {}
+    assert 'no mlx4_ib ports found' in caplog.text
+
+
+def test_probe_modes_agree_on_guids():
+    # Both modes key a port by the same GUID, also with a leading zero nibble
+    ibstat = topo.parse_probe_output("node01\nState: Active\nPort GUID: 0x0c42a10300001234")
+    sysfs = topo.parse_sysfs_probe(
+        "/sys/class/infiniband/mlx5_ib0/ports/1/gids/0:fe80:0000:0000:0000:0c42:a103:0000:1234\n"
+        "/sys/class/infiniband/mlx5_ib0/ports/1/state:4: ACTIVE\n"
+    )
+    assert ibstat['port_state'] == sysfs['port_state'] == {'0xc42a10300001234': 'Active'}
+
+
 def test_write_guids_to_file():
     ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, SHARP_CMD)
     ibtopo.guids_file = NEW_GUIDS_FILE
@@ -194,6 +328,91 @@ def test_create_topo_file():
         assert test_data == expected_data
 
 
+def test_create_topo_file_fake_sharp_cmd(tmp_path):
+    sharp_cmd = fake_sharp_cmd(tmp_path, f"""
+print(os.environ['SHARP_SMX_UCX_INTERFACE'], ' '.join(sys.argv[1:4]))
+shutil.copyfile({str(Path(TOPO_FILE).resolve())!r}, topology_file)
+""")
+    ibtopo = IBTopology(tmp_path, HOSTS_FILE, sharp_cmd, 'mlx5_ib0:1; exit 1')
+    ibtopo.create_topo_file()
+
+    assert ibtopo.topo_file.read_text() == Path(TOPO_FILE).read_text()
+    # Arguments are passed as is, without a shell
+    assert (tmp_path / 'sharp_cmd.log').read_text() == "mlx5_ib0:1; exit 1 topology --ib-dev mlx5_ib0:1; exit 1\n"
+    assert ibtopo.sharp_cmd_status['return_code'] == 0
+
+
+def test_create_topo_file_sharp_cmd_fails(tmp_path):
+    # The topology file of the previous run is kept
+    (tmp_path / 'topology.txt').write_text('previous\n')
+    ibtopo = IBTopology(tmp_path, HOSTS_FILE, fake_sharp_cmd(tmp_path, "open(topology_file, 'w').write('partial'); print('No SM found'); sys.exit(3)"))
+    with pytest.raises(topo.SharpCmdError, match='exited with status 3: No SM found'):
+        ibtopo.create_topo_file()
+    assert (tmp_path / 'topology.txt').read_text() == 'previous\n'
+    assert not (tmp_path / '.topology.txt.tmp').exists()
+
+    ibtopo = IBTopology(tmp_path, HOSTS_FILE, fake_sharp_cmd(tmp_path, "pass"))
+    with pytest.raises(topo.SharpCmdError, match='did not write'):
+        ibtopo.create_topo_file()
+    assert (tmp_path / 'topology.txt').read_text() == 'previous\n'
+
+
+def test_create_topo_file_timeout(tmp_path):
+    ibtopo = IBTopology(tmp_path, HOSTS_FILE, fake_sharp_cmd(tmp_path, "time.sleep(30)"))
+    start = time.perf_counter()
+    with pytest.raises(topo.SharpCmdError, match='did not finish within 0.2s'):
+        ibtopo.create_topo_file(timeout=0.2)
+    assert time.perf_counter() - start < 5
+    assert ibtopo.sharp_cmd_status['timed_out']
+
+
+def test_stream_topo_file(tmp_path):
+    # Writes half of the topology file, then the rest 0.5s later
+    sharp_cmd = fake_sharp_cmd(tmp_path, f"""
+lines = open({str(Path(TOPO_FILE).resolve())!r}).readlines()
+with open(topology_file, 'w') as f:
+    f.writelines(lines[:len(lines) // 2])
+    f.write(lines[len(lines) // 2][:10])
+    f.flush()
+    time.sleep(0.5)
+    f.write(lines[len(lines) // 2][10:])
+    f.writelines(lines[len(lines) // 2 + 1:])
+""")
+    ibtopo = IBTopology(tmp_path, HOSTS_FILE, sharp_cmd)
+    start = time.perf_counter()
+    arrivals = []
+
+    def timed(records):
+        for record in records:
+            arrivals.append(time.perf_counter() - start)
+            # topology.txt only appears once sharp_cmd is done
+            assert not ibtopo.topo_file.exists()
+            yield record
+
+    ibtopo.load_topology(records=timed(ibtopo.stream_topo_file(poll_interval=0.01)))
+
+    expected = IBTopology(OUTPUT_DIR, HOSTS_FILE, SHARP_CMD)
+    expected.load_topology()
+    assert ibtopo.device_guids_per_switch == expected.device_guids_per_switch
+    assert ibtopo.switch_links == expected.switch_links
+    assert len(ibtopo.graph.nodes) == 241
+    # The first half was parsed while sharp_cmd was still writing
+    assert arrivals[0] < 0.4 < arrivals[-1]
+
+
+def test_stream_topo_file_sharp_cmd_fails(tmp_path):
+    sharp_cmd = fake_sharp_cmd(tmp_path, "open(topology_file, 'w').write('SwitchName=ibsw1 Nodes=0x1\\n'); sys.exit(1)")
+    ibtopo = IBTopology(tmp_path, HOSTS_FILE, sharp_cmd)
+    with pytest.raises(topo.SharpCmdError, match='exited with status 1'):
+        ibtopo.load_topology(records=ibtopo.stream_topo_file())
+
+    ibtopo = IBTopology(tmp_path, HOSTS_FILE, fake_sharp_cmd(tmp_path, "time.sleep(30)"))
+    with pytest.raises(topo.SharpCmdError, match='did not finish'):
+        ibtopo.load_topology(records=ibtopo.stream_topo_file(timeout=0.2))
+    assert not ibtopo.topo_file.exists()
+    assert not (tmp_path / '.topology.txt.tmp').exists()
+
+
 def test_populate_device_guids_per_switch():
     ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, SHARP_CMD)
     ibtopo.device_guids_per_switch = ibtopo._populate_device_guids_per_switch()
@@ -212,6 +431,18 @@ def test_populate_graph():
     assert len(ibtopo.graph.edges) == 240
 
 
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_load_topology(use_mmap):
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, SHARP_CMD)
+    ibtopo.load_topology(use_mmap=use_mmap)
+
+    assert ibtopo.device_guids_per_switch == ibtopo._populate_device_guids_per_switch()
+    assert len(ibtopo.switch_links) == 17
+    assert ibtopo.switch_links['ibsw2'][:2] == ['ibsw55', 'ibsw57']
+    assert len(ibtopo.graph.nodes) == 241
+    assert len(ibtopo.graph.edges) == 240
+
+
 def test_identify_torsets():
     ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, SHARP_CMD)
     ibtopo.device_guids_per_switch = ibtopo._populate_device_guids_per_switch()
@@ -222,6 +453,26 @@ def test_identify_torsets():
     assert len(torset_nodes_map) == 16
 
 
+def test_identify_torsets_merges_switches_sharing_hosts():
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, SHARP_CMD)
+    ibtopo.guid_to_host_ip = {'0x1': 'h1', '0x2': 'h1', '0x3': 'h2', '0x4': 'h2', '0x5': 'h3', '0x6': 'h3', '0x7': 'h4'}
+    # h2 is attached to both ibsw1 (with h1) and ibsw2 (with h3), which makes them one torset
+    ibtopo.device_guids_per_switch = {'ibsw1': ['0x1', '0x3'], 'ibsw2': ['0x5'], 'ibsw3': ['0x7'], 'ibsw4': ['0x4', '0x6'], 'ibsw5': ['0x2']}
+    host_ip_to_torset = ibtopo.identify_torsets()
+
+    assert host_ip_to_torset == {'h1': 'torset-00', 'h2': 'torset-00', 'h3': 'torset-00', 'h4': 'torset-01'}
+    assert ibtopo.spanning_hosts == ['h1', 'h2', 'h3']
+
+
+def test_identify_torsets_no_spanning_hosts():
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, SHARP_CMD)
+    ibtopo.device_guids_per_switch = ibtopo._populate_device_guids_per_switch()
+    ibtopo.guid_to_host_ip = MOCKED_GUID_TO_HOST_IP
+    ibtopo.identify_torsets()
+
+    assert ibtopo.spanning_hosts == []
+
+
 def test_group_hosts_by_torset():
     ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, SHARP_CMD)
     ibtopo.device_guids_per_switch = ibtopo._populate_device_guids_per_switch()
@@ -258,3 +509,39 @@ def test_draw_topology():
     ibtopo.host_ip_to_torset = ibtopo.identify_torsets()
     ibtopo.torsets = ibtopo.group_hosts_by_torset()
     ibtopo.draw_topology()
+
+
+def test_draw_topology_aggregate(tmp_path):
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, SHARP_CMD)
+    ibtopo.output_dir = tmp_path
+    ibtopo.load_topology(compact=True)
+    ibtopo.guid_to_host_ip = MOCKED_GUID_TO_HOST_IP
+    ibtopo.host_ip_to_torset = ibtopo.identify_torsets()
+    ibtopo.torsets = ibtopo.group_hosts_by_torset()
+    ibtopo.draw_topology('aggregate')
+
+    assert (tmp_path / 'topology.png').exists()
+    assert (tmp_path / 'topology_layout_aggregate.json').exists()
+
+
+@pytest.mark.parametrize('fmt', ['dot', 'graphml'])
+def test_export_topology(tmp_path, fmt):
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, SHARP_CMD)
+    ibtopo.output_dir = tmp_path
+    ibtopo.load_topology()
+    ibtopo.guid_to_host_ip = MOCKED_GUID_TO_HOST_IP
+    ibtopo.host_ip_to_torset = ibtopo.identify_torsets()
+    path = ibtopo.export_topology(fmt, 'aggregate')
+
+    assert path == tmp_path / f'topology.{fmt}'
+    assert 'torset-11' in path.read_text()
+
+
+@pytest.mark.parametrize('code', [
+    'import ibtopo',
+    'from ibtopo.topofile import parse_topology; list(parse_topology("tests/data/topology.txt"))',
+])
+def test_import_does_not_load_heavy_dependencies(code):
+    check = "; import sys; print(sorted(m for m in ('fabric', 'matplotlib', 'networkx', 'numpy') if m in sys.modules))"
+    result = subprocess.run([sys.executable, '-c', code + check], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '[]'
@@ -0,0 +1,97 @@
+import json
+import pstats
+
+import fabric
+import pytest
+
+from ibtopo import topo
+from ibtopo.metrics import RunMetrics, latency_summary, percentile, reset_peak_rss
+from ibtopo.topo import read_torsets
+from conftest import SLOW_HOST, MockedConnection, config
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([3.0], 99) == 3.0
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile(range(101), 90) == 90
+
+
+def test_latency_summary():
+    latencies = {f'h{i}': float(i) for i in range(1, 21)}
+    summary = latency_summary(latencies, slowest=3)
+
+    assert summary['hosts'] == 20
+    assert summary['seconds']['max'] == 20.0
+    assert summary['seconds']['p50'] == 10.5
+    assert [entry['host'] for entry in summary['slowest']] == ['h20', 'h19', 'h18']
+    assert latency_summary({})['slowest'] == []
+
+
+def test_run_metrics_phase_recorded_on_error():
+    metrics = RunMetrics()
+    with pytest.raises(RuntimeError):
+        with metrics.phase('sharp_cmd'):
+            raise RuntimeError
+    assert metrics.phases['sharp_cmd']['seconds'] >= 0
+    assert metrics.phases['sharp_cmd']['peak_rss_bytes'] > 0
+
+
+@pytest.mark.skipif(not reset_peak_rss(), reason='peak RSS cannot be reset on this platform')
+def test_run_metrics_peak_rss_per_phase():
+    metrics = RunMetrics()
+    with metrics.phase('load_topology'):
+        data = b'x' * (128 * 1024 * 1024)
+        del data
+    with metrics.phase('identify_torsets'):
+        pass
+
+    # The peak of the first phase is not carried over into the next one
+    assert metrics.phases['load_topology']['peak_rss_bytes'] - metrics.phases['identify_torsets']['peak_rss_bytes'] > 64 * 1024 * 1024
+
+
+def test_main_writes_metrics(tmp_path, monkeypatch):
+    monkeypatch.setattr(fabric, 'Connection', MockedConnection)
+    topo.main(config(tmp_path))
+
+    metrics = json.loads((tmp_path / 'output' / 'metrics.json').read_text())
+    assert list(metrics['phases']) == ['collect_guids', 'write_guids', 'load_topology', 'identify_torsets', 'write_torsets', 'snapshot', 'hop_distances']
+    assert metrics['sharp_cmd']['return_code'] == 0
+    assert metrics['ssh']['hosts'] == 16
+    assert metrics['ssh']['slowest'][0]['host'] == SLOW_HOST
+    assert metrics['ssh']['seconds']['max'] >= 0.05
+    assert metrics['total_seconds'] >= sum(phase['seconds'] for phase in metrics['phases'].values())
+    assert len(read_torsets(tmp_path / 'output')) == 12
+    assert not list((tmp_path / 'output').glob('torset-*_hosts.txt'))
+    assert not (tmp_path / 'output' / 'profile.prof').exists()
+
+
+def test_main_without_streaming(tmp_path, monkeypatch):
+    monkeypatch.setattr(fabric, 'Connection', MockedConnection)
+    topo.main(config(tmp_path, stream_topology=False))
+
+    metrics = json.loads((tmp_path / 'output' / 'metrics.json').read_text())
+    assert list(metrics['phases'])[2:4] == ['sharp_cmd', 'load_topology']
+    assert metrics['sharp_cmd']['seconds'] <= metrics['phases']['sharp_cmd']['seconds']
+
+
+def test_main_profile(tmp_path, monkeypatch):
+    monkeypatch.setattr(fabric, 'Connection', MockedConnection)
+    topo.main(config(tmp_path, profile=True))
+
+    stats = pstats.Stats(str(tmp_path / 'output' / 'profile.prof'))
+    assert any(function == 'identify_torsets' for _, _, function in stats.stats)
+
+
+def test_main_unreachable_hosts(tmp_path, unreliable):
+    unreliable.hanging = {'10.193.0.13'}
+    with pytest.raises(topo.DiscoveryError, match='1 hosts could not be reached: 10.193.0.13'):
+        topo.main(config(tmp_path, command_timeout=0.1, retries=0, use_guid_cache=False))
+    report = json.loads((tmp_path / 'output' / 'failed_hosts.json').read_text())
+    assert list(report['hosts']) == ['10.193.0.13']
+    assert report['hosts']['10.193.0.13']['unreachable']
+
+    topo.main(config(tmp_path, command_timeout=0.1, retries=0, use_guid_cache=False, partial_results=True))
+    torsets = read_torsets(tmp_path / 'output').values()
+    assert sum(len(hosts) for hosts in torsets) == 15
+    assert not any('10.193.0.13' in hosts for hosts in torsets)
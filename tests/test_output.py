@@ -0,0 +1,78 @@
+import json
+
+import fabric
+import pytest
+
+from ibtopo import topo
+from ibtopo.output import atomic_open, read_torset_map, slurm_topology, write_torset_map
+from ibtopo.synthetic import fat_tree
+from ibtopo.topo import read_torsets, write_torsets
+from conftest import MockedConnection, config
+
+
+def test_atomic_open(tmp_path):
+    path = tmp_path / 'torsets.json'
+    with atomic_open(path) as f:
+        f.write('old')
+    with pytest.raises(RuntimeError):
+        with atomic_open(path) as f:
+            f.write('partial')
+            raise RuntimeError
+
+    assert path.read_text() == 'old'
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_read_torsets_prefers_torset_map(tmp_path):
+    assert read_torset_map(tmp_path) is None
+    write_torsets(tmp_path, {'torset-00': ['h1', 'h2']})
+    assert read_torsets(tmp_path) == {'torset-00': ['h1', 'h2']}
+
+    write_torset_map(tmp_path, {'torset-00': ['h1'], 'torset-01': ['h2']})
+    assert read_torsets(tmp_path) == {'torset-00': ['h1'], 'torset-01': ['h2']}
+    assert json.loads((tmp_path / 'torsets.json').read_text())['version'] == 1
+
+
+def test_slurm_topology():
+    device_guids_per_switch = {'leaf1': ['0x1', '0x2'], 'leaf2': ['0x3', '0x4'], 'leaf3': ['0x5'], 'leaf4': ['0x6']}
+    switch_links = {'spine1': ['leaf1', 'leaf2', 'leaf3'], 'spine2': ['leaf1', 'leaf2']}
+    guid_to_host_ip = {'0x1': 'h1', '0x2': 'h2', '0x3': 'h1', '0x4': 'h2', '0x5': 'h3', '0x6': 'h4'}
+    host_ip_to_torset = {'h1': 'torset-00', 'h2': 'torset-00', 'h3': 'torset-01', 'h4': 'torset-02'}
+
+    # leaf4 is not cabled to any spine, torset-02 stays on its own
+    assert slurm_topology(device_guids_per_switch, switch_links, guid_to_host_ip, host_ip_to_torset).splitlines() == [
+        'SwitchName=torset-00 Nodes=h1,h2',
+        'SwitchName=torset-01 Nodes=h3',
+        'SwitchName=torset-02 Nodes=h4',
+        'SwitchName=tier1-00 Switches=torset-00,torset-01',
+    ]
+
+
+def test_slurm_topology_fat_tree():
+    # 2 pods of 4 torsets: torsets of a pod share spines, pods share cores
+    fabric = fat_tree(64, guids_per_host=2, hosts_per_leaf=8, torsets_per_pod=4, spines_per_pod=2)
+    host_ip_to_torset = {host: f"torset-{i:02}" for i, hosts in enumerate(fabric.torsets) for host in hosts}
+    lines = slurm_topology(fabric.device_guids_per_switch, fabric.switch_links, fabric.guid_to_host_ip, host_ip_to_torset).splitlines()
+
+    assert len(lines) == 11
+    assert lines[0] == f"SwitchName=torset-00 Nodes={','.join(fabric.torsets[0])}"
+    assert lines[8:] == [
+        'SwitchName=tier1-00 Switches=torset-00,torset-01,torset-02,torset-03',
+        'SwitchName=tier1-01 Switches=torset-04,torset-05,torset-06,torset-07',
+        'SwitchName=tier2-00 Switches=tier1-00,tier1-01',
+    ]
+
+
+@pytest.mark.parametrize('torset_files', [False, True])
+def test_main_writes_torset_outputs(tmp_path, monkeypatch, torset_files):
+    monkeypatch.setattr(fabric, 'Connection', MockedConnection)
+    topo.main(config(tmp_path, torset_files=torset_files))
+    output_dir = tmp_path / 'output'
+
+    torsets = read_torsets(output_dir)
+    assert len(torsets) == 12
+    conf = (output_dir / 'topology.conf').read_text().splitlines()
+    assert conf[:12] == [f"SwitchName={torset} Nodes={','.join(hosts)}" for torset, hosts in torsets.items()]
+    assert conf[-1].startswith('SwitchName=tier')
+    assert len(list(output_dir.glob('torset-*_hosts.txt'))) == (12 if torset_files else 0)
+    assert not list(output_dir.glob('.*.tmp'))
@@ -0,0 +1,118 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from ibtopo import IBTopology
+from ibtopo.cache import GuidCache
+from ibtopo.distances import DistanceMatrix
+from ibtopo.placement import PlacementIndex, cli, index_from_output_dir, torset_hop_distances
+from ibtopo.synthetic import fat_tree
+from conftest import MOCKED_GUID_TO_HOST_IP
+
+OUTPUT_DIR = Path('tests/data')
+HOSTS_FILE = Path('tests/data/hosts.txt')
+
+
+def two_pod_index():
+    # pod A: torset-00 (4 hosts), torset-01 (2 hosts), pod B: torset-02 (3 hosts), torset-03 (4 hosts)
+    torsets = {
+        'torset-00': ['a0', 'a1', 'a2', 'a3'],
+        'torset-01': ['b0', 'b1'],
+        'torset-02': ['c0', 'c1', 'c2'],
+        'torset-03': ['d0', 'd1', 'd2', 'd3'],
+    }
+    guid_to_host_ip = {f'0x{i}': host for i, host in enumerate(host for hosts in torsets.values() for host in hosts)}
+    host_ip_to_torset = {host: torset for torset, hosts in torsets.items() for host in hosts}
+    device_guids_per_switch = {f'leaf{i}': [guid for guid, host in guid_to_host_ip.items() if host_ip_to_torset[host] == torset] for i, torset in enumerate(torsets)}
+    switch_links = {'spineA': ['leaf0', 'leaf1'], 'spineB': ['leaf2', 'leaf3'], 'core': ['spineA', 'spineB']}
+    distances = torset_hop_distances(device_guids_per_switch, switch_links, guid_to_host_ip, host_ip_to_torset)
+    return PlacementIndex(torsets, distances)
+
+
+def test_torset_hop_distances():
+    index = two_pod_index()
+    assert index.distance('torset-00', 'torset-01') == 2
+    assert index.distance('torset-00', 'torset-03') == 4
+    assert index.distance('torset-02', 'torset-02') == 0
+
+
+def test_place_single_torset_best_fit():
+    index = two_pod_index()
+    # Smallest torset that fits, keeping the 4 host torsets free
+    assert index.place(3) == ['c0', 'c1', 'c2']
+    assert index.place(2) == ['b0', 'b1']
+
+
+def test_place_fewest_torsets_then_fewest_hops():
+    index = two_pod_index()
+    # 6 hosts need two torsets, within a pod is 2 hops instead of 4
+    hosts = index.place(6)
+    assert len(hosts) == 6
+    assert {index.host_torset[host] for host in hosts} == {'torset-00', 'torset-01'}
+
+    hosts = index.place(7, free_hosts=['a0', 'a1', 'b0', 'c0', 'c1', 'c2', 'd0', 'd1', 'd2', 'd3'])
+    assert {index.host_torset[host] for host in hosts} == {'torset-02', 'torset-03'}
+
+
+def test_allocate_and_release():
+    index = two_pod_index()
+    index.allocate(index.place(4))
+    assert index.place(4) == ['d0', 'd1', 'd2', 'd3']
+    with pytest.raises(ValueError):
+        index.place(11)
+    index.release(['a0'])
+    assert len(index.place(10)) == 10
+
+
+def test_place_on_partly_free_torsets():
+    # Latency is measured by the place phase of benchmarks/bench_pipeline.py
+    torsets = {f'torset-{i:03}': [f'h{i}-{j}' for j in range(16)] for i in range(500)}
+    index = PlacementIndex(torsets)
+    free_hosts = [host for i, hosts in enumerate(torsets.values()) for host in hosts[i % 3:]]
+    hosts = index.place(100, free_hosts)
+    assert len(hosts) == 100
+    assert len({index.host_torset[host] for host in hosts}) == 7
+
+
+def test_place_on_fat_tree():
+    fabric = fat_tree(4096)
+    torsets = {f'torset-{i:03}': hosts for i, hosts in enumerate(fabric.torsets)}
+    host_ip_to_torset = {host: torset for torset, hosts in torsets.items() for host in hosts}
+    distances = torset_hop_distances(fabric.device_guids_per_switch, fabric.switch_links, fabric.guid_to_host_ip, host_ip_to_torset)
+    assert isinstance(distances, DistanceMatrix)
+    index = PlacementIndex(torsets, distances)
+
+    free_hosts = [host for i, hosts in enumerate(torsets.values()) for host in hosts[i % 5:]]
+    hosts = index.place(500, free_hosts)
+    assert len(hosts) == 500
+    # Fewest torsets: 32 of the torsets with all 16 hosts free
+    assert len({index.host_torset[host] for host in hosts}) == 32
+
+
+def test_cli(tmp_path, capsys):
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, 'sharp_cmd')
+    ibtopo.output_dir = tmp_path
+    ibtopo.load_topology()
+    ibtopo.guid_to_host_ip = MOCKED_GUID_TO_HOST_IP
+    ibtopo.host_ip_to_torset = ibtopo.identify_torsets()
+    ibtopo.torsets = ibtopo.group_hosts_by_torset()
+    ibtopo.write_hosts_by_torset()
+    shutil.copy(OUTPUT_DIR / 'topology.txt', tmp_path / 'topology.txt')
+
+    assert index_from_output_dir(tmp_path).distances == {}
+    cli([str(tmp_path), '3'])
+    hosts = capsys.readouterr().out.split()
+    assert len(hosts) == 3
+    assert len({ibtopo.host_ip_to_torset[host] for host in hosts}) == 2
+
+    cache = GuidCache(tmp_path / 'guid_cache.json')
+    for host in ibtopo.hosts:
+        cache.update(host, [guid for guid, host_ip in MOCKED_GUID_TO_HOST_IP.items() if host_ip == host])
+    cache.save()
+    index = index_from_output_dir(tmp_path)
+    assert index.distance('torset-00', 'torset-08') == 2
+    assert index.distance('torset-00', 'torset-11') == 4
+    torsets = {index.host_torset[host] for host in index.place(3)}
+    assert len(torsets) == 2
+    assert index.distance(*torsets) == 2
@@ -0,0 +1,55 @@
+
+import networkx as nx
+
+from ibtopo.render import aggregate_graph, cached_layout, write_dot
+
+
+def test_aggregate_graph():
+    device_guids_per_switch = {'leaf1': ['0x1', '0x2'], 'leaf2': ['0x3', '0x4'], 'leaf3': ['0x5']}
+    switch_links = {'spine1': ['leaf1', 'leaf2', 'leaf3'], 'spine2': ['leaf1', 'leaf2'], 'core1': ['spine1', 'spine2']}
+    guid_to_host_ip = {'0x1': 'h1', '0x2': 'h2', '0x3': 'h1', '0x4': 'h2', '0x5': 'h3'}
+    host_ip_to_torset = {'h1': 'torset-00', 'h2': 'torset-00', 'h3': 'torset-01'}
+    graph = aggregate_graph(device_guids_per_switch, switch_links, guid_to_host_ip, host_ip_to_torset)
+
+    assert dict(graph.nodes(data='tier')) == {'torset-00': 0, 'torset-01': 0, 'spine1': 1, 'spine2': 1, 'core1': 2}
+    assert graph.nodes['torset-00']['hosts'] == 2
+    assert {frozenset(edge) for edge in graph.edges} == {
+        frozenset({'torset-00', 'spine1'}),
+        frozenset({'torset-00', 'spine2'}),
+        frozenset({'torset-01', 'spine1'}),
+        frozenset({'core1', 'spine1'}),
+        frozenset({'core1', 'spine2'}),
+    }
+
+
+def test_cached_layout(tmp_path):
+    calls = []
+
+    def layout(graph):
+        calls.append(graph)
+        return nx.circular_layout(graph)
+
+    graph = nx.path_graph(['a', 'b', 'c'])
+    pos = cached_layout(graph, 'circular', layout, tmp_path / 'layout.json')
+    assert cached_layout(graph, 'circular', layout, tmp_path / 'layout.json') == {node: tuple(xy) for node, xy in pos.items()}
+    assert len(calls) == 1
+
+    # A different graph invalidates the cached layout
+    graph.add_edge('c', 'd')
+    cached_layout(graph, 'circular', layout, tmp_path / 'layout.json')
+    assert len(calls) == 2
+
+
+def test_write_dot(tmp_path):
+    graph = nx.Graph()
+    graph.add_node('torset-00', tier=0)
+    graph.add_edge('torset-00', 'ibsw2')
+    write_dot(graph, tmp_path / 'topology.dot')
+
+    assert (tmp_path / 'topology.dot').read_text() == (
+        'graph topology {\n'
+        '  "torset-00" [tier="0"];\n'
+        '  "ibsw2";\n'
+        '  "torset-00" -- "ibsw2";\n'
+        '}\n'
+    )
@@ -0,0 +1,82 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from ibtopo import IBTopology
+from ibtopo.snapshot import MAGIC
+from conftest import MOCKED_GUID_TO_HOST_IP
+
+OUTPUT_DIR = Path('tests/data')
+HOSTS_FILE = Path('tests/data/hosts.txt')
+
+
+def topology():
+    ibtopo = IBTopology(OUTPUT_DIR, HOSTS_FILE, 'sharp_cmd')
+    ibtopo.load_topology()
+    ibtopo.guid_to_host_ip = MOCKED_GUID_TO_HOST_IP
+    ibtopo.host_ip_to_torset = ibtopo.identify_torsets()
+    ibtopo.torsets = ibtopo.group_hosts_by_torset()
+    return ibtopo
+
+
+def test_snapshot_round_trip(tmp_path):
+    ibtopo = topology()
+    path = ibtopo.save_snapshot(tmp_path / 'topology.snapshot')
+    restored = IBTopology.from_snapshot(path)
+
+    assert restored.hosts == ibtopo.hosts
+    assert restored.hosts_file == HOSTS_FILE
+    assert restored.guid_to_host_ip == ibtopo.guid_to_host_ip
+    assert restored.device_guids_per_switch == ibtopo.device_guids_per_switch
+    assert restored.switch_links == ibtopo.switch_links
+    assert restored.host_ip_to_torset == ibtopo.host_ip_to_torset
+    assert restored.torsets == ibtopo.torsets
+    assert restored.spanning_hosts == ibtopo.spanning_hosts
+
+    # Torsets can be recomputed offline from the snapshot alone
+    assert restored.identify_torsets() == ibtopo.host_ip_to_torset
+    assert restored.group_hosts_by_torset() == ibtopo.torsets
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_snapshot_rebuilds_graph(tmp_path, compact):
+    path = topology().save_snapshot(tmp_path / 'topology.snapshot')
+    restored = IBTopology.from_snapshot(path, build_graph=True, compact=compact)
+
+    assert restored.graph.number_of_nodes() == 241
+    assert restored.graph.number_of_edges() == 240
+
+
+def test_snapshot_rejects_other_files(tmp_path):
+    path = tmp_path / 'topology.snapshot'
+    path.write_bytes(b'SwitchName=ibsw1 Nodes=0x1\n')
+    with pytest.raises(ValueError, match='not an ibtopo snapshot'):
+        IBTopology.from_snapshot(path)
+
+    path.write_bytes(MAGIC + (99).to_bytes(4, sys.byteorder) + (b'<' if sys.byteorder == 'little' else b'>') + bytes(4))
+    with pytest.raises(ValueError, match='Unsupported snapshot version 99'):
+        IBTopology.from_snapshot(path)
+
+
+def test_snapshot_normalizes_guids(tmp_path):
+    # ibstat form with a leading zero nibble, as in the 0c42a1 OUI
+    ibtopo = topology()
+    ibtopo.device_guids_per_switch = {'ibsw1': ['0x0c42a10300001234']}
+    ibtopo.switch_links = {}
+    ibtopo.guid_to_host_ip = {'0x0c42a10300001234': 'h1'}
+    ibtopo.host_ip_to_torset = ibtopo.identify_torsets()
+    restored = IBTopology.from_snapshot(ibtopo.save_snapshot(tmp_path / 'topology.snapshot'))
+
+    assert restored.guid_to_host_ip == {'0xc42a10300001234': 'h1'}
+    assert restored.device_guids_per_switch == {'ibsw1': ['0xc42a10300001234']}
+    assert restored.host_ip_to_torset == {'h1': 'torset-00'}
+
+
+def test_snapshot_load_does_not_import_graph_libraries(tmp_path):
+    path = topology().save_snapshot(tmp_path / 'topology.snapshot')
+    code = f"from ibtopo import IBTopology; IBTopology.from_snapshot({str(path)!r}).identify_torsets()"
+    check = "; import sys; print(sorted(m for m in ('fabric', 'matplotlib', 'networkx', 'numpy') if m in sys.modules))"
+    result = subprocess.run([sys.executable, '-c', code + check], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '[]'
@@ -0,0 +1,33 @@
+from ibtopo import IBTopology
+from ibtopo.cache import GuidCache
+from ibtopo.synthetic import fat_tree, write_fabric
+
+
+def test_fat_tree():
+    fabric = fat_tree(100, guids_per_host=8, hosts_per_leaf=16, torsets_per_pod=4, spines_per_pod=2)
+
+    assert len(fabric.hosts) == len(set(fabric.hosts)) == 100
+    assert len(fabric.guid_to_host_ip) == 800
+    # 7 torsets, the last one partially filled, with a leaf per rail
+    assert [len(hosts) for hosts in fabric.torsets] == [16] * 6 + [4]
+    assert len(fabric.device_guids_per_switch) == 56
+    # 2 pods of 2 spines per rail, each linked to the pod's leaves of its rail and to one core
+    assert len(fabric.switch_links) == 32
+    assert all(len(links) == 5 for links in list(fabric.switch_links.values())[:16])
+    assert all(guid == hex(int(guid, 16)) for guid in fabric.guid_to_host_ip)
+
+
+def test_write_fabric_round_trip(tmp_path):
+    fabric = fat_tree(64, guids_per_host=4, hosts_per_leaf=8, torsets_per_pod=2, spines_per_pod=2)
+    write_fabric(tmp_path, fabric, seed=1)
+
+    ibtopo = IBTopology(tmp_path, tmp_path / 'hosts.txt', 'sharp_cmd')
+    assert ibtopo.hosts == fabric.hosts
+    ibtopo.guid_to_host_ip = GuidCache(tmp_path / 'guid_cache.json').guid_to_host(ibtopo.hosts)
+    assert ibtopo.guid_to_host_ip == fabric.guid_to_host_ip
+
+    ibtopo.load_topology()
+    assert ibtopo.device_guids_per_switch == fabric.device_guids_per_switch
+    assert ibtopo.switch_links == fabric.switch_links
+    ibtopo.host_ip_to_torset = ibtopo.identify_torsets()
+    assert sorted(ibtopo.group_hosts_by_torset().values()) == sorted(fabric.torsets)
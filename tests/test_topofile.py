@@ -0,0 +1,66 @@
+import threading
+from pathlib import Path
+
+from ibtopo.topofile import TopologyRecord, follow_lines, parse_topology, parse_topology_lines
+
+TOPO_FILE = Path('tests/data/topology.txt')
+
+
+def test_parse_topology_lines():
+    lines = [
+        '# Topology file generated by sharp_cmd\n',
+        '\n',
+        'SwitchName=ibsw1 Nodes=0x155dfffd341941,0x155dfffd341ad9\n',
+        'SwitchName=ibsw2 Switches=ibsw55,ibsw57\n',
+        'SwitchName=ibsw3\n',
+    ]
+    assert list(parse_topology_lines(lines)) == [
+        TopologyRecord('ibsw1', 'Nodes', ['0x155dfffd341941', '0x155dfffd341ad9']),
+        TopologyRecord('ibsw2', 'Switches', ['ibsw55', 'ibsw57']),
+    ]
+
+
+def test_parse_topology():
+    records = list(parse_topology(TOPO_FILE))
+
+    assert len(records) == 113
+    assert sum(record.kind == 'Nodes' for record in records) == 96
+    assert sum(len(record.members) for record in records if record.kind == 'Nodes') == 128
+
+
+def test_parse_topology_mmap(tmp_path):
+    assert list(parse_topology(TOPO_FILE, use_mmap=True)) == list(parse_topology(TOPO_FILE))
+
+    (tmp_path / 'empty.txt').touch()
+    assert list(parse_topology(tmp_path / 'empty.txt', use_mmap=True)) == []
+
+
+def test_follow_lines(tmp_path):
+    path = tmp_path / 'topology.txt'
+    written = threading.Event()
+    done = threading.Event()
+    chunks = ['SwitchName=ibsw1 Nodes=0x1\nSwitchName=ibsw2 No', 'des=0x2\n', 'SwitchName=ibsw3 Nodes=0x3']
+
+    def writer():
+        # Creates the file after following started, and writes lines in pieces
+        with open(path, 'w') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                f.flush()
+                written.wait(0.2)
+                written.clear()
+        done.set()
+
+    lines = []
+    thread = threading.Thread(target=writer)
+    thread.start()
+    for line in follow_lines(path, done.is_set, poll_interval=0.01):
+        lines.append(line)
+        written.set()
+    thread.join()
+
+    assert lines == ['SwitchName=ibsw1 Nodes=0x1\n', 'SwitchName=ibsw2 Nodes=0x2\n', 'SwitchName=ibsw3 Nodes=0x3']
+
+
+def test_follow_lines_missing_file(tmp_path):
+    assert list(follow_lines(tmp_path / 'topology.txt', lambda: True)) == []